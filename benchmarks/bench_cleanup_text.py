@@ -0,0 +1,100 @@
+"""
+Compare typeset.py's cleanup_text with the backreference regexes it used
+to run, on a normal 500 KB chapter and on inputs that made those regexes
+slow: long runs of Chinese text with no punctuation (an index or 目录 whose
+lines were joined, a model stuck repeating itself), plus the repeats the
+cleanup exists for. Prints the time of each and whether the outputs match.
+They differ only on runs longer than 2 * typeset.MAX_REPEAT that repeat a
+word longer than MAX_REPEAT (the "loop run" rows): the old regex kept half
+of such a loop, the new dedupe keeps one word of at most MAX_REPEAT.
+
+    python benchmarks/bench_cleanup_text.py --chapter-kb 500 --run-chars 2000,10000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pdf-set", "scripts"))
+import typeset  # noqa: E402
+
+PHRASES = ("天下之事", "常成于困约", "而败于奢靡", "学者须先立志", "读书贵在有疑", "温故而知新", "君子务本")
+
+
+def old_cleanup(text):
+    """The cleanup_text typeset.py had before the linear dedupe."""
+    text = re.sub(r'([一-龥]{2,})\1+', r'\1', text)
+    text = re.sub(r'([一-龥])\1{2,}', r'\1\1', text)
+    text = re.sub(r'(\b\w+\b)\1+', r'\1', text)
+
+    def clean_footnote(match):
+        return "".join(line.strip() for line in match.group(0).splitlines())
+
+    return re.compile(r'<sup>.*?</sup>', re.DOTALL).sub(clean_footnote, text)
+
+
+def chapter(size, rng):
+    """
+    Indented paragraphs of about size characters, with OCR-style doubled
+    words, tripled characters and footnotes.
+    """
+    paragraphs = []
+    total = 0
+    while total < size:
+        words = [rng.choice(PHRASES) for _ in range(rng.randint(4, 12))]
+        if rng.random() < 0.2:
+            words[0] *= 2
+        if rng.random() < 0.1:
+            words[-1] += words[-1][-1] * 2
+        paragraph = "  " + "，".join(words) + "。"
+        if rng.random() < 0.1:
+            paragraph += "<sup>1\n注释</sup>"
+        paragraphs.append(paragraph)
+        total += len(paragraph)
+    return "\n\n".join(paragraphs)
+
+
+def cases(args):
+    rng = random.Random(args.seed)
+    hanzi = [chr(c) for c in range(0x4e00, 0x4e00 + 3000)]
+    yield f"chapter {args.chapter_kb} KB", chapter(args.chapter_kb * 1024 // 3, rng)
+    yield f"目录 {args.chapter_kb} KB", "\n".join(
+        f"{rng.choice(PHRASES)}{rng.choice(PHRASES)} {rng.randint(1, 400)}" for _ in range(args.chapter_kb * 1024 // 30)
+    )
+    for n in args.run_chars:
+        yield f"random run {n}", "".join(rng.choice(hanzi) for _ in range(n))
+        yield f"phrase run {n}", "".join(rng.choice(PHRASES) for _ in range(n // 4))[:n]
+        yield f"loop run {n}", ("学者须先立志读书贵在有疑" * n)[:n]
+        yield f"one char {n}", "的" * n
+
+
+def measure(fn, text):
+    started = time.perf_counter()
+    result = fn(text)
+    return time.perf_counter() - started, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark typeset.cleanup_text against the old regexes.")
+    parser.add_argument("--chapter-kb", type=int, default=500, help="Size of the normal and 目录 chapters.")
+    parser.add_argument(
+        "--run-chars",
+        default="2000,10000",
+        help="Comma-separated lengths of the unpunctuated runs (the old regexes grow with the square of these).",
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    args.run_chars = [int(n) for n in args.run_chars.split(",") if n.strip()]
+
+    print(f"{'input':<20} {'old':>9} {'new':>9} {'speedup':>8}  same")
+    for label, text in cases(args):
+        old_time, old_result = measure(old_cleanup, text)
+        new_time, new_result = measure(typeset.cleanup_text, text)
+        speedup = old_time / new_time if new_time else float("inf")
+        print(f"{label:<20} {old_time:>8.3f}s {new_time:>8.3f}s {speedup:>7.1f}x  {old_result == new_result}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Compare per-image latency of a cold `ocr.py --input-file` run with the same
+image sent to a warm `ocr.py --serve` daemon, both through ocr_client.py and
+over its socket directly.
+
+The GenAI endpoint is mock_genai_server.py answering after a fixed delay, so
+the difference is start-up cost: importing google.genai, parsing secrets.txt,
+building clients and opening connections. The scripts run from a temporary
+copy with their own secrets.txt, so the real one is never read.
+
+    python benchmarks/bench_daemon.py --images 10 --latency 0.2
+"""
+import argparse
+import glob
+import io
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from mock_genai_server import secrets_text, start_server
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(__file__), "..", "pdf-set", "scripts")
+
+
+def prepare_workdir(workdir, endpoint, images):
+    scripts = os.path.join(workdir, "scripts")
+    os.makedirs(scripts)
+    for path in glob.glob(os.path.join(SCRIPTS_DIR, "*.py")) + [os.path.join(SCRIPTS_DIR, "ocr_prompt.md")]:
+        shutil.copy(path, scripts)
+    with open(os.path.join(scripts, "secrets.txt"), "w", encoding="utf-8") as f:
+        f.write(secrets_text(endpoint))
+    image_dir = os.path.join(workdir, "images")
+    os.makedirs(image_dir)
+    paths = []
+    for i in range(images):
+        image = Image.new("L", (800, 1100), 235)
+        ImageDraw.Draw(image).text((80, 80), f"page {i}", fill=20)
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=80)
+        path = os.path.join(image_dir, f"{i}.jpg")
+        with open(path, "wb") as f:
+            f.write(buf.getvalue())
+        paths.append(path)
+    return scripts, paths
+
+
+def _timed_run(cmd):
+    started = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def _report(label, times):
+    print(
+        f"{label:<22} mean {statistics.mean(times):6.3f}s  p50 {statistics.median(times):6.3f}s  "
+        f"max {max(times):6.3f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold ocr.py runs against the OCR daemon.")
+    parser.add_argument("--images", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="Mock API latency in seconds.")
+    args = parser.parse_args()
+
+    server = start_server(latency=args.latency, jitter=0.0)
+    endpoint = server.base_url
+    workdir = tempfile.mkdtemp(prefix="bench-daemon-")
+    daemon = None
+    try:
+        scripts, images = prepare_workdir(workdir, endpoint, args.images)
+        ocr_py = os.path.join(scripts, "ocr.py")
+        client_py = os.path.join(scripts, "ocr_client.py")
+        out_dir = os.path.join(workdir, "ocr-result")
+        daemon_file = os.path.join(workdir, "ocr-daemon.json")
+        common = ["--no-cache", "--no-quota", "--output-dir", out_dir]
+
+        cold = [_timed_run([sys.executable, ocr_py, "--input-file", path] + common) for path in images]
+
+        daemon = subprocess.Popen(
+            [sys.executable, ocr_py, "--serve", "--daemon-file", daemon_file, "--no-prompt-cache"] + common,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        while not os.path.isfile(daemon_file):
+            if daemon.poll() is not None:
+                raise RuntimeError("OCR daemon exited during start-up")
+            time.sleep(0.05)
+        client_cli = [
+            _timed_run([sys.executable, client_py, path, "--output-dir", out_dir, "--daemon-file", daemon_file])
+            for path in images
+        ]
+
+        sys.path.insert(0, scripts)
+        import ocr_client
+
+        info = ocr_client.load_daemon_info(daemon_file)
+        direct = []
+        for path in images:
+            started = time.perf_counter()
+            results = list(ocr_client.ocr_images(info, [path], out_dir))
+            direct.append(time.perf_counter() - started)
+            assert results[0]["state"] == "done", results
+        list(ocr_client.send_request(info, {"cmd": "shutdown"}))
+        daemon.wait(timeout=10)
+        daemon = None
+    finally:
+        if daemon is not None:
+            daemon.kill()
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{args.images} images, mock API latency {args.latency:.2f}s")
+    _report("cold ocr.py", cold)
+    _report("daemon via client CLI", client_cli)
+    _report("daemon via socket", direct)
+    print(f"Per-image saving: {statistics.mean(cold) - statistics.mean(direct):.3f}s")
+
+
+if __name__ == "__main__":
+    main()
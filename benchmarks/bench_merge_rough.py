@@ -0,0 +1,116 @@
+"""
+Compare the old in-memory rough merge with the streaming merge in
+pdf-set/scripts/merge_rough.py on a large synthetic book: wall time, peak
+Python memory (tracemalloc) and whether the two 0.rough.md files are
+byte-identical.
+
+    python benchmarks/bench_merge_rough.py --pages 1000 --chars 2000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pdf-set", "scripts"))
+import merge_rough  # noqa: E402
+
+PHRASES = ("天下之事", "常成于困约", "而败于奢靡", "学者须先立志", "读书贵在有疑", "温故而知新", "君子务本")
+
+
+def write_book(input_dir, pages, chars, seed):
+    """
+    Pages with a running head repeated on every page, a chapter heading
+    every 20 pages, paragraphs and stray blank lines.
+    """
+    rng = random.Random(seed)
+    os.makedirs(input_dir)
+    for idx in range(pages):
+        lines = [f"## 第{idx // 20 + 1}章", ""]
+        if idx % 20 == 0:
+            lines += [f"# 第{idx // 20 + 1}章 正文", ""]
+        size = 0
+        while size < chars:
+            line = "  " + "，".join(rng.choice(PHRASES) for _ in range(rng.randint(4, 12))) + "。"
+            lines.append(line)
+            size += len(line)
+            if rng.random() < 0.2:
+                lines += ["", ""]
+        with open(os.path.join(input_dir, f"{idx}.md"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+
+
+def old_merge(input_dir, output_file):
+    """The merge merge_rough.py did before it streamed."""
+    md_files = [f for f in os.listdir(input_dir) if f.endswith('.md')]
+    md_files.sort(key=merge_rough.get_natural_sort_key)
+    all_content = []
+    for filename in md_files:
+        with open(os.path.join(input_dir, filename), 'r', encoding='utf-8') as f:
+            content = f.read().strip()
+            if content:
+                all_content.append(content)
+    lines = "\n\n".join(all_content).splitlines()
+    seen_titles = set()
+    out_lines = []
+    heading_re = re.compile(r'^\s*(#{1,6})\s+(.+?)\s*$')
+    for line in lines:
+        m = heading_re.match(line)
+        if m:
+            title = m.group(2).strip()
+            if title in seen_titles:
+                if out_lines and out_lines[-1].strip() != "":
+                    out_lines.append("")
+                continue
+            seen_titles.add(title)
+        out_lines.append(line)
+    cleaned = []
+    prev_blank = False
+    for line in out_lines:
+        is_blank = (line.strip() == "")
+        if is_blank:
+            if not prev_blank:
+                cleaned.append("")
+            prev_blank = True
+        else:
+            cleaned.append(line)
+            prev_blank = False
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("\n".join(cleaned).strip() + "\n")
+
+
+def measure(label, fn, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn(*args)
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {elapsed:7.2f}s  peak {peak / 1048576:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rough merge on a synthetic book.")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--chars", type=int, default=2000, help="Characters per page.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench-merge-") as tmp:
+        input_dir = os.path.join(tmp, "ocr-result")
+        write_book(input_dir, args.pages, args.chars, args.seed)
+        old_file = os.path.join(tmp, "old.rough.md")
+        new_file = os.path.join(tmp, "new.rough.md")
+        size = sum(os.path.getsize(os.path.join(input_dir, name)) for name in os.listdir(input_dir))
+        print(f"{args.pages} pages, {size / 1048576:.1f} MB of Markdown")
+        measure("in-memory", old_merge, input_dir, old_file)
+        measure("streaming", merge_rough.merge_ocr_results, input_dir, tmp, new_file)
+        with open(old_file, "rb") as a, open(new_file, "rb") as b:
+            print(f"Byte-identical: {a.read() == b.read()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""
+Measure ocr.py's OCR stage end to end against the local mock GenAI server:
+process_images runs unchanged over real HTTP, once per concurrency setting,
+and each run reports pages/sec, per-page latency percentiles and how many
+calls were throttled, failed or retried.
+
+Nothing leaves the machine and the real secrets.txt is never read, so every
+scheduler or retry change can be measured the same way, e.g.
+
+    python benchmarks/bench_ocr.py --pages 120 --concurrency 1,3,8 --latency 0.3 --rate-429 0.02 --rate-5xx 0.02
+    python benchmarks/bench_ocr.py --pages 200 --concurrency 8 --tail-prob 0.03 --hedge 0.05
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageDraw
+
+from mock_genai_server import add_arguments, secrets_text, settings_from_args, start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pdf-set", "scripts"))
+import ocr  # noqa: E402
+
+
+def write_images(images_dir, pages):
+    os.makedirs(images_dir)
+    for idx in range(1, pages + 1):
+        image = Image.new("L", (400, 560), 235)
+        ImageDraw.Draw(image).text((40, 40), f"page {idx}", fill=20)
+        image.save(os.path.join(images_dir, f"{idx}.jpg"), format="JPEG", quality=80)
+
+
+def run_once(server, secrets_path, images_dir, output_dir, concurrency, args):
+    """
+    One process_images run with a fresh client pool, limiter and stats.
+    Returns the row of the report.
+    """
+    server.reset_stats()
+    ocr.init_client(secrets_path)
+    ocr.configure_limiter(concurrency, args.max_concurrency or concurrency)
+    ocr.configure_quota(None)
+    ocr.configure_cache(None, 0)
+    ocr.configure_packing(args.pages_per_request)
+    ocr.configure_streaming(not args.no_stream)
+    ocr.configure_timeout(args.request_timeout)
+    ocr.configure_hedging(args.hedge)
+    if ocr.hedger is not None:
+        ocr.hedger.min_delay = args.hedge_min_delay
+    ocr.request_stats = ocr.RequestStats()
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) as log:
+        ocr.process_images(images_dir, output_dir, "基准测试用 prompt。", batch_size=concurrency)
+    elapsed = time.perf_counter() - started
+    if args.verbose:
+        print(log.getvalue())
+
+    counts = {}
+    for key in ocr.client_pool.keys:
+        for outcome, count in key.limiter.counts.items():
+            counts[outcome] = counts.get(outcome, 0) + count
+    latencies = sorted(ocr.request_stats.page_latencies)
+    failed = sum(count for outcome, count in counts.items() if outcome not in ("ok", "cancelled"))
+    return {
+        "concurrency": concurrency,
+        "pages": len(latencies),
+        "seconds": elapsed,
+        "pages_per_sec": len(latencies) / elapsed if elapsed else 0.0,
+        "p50": ocr._percentile(latencies, 0.5) if latencies else 0.0,
+        "p95": ocr._percentile(latencies, 0.95) if latencies else 0.0,
+        "p99": ocr._percentile(latencies, 0.99) if latencies else 0.0,
+        "requests": server.stats.get("requests", 0),
+        "throttled": counts.get("throttled", 0),
+        "errors": failed - counts.get("throttled", 0),
+        "retries": failed,
+        "continuations": ocr.request_stats.continuations,
+        "hedges": ocr.request_stats.hedges,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ocr.py process_images against a mock GenAI server.")
+    parser.add_argument("--pages", type=int, default=60)
+    parser.add_argument("--concurrency", default="1,3,8", help="Comma-separated batch sizes to compare.")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Limiter ceiling (default: the batch size).")
+    parser.add_argument("--keys", type=int, default=1, help="API keys (credential blocks) in the generated secrets.txt.")
+    parser.add_argument("--pages-per-request", type=int, default=1)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--hedge", type=float, default=0.0)
+    parser.add_argument("--hedge-min-delay", type=float, default=ocr.HEDGE_MIN_DELAY)
+    parser.add_argument("--verbose", action="store_true", help="Show ocr.py's own output.")
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = start_server(**settings_from_args(args))
+    rows = []
+    try:
+        with tempfile.TemporaryDirectory(prefix="bench-ocr-") as tmp:
+            secrets_path = os.path.join(tmp, "secrets.txt")
+            with open(secrets_path, "w", encoding="utf-8") as f:
+                f.write(secrets_text(server.base_url, args.keys))
+            images_dir = os.path.join(tmp, "images")
+            write_images(images_dir, args.pages)
+            for concurrency in [int(c) for c in args.concurrency.split(",") if c.strip()]:
+                output_dir = os.path.join(tmp, f"ocr-result-{concurrency}")
+                rows.append(run_once(server, secrets_path, images_dir, output_dir, concurrency, args))
+    finally:
+        server.shutdown()
+
+    print(
+        f"{args.pages} pages, mock latency {args.latency:.2f}s (jitter {args.jitter}, tail {args.tail_prob:.0%} x{args.tail_factor:g}), "
+        f"429 {args.rate_429:.0%}, 5xx {args.rate_5xx:.0%}, {args.keys} key(s)"
+    )
+    print(
+        f"{'conc':>4} {'pages/s':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'requests':>8} "
+        f"{'429':>5} {'errors':>6} {'retries':>7} {'cont':>5} {'hedged':>6}"
+    )
+    for row in rows:
+        print(
+            f"{row['concurrency']:>4} {row['pages_per_sec']:>8.2f} {row['p50']:>6.2f}s {row['p95']:>6.2f}s "
+            f"{row['p99']:>6.2f}s {row['requests']:>8} {row['throttled']:>5} {row['errors']:>6} "
+            f"{row['retries']:>7} {row['continuations']:>5} {row['hedges']:>6}"
+        )
+
+
+if __name__ == "__main__":
+    main()
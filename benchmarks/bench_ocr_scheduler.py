@@ -0,0 +1,92 @@
+"""
+Compare the old batch-barrier OCR scheduler with the sliding-window scheduler
+in pdf-set/scripts/ocr.py.
+
+The API call is replaced by a sleep drawn from a heavy-tailed latency
+distribution, so the benchmark needs neither network access nor secrets.txt.
+
+    python benchmarks/bench_ocr_scheduler.py --pages 450 --batch-size 3
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pdf-set", "scripts"))
+import ocr  # noqa: E402
+
+
+def build_latencies(pages, median, tail_prob, tail_factor, seed):
+    rng = random.Random(seed)
+    latencies = {}
+    for idx in range(pages):
+        latency = median * rng.lognormvariate(0.0, 0.35)
+        if rng.random() < tail_prob:
+            latency *= tail_factor
+        latencies[idx] = latency
+    return latencies
+
+
+def make_fake_api(latencies):
+    def _fake(image_path, page_num, prompt_text, image_bytes=None, mime_type=None, partial_path=None, first_tier=0):
+        idx = int(os.path.splitext(os.path.basename(image_path))[0])
+        time.sleep(latencies[idx])
+        return f"page {idx}"
+    return _fake
+
+
+def batch_barrier(image_files, output_dir, batch_size, fake_api):
+    """The scheduler process_images used before the sliding window."""
+    items = list(enumerate(image_files, start=1))
+    for i in range(0, len(items), batch_size):
+        batch = items[i:i + batch_size]
+        with ThreadPoolExecutor(max_workers=batch_size) as executor:
+            futures = [executor.submit(fake_api, path, idx, "") for idx, path in batch]
+            for future in as_completed(futures):
+                future.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OCR page scheduling.")
+    parser.add_argument("--pages", type=int, default=450)
+    parser.add_argument("--batch-size", type=int, default=3)
+    parser.add_argument("--median", type=float, default=0.02, help="Median simulated latency in seconds.")
+    parser.add_argument("--tail-prob", type=float, default=0.05, help="Probability of a slow page.")
+    parser.add_argument("--tail-factor", type=float, default=10.0, help="Slow page latency multiplier.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    latencies = build_latencies(args.pages, args.median, args.tail_prob, args.tail_factor, args.seed)
+    fake_api = make_fake_api(latencies)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        images_dir = os.path.join(tmp, "images")
+        os.makedirs(images_dir)
+        for idx in range(args.pages):
+            with open(os.path.join(images_dir, f"{idx}.jpg"), "wb") as f:
+                f.write(b"\xff\xd8\xff")
+        image_files = [os.path.join(images_dir, f"{idx}.jpg") for idx in range(args.pages)]
+
+        start = time.perf_counter()
+        batch_barrier(image_files, os.path.join(tmp, "out-batch"), args.batch_size, fake_api)
+        batch_elapsed = time.perf_counter() - start
+
+        ocr.extract_text_from_gemini_api = fake_api
+        ocr.configure_limiter(args.batch_size, args.batch_size)
+        start = time.perf_counter()
+        ocr.process_images(images_dir, os.path.join(tmp, "out-window"), "", batch_size=args.batch_size)
+        window_elapsed = time.perf_counter() - start
+
+    ideal = sum(latencies.values()) / args.batch_size
+    print(f"Pages: {args.pages}  batch size: {args.batch_size}  ideal: {ideal:.2f}s")
+    for name, elapsed in (("batch barrier", batch_elapsed), ("sliding window", window_elapsed)):
+        ppm = args.pages / elapsed * 60
+        print(f"{name:>15}: {elapsed:7.2f}s  {ppm:9.1f} pages/min")
+    print(f"Speedup: {batch_elapsed / window_elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Compare serial and multi-process rendering in
+pdf-set/scripts/convert_pdf_to_images.py on a synthetic scanned PDF.
+
+Each page of the generated PDF is a single grey-noise JPEG, similar in
+render cost to a real scan.
+
+    python benchmarks/bench_render.py --pages 500 --workers 1 4 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+import pypdfium2 as pdfium
+from PIL import Image, ImageDraw, ImageFilter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pdf-set", "scripts"))
+import convert_pdf_to_images  # noqa: E402
+
+
+def make_scanned_pdf(path, pages, seed, variants=8):
+    """
+    Build a PDF whose pages each hold one full-page JPEG, like a scanner's output.
+    A few distinct page images are reused to keep generation fast and small.
+    """
+    rng = random.Random(seed)
+    base = Image.effect_noise((1240, 1754), 12).convert("L")
+    base = base.filter(ImageFilter.GaussianBlur(1)).point(lambda v: 200 + v // 5)
+    jpegs = []
+    for i in range(variants):
+        image = base.copy()
+        draw = ImageDraw.Draw(image)
+        for y in range(120, 1650, 36):
+            draw.text((110 + rng.randint(0, 20), y), f"{i:04d} " + "scanned text " * 8, fill=30)
+        buf = io.BytesIO()
+        image.save(buf, format="JPEG", quality=80)
+        jpegs.append(buf.getvalue())
+
+    pdf = pdfium.PdfDocument.new()
+    width, height = 595, 842
+    for i in range(pages):
+        page = pdf.new_page(width, height)
+        image = pdfium.PdfImage.new(pdf)
+        image.load_jpeg(io.BytesIO(jpegs[i % variants]), inline=True)
+        image.set_matrix(pdfium.PdfMatrix().scale(width, height))
+        page.insert_obj(image)
+        page.gen_content()
+        page.close()
+    pdf.save(path)
+    pdf.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PDF page rendering.")
+    parser.add_argument("--pages", type=int, default=500)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument("--dpi", type=int, default=144)
+    parser.add_argument("--pdf", default=None, help="Use an existing PDF instead of generating one.")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = args.pdf
+        if not pdf_path:
+            pdf_path = os.path.join(tmp, "scanned.pdf")
+            start = time.perf_counter()
+            make_scanned_pdf(pdf_path, args.pages, args.seed)
+            print(f"Generated {args.pages}-page PDF in {time.perf_counter() - start:.1f}s")
+
+        results = []
+        for workers in sorted(set(args.workers)):
+            out_dir = os.path.join(tmp, f"out-{workers}")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                convert_pdf_to_images.convert(pdf_path, out_dir, dpi=args.dpi, workers=workers)
+            elapsed = time.perf_counter() - start
+            results.append((workers, elapsed, len(os.listdir(out_dir))))
+
+    serial = results[0][1]
+    print(f"CPUs: {os.cpu_count()}")
+    for workers, elapsed, count in results:
+        print(
+            f"workers={workers:>3}: {elapsed:7.2f}s  {count / elapsed:7.1f} pages/s  "
+            f"speedup {serial / elapsed:.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
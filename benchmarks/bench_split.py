@@ -0,0 +1,122 @@
+"""
+Time pdf-set/scripts/split.py on a large synthetic book, by level-1 headings
+and with a TOC file, and check that the TOC matcher puts each chapter where
+it starts in layouts that have gone wrong before:
+
+- the book's own contents page right before chapter 1, whose title is only
+  a fuzzy match (OCR noise), so the contents-page entry must not win;
+- titles OCR'd over two lines, with one wrong character, or as ## headings;
+- chapter titles repeated as running heads at the top of every later page
+  of the chapter, with the chapter titles plain or as # headings.
+
+Exits non-zero if a check fails.
+
+    python benchmarks/bench_split.py --pages 3000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "pdf-set", "scripts"))
+import split  # noqa: E402
+
+BODY = "\n".join("  天下之事，常成于困约，而败于奢靡。" * 3 for _ in range(5))
+
+
+def run_split(tmp, name, lines, titles=None):
+    """
+    Split lines as 0.rough.md in a fresh folder under tmp; returns the
+    manifest's chapters as (title, line) pairs.
+    """
+    output_dir = os.path.join(tmp, name)
+    os.makedirs(output_dir)
+    input_file = os.path.join(output_dir, "0.rough.md")
+    with open(input_file, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    toc_file = None
+    if titles is not None:
+        toc_file = os.path.join(output_dir, "toc.txt")
+        with open(toc_file, "w", encoding="utf-8") as f:
+            f.write("\n".join(titles) + "\n")
+    with contextlib.redirect_stdout(io.StringIO()):
+        split.split_markdown(input_file, output_dir, toc_file=toc_file)
+    with open(os.path.join(output_dir, split.DEFAULT_MANIFEST_FILENAME), encoding="utf-8") as f:
+        return [(c["title"], c["line"]) for c in json.load(f)["chapters"]]
+
+
+def book(headings, running_heads=None, pages=3):
+    """
+    Lines of a book with a body after each heading, and where each heading
+    landed. With running_heads each chapter runs to pages pages, each after
+    the first headed by its running head; the last page holds one line, so
+    its running head comes just before the next chapter's title.
+    """
+    lines = []
+    starts = []
+    for n, heading in enumerate(headings):
+        starts.append(len(lines) + 1)
+        lines += heading.split("\n") + [""] + BODY.split("\n") + [""]
+        if running_heads:
+            for page in range(1, pages):
+                body = BODY.split("\n")
+                lines += [running_heads[n], ""] + (body if page < pages - 1 else body[:1]) + [""]
+    return lines, starts
+
+
+def check(tmp, name, contents, headings, titles, running_heads=None):
+    lines, starts = book(headings, running_heads)
+    expected = [(title, len(contents) + start) for title, start in zip(titles, starts)]
+    got = run_split(tmp, name, contents + lines, titles)
+    ok = got == expected
+    print(f"{name:<28} {'ok' if ok else 'FAILED'}")
+    if not ok:
+        print(f"  expected {expected}\n  got      {got}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark and check split.py on synthetic books.")
+    parser.add_argument("--pages", type=int, default=3000, help="Pages of about 40 lines in the timed book.")
+    parser.add_argument("--chapters", type=int, default=150)
+    args = parser.parse_args()
+
+    titles = ["第一章 总论", "第二章 方法", "第三章 结果", "第四章 讨论"]
+    contents = ["目录", ""] + titles + [""]
+    results = []
+    with tempfile.TemporaryDirectory(prefix="bench-split-") as tmp:
+        results.append(check(tmp, "contents then fuzzy ch.1", contents, ["第一章 总伦"] + titles[1:], titles))
+        results.append(check(tmp, "contents then exact ch.1", contents, titles, titles))
+        results.append(check(tmp, "no contents page", [], titles, titles))
+        results.append(
+            check(tmp, "split, noisy and ## titles", contents, ["第一章\n总论", "## 第二章 方法", "第三章 結果", "第四章　讨论"], titles)
+        )
+        results.append(check(tmp, "running heads, plain titles", [], titles, titles, titles))
+        results.append(check(tmp, "running heads, # titles", [], ["# " + t for t in titles], titles, titles))
+        results.append(
+            check(tmp, "contents and running heads", contents, ["# " + t for t in titles], titles, titles)
+        )
+
+        per_chapter = max(1, args.pages // args.chapters)
+        lines = []
+        for chapter in range(1, args.chapters + 1):
+            lines.append(f"# 第{chapter}章 正文")
+            lines += [BODY] * (per_chapter * 8)
+        big_titles = [f"第{chapter}章 正文" for chapter in range(1, args.chapters + 1)]
+        for label, titles_arg in (("h1", None), ("toc", big_titles)):
+            started = time.perf_counter()
+            found = run_split(tmp, f"big-{label}", lines, titles_arg)
+            elapsed = time.perf_counter() - started
+            ok = len(found) == args.chapters
+            results.append(ok)
+            print(f"{args.pages} pages by {label:<4} {elapsed:7.2f}s  {len(found)} chapters {'ok' if ok else 'FAILED'}")
+    if not all(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
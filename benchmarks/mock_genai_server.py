@@ -0,0 +1,312 @@
+"""
+A local stand-in for the GenAI generateContent API, for measuring ocr.py
+without network access or quota.
+
+It answers :generateContent and :streamGenerateContent (as server-sent
+events) for any model; everything else, e.g. cachedContents, is a 404, so
+ocr.py falls back to sending the prompt with every request. What a request
+gets is decided from a hash of its images and how often those images were
+sent before, so the same pages see the same text, latencies and faults in
+every run whatever order the requests arrive in:
+
+- latency: lognormal around --latency, with a --tail-prob chance of being
+  --tail-factor times slower;
+- 429 RESOURCE_EXHAUSTED with --rate-429 (optionally with a Retry-After),
+  and for every request beyond --max-concurrent in flight;
+- 500/503 with --rate-5xx;
+- finishReason PROHIBITED_CONTENT for --prohibited of the pages, and
+  MAX_TOKENS halfway through the text for --max-tokens of them (the
+  continuation request gets the rest);
+- text: --chars characters per page built from a fixed phrase list; several
+  images in one request are answered with <<<PAGE k>>> markers.
+
+Run it on its own and point secrets.txt's api_endpoint at it:
+
+    python benchmarks/mock_genai_server.py --port 8765 --latency 1.5 --rate-429 0.02
+
+or start it in-process with start_server(**settings).
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PHRASES = (
+    "天下之事", "常成于困约", "而败于奢靡", "学者须先立志", "读书贵在有疑",
+    "古人云", "温故而知新", "可以为师矣", "其为人也孝弟", "而好犯上者鲜矣",
+    "君子务本", "本立而道生", "山川之形胜", "风俗之厚薄", "一时之盛",
+)
+
+DEFAULT_SETTINGS = {
+    "latency": 0.2,
+    "jitter": 0.3,
+    "tail_prob": 0.0,
+    "tail_factor": 10.0,
+    "first_byte": 0.3,
+    "chunks": 4,
+    "rate_429": 0.0,
+    "retry_after": None,
+    "max_concurrent": None,
+    "rate_5xx": 0.0,
+    "prohibited": 0.0,
+    "max_tokens": 0.0,
+    "chars": 600,
+    "seed": 1,
+}
+
+
+def page_text(digest, chars, seed=1):
+    """
+    Deterministic Chinese text of about chars characters for the image
+    with this digest.
+    """
+    rng = random.Random(f"{seed}:text:{digest}")
+    lines = []
+    size = 0
+    while size < chars:
+        line = "  " + "，".join(rng.choice(PHRASES) for _ in range(rng.randint(3, 8))) + "。"
+        lines.append(line)
+        size += len(line)
+    return "\n".join(lines)
+
+
+class MockGenAIHandler(BaseHTTPRequestHandler):
+    # HTTP/1.0 closes the connection after each reply, so a stream needs no length.
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        stream = ":streamGenerateContent" in self.path
+        if not stream and ":generateContent" not in self.path:
+            self.send_error(404, "not supported by the mock server")
+            return
+        server = self.server
+        with server.lock:
+            server.in_flight += 1
+            crowded = server.settings["max_concurrent"] and server.in_flight > server.settings["max_concurrent"]
+        try:
+            self._answer(json.loads(body or b"{}"), stream, crowded)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+    def _error(self, code, status, message, retry_after=None):
+        data = json.dumps({"error": {"code": code, "message": message, "status": status}}).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if retry_after:
+            self.send_header("Retry-After", str(retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _answer(self, request, stream, crowded):
+        server = self.server
+        settings = server.settings
+        contents = request.get("contents") or []
+        images = []
+        prefix = None
+        for content in contents:
+            for part in content.get("parts") or []:
+                if content.get("role") == "model" and "text" in part:
+                    prefix = (prefix or "") + part["text"]
+                elif "inlineData" in part:
+                    # Hashing the encoded data is enough to tell images apart.
+                    images.append((part["inlineData"].get("data") or "").encode("ascii"))
+        digest = hashlib.sha256(b"".join(images)).hexdigest()[:16]
+        attempt = server.count(digest, prefix is not None)
+        rng = random.Random(f"{settings['seed']}:{digest}:{prefix is not None}:{attempt}")
+        page_rng = random.Random(f"{settings['seed']}:page:{digest}")
+
+        latency = settings["latency"] * rng.lognormvariate(0.0, settings["jitter"])
+        if rng.random() < settings["tail_prob"]:
+            latency *= settings["tail_factor"]
+        fault = rng.random()
+        if crowded or fault < settings["rate_429"]:
+            server.record("429")
+            time.sleep(min(latency, 0.05))
+            self._error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).", settings["retry_after"])
+            return
+        if fault < settings["rate_429"] + settings["rate_5xx"]:
+            server.record("5xx")
+            time.sleep(latency * rng.random())
+            code = rng.choice((500, 503))
+            self._error(code, "INTERNAL" if code == 500 else "UNAVAILABLE", "The service is currently unavailable.")
+            return
+
+        if len(images) > 1:
+            text = "\n".join(
+                f"<<<PAGE {k}>>>\n{page_text(hashlib.sha256(image).hexdigest()[:16], settings['chars'], settings['seed'])}"
+                for k, image in enumerate(images, start=1)
+            )
+        else:
+            text = page_text(digest, settings["chars"], settings["seed"])
+        finish_reason = "STOP"
+        if prefix is not None:
+            server.record("continuation")
+            text = text[len(prefix):] if text.startswith(prefix) else text
+        elif page_rng.random() < settings["prohibited"]:
+            server.record("prohibited")
+            text, finish_reason = "", "PROHIBITED_CONTENT"
+        elif page_rng.random() < settings["max_tokens"]:
+            server.record("max_tokens")
+            text, finish_reason = text[: len(text) // 2], "MAX_TOKENS"
+        server.record("ok")
+        usage = {
+            "promptTokenCount": 300 + 258 * len(images),
+            "candidatesTokenCount": len(text),
+            "totalTokenCount": 300 + 258 * len(images) + len(text),
+        }
+
+        if not stream:
+            time.sleep(latency)
+            self._json_reply(_response(text, finish_reason, usage))
+            return
+        count = max(1, min(settings["chunks"], len(text)))
+        size = -(-len(text) // count) if text else 0
+        pieces = [text[i * size:(i + 1) * size] for i in range(count)]
+        first = latency * settings["first_byte"]
+        time.sleep(first)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, piece in enumerate(pieces):
+            if i:
+                time.sleep((latency - first) / max(1, count - 1))
+            last = i == len(pieces) - 1
+            event = _response(piece, finish_reason if last else None, usage if last else None)
+            try:
+                self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\r\n\r\n".encode("utf-8"))
+                self.wfile.flush()
+            except OSError:
+                # The client gave up, e.g. a hedged request whose twin answered first.
+                server.record("disconnected")
+                return
+
+    def _json_reply(self, data):
+        data = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _response(text, finish_reason=None, usage=None):
+    candidate = {"content": {"role": "model", "parts": [{"text": text}]}}
+    if finish_reason:
+        candidate["finishReason"] = finish_reason
+    response = {"candidates": [candidate]}
+    if usage:
+        response["usageMetadata"] = usage
+    return response
+
+
+class MockGenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, **settings):
+        unknown = set(settings) - set(DEFAULT_SETTINGS)
+        if unknown:
+            raise TypeError(f"unknown mock server settings: {', '.join(sorted(unknown))}")
+        super().__init__(address, MockGenAIHandler)
+        self.settings = dict(DEFAULT_SETTINGS, **settings)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.attempts = {}
+        self.stats = {}
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def count(self, digest, continuation):
+        """
+        How many requests for these images (or their continuations) came before this one.
+        """
+        with self.lock:
+            key = (digest, continuation)
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+            self.stats["requests"] = self.stats.get("requests", 0) + 1
+            return attempt
+
+    def record(self, event):
+        with self.lock:
+            self.stats[event] = self.stats.get(event, 0) + 1
+
+    def reset_stats(self):
+        with self.lock:
+            self.attempts.clear()
+            self.stats.clear()
+
+
+def start_server(host="127.0.0.1", port=0, **settings):
+    """
+    Start a MockGenAIServer on a background thread and return it; stop it
+    with server.shutdown().
+    """
+    server = MockGenAIServer((host, port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def secrets_text(base_url, keys=1, model="mock-model"):
+    """
+    A secrets.txt for ocr.py with keys credential blocks pointing at base_url.
+    """
+    return "\n".join(
+        "import google.generativeai as genai\n"
+        f'genai.configure(api_key="mock-key-{i}", transport="rest", client_options={{"api_endpoint": "{base_url}"}})\n'
+        f'model = genai.GenerativeModel("{model}")\n'
+        for i in range(1, keys + 1)
+    )
+
+
+def add_arguments(parser):
+    """
+    The server's settings as command-line options, shared with the benchmarks.
+    """
+    parser.add_argument("--latency", type=float, default=DEFAULT_SETTINGS["latency"], help="Median latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_SETTINGS["jitter"], help="Lognormal sigma of the latency.")
+    parser.add_argument("--tail-prob", type=float, default=DEFAULT_SETTINGS["tail_prob"], help="Probability of a slow request.")
+    parser.add_argument("--tail-factor", type=float, default=DEFAULT_SETTINGS["tail_factor"], help="Slow request latency multiplier.")
+    parser.add_argument("--rate-429", type=float, default=DEFAULT_SETTINGS["rate_429"], help="Fraction of requests answered 429.")
+    parser.add_argument("--retry-after", type=int, default=None, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--max-concurrent", type=int, default=None, help="Answer 429 beyond this many requests in flight.")
+    parser.add_argument("--rate-5xx", type=float, default=DEFAULT_SETTINGS["rate_5xx"], help="Fraction of requests answered 500/503.")
+    parser.add_argument("--prohibited", type=float, default=DEFAULT_SETTINGS["prohibited"], help="Fraction of pages blocked as PROHIBITED_CONTENT.")
+    parser.add_argument("--max-tokens", type=float, default=DEFAULT_SETTINGS["max_tokens"], help="Fraction of pages cut off at MAX_TOKENS.")
+    parser.add_argument("--chars", type=int, default=DEFAULT_SETTINGS["chars"], help="Characters of text per page.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SETTINGS["seed"])
+
+
+def settings_from_args(args):
+    return {name: getattr(args, name) for name in DEFAULT_SETTINGS if hasattr(args, name)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local mock of the GenAI generateContent API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockGenAIServer((args.host, args.port), **settings_from_args(args))
+    print(f"Mock GenAI API on {server.base_url}; secrets.txt for ocr.py:\n")
+    print(secrets_text(server.base_url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,207 @@
 import argparse
+import io
+import multiprocessing
 import os
 
 import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from PIL import Image
 
 
-def convert(pdf_path, output_dir, dpi=144, start_index=0, image_format="jpg", max_dim=None):
+def render_page(pdf, index, scale, max_dim=None):
+    page = pdf[index]
+    image = page.render(scale=scale).to_pil()
+    page.close()
+
+    if max_dim:
+        width, height = image.size
+        if width > max_dim or height > max_dim:
+            scale_factor = min(max_dim / width, max_dim / height)
+            new_width = int(width * scale_factor)
+            new_height = int(height * scale_factor)
+            image = image.resize((new_width, new_height))
+    return image
+
+
+def save_format_for(image_format):
+    return "JPEG" if image_format.lower() in {"jpg", "jpeg"} else image_format.upper()
+
+
+def encode_image(image, image_format="jpg"):
+    """
+    Encode a rendered page in memory exactly as convert() would write it to disk.
+    """
+    buf = io.BytesIO()
+    image.save(buf, format=save_format_for(image_format))
+    return buf.getvalue()
+
+
+def _save_page(pdf, i, output_dir, scale, start_index, image_format, max_dim, passthrough=False):
+    if passthrough:
+        extracted = extract_page_image(pdf, i, image_format, max_dim)
+        if extracted is not None:
+            data, ext, size, mode = extracted
+            image_path = os.path.join(output_dir, f"{start_index + i}.{ext}")
+            with open(image_path, "wb") as f:
+                f.write(data)
+            return start_index + i, image_path, size, mode
+    image = render_page(pdf, i, scale, max_dim)
+    filename = f"{start_index + i}.{image_format}"
+    image_path = os.path.join(output_dir, filename)
+    image.save(image_path, format=save_format_for(image_format))
+    return start_index + i, image_path, image.size, MODE_RENDERED
+
+
+_worker_pdf = None
+
+
+def _init_worker(pdf_path):
+    # pdfium is not thread-safe, so every worker process opens its own document.
+    global _worker_pdf
+    _worker_pdf = pdfium.PdfDocument(pdf_path)
+
+
+def _render_range(task):
+    first, last, output_dir, scale, start_index, image_format, max_dim, passthrough = task
+    # Render and save one page at a time so a worker holds at most one bitmap.
+    return [
+        _save_page(_worker_pdf, i, output_dir, scale, start_index, image_format, max_dim, passthrough)
+        for i in range(first, last)
+    ]
+
+
+def _page_ranges(page_count, workers):
+    # Several small contiguous ranges per worker keep the load balanced when
+    # some pages (plates, figures) are much slower to render than others.
+    chunk = max(1, min(16, page_count // (workers * 4) or 1))
+    return [(i, min(i + chunk, page_count)) for i in range(0, page_count, chunk)]
+
+
+# A page counts as a plain scan when its only visible object is one image
+# covering at least this share of the page.
+SCAN_MIN_COVERAGE = 0.9
+
+MODE_EMBEDDED = "embedded"
+MODE_DECODED = "decoded"
+MODE_RENDERED = "rendered"
+
+
+def _single_scan_image(page):
+    """
+    Return the page's image object if the page is a single upright scan image
+    with no text or vector content, else None.
+    """
+    if page.get_rotation() != 0:
+        return None
+    images = []
+    for obj in page.get_objects():
+        if obj.type == pdfium_c.FPDF_PAGEOBJ_FORM:
+            continue
+        if obj.type != pdfium_c.FPDF_PAGEOBJ_IMAGE or len(images) == 1:
+            return None
+        images.append(obj)
+    if not images:
+        return None
+    image = images[0]
+    matrix = image.get_matrix()
+    if matrix.b != 0 or matrix.c != 0 or matrix.a <= 0 or matrix.d <= 0:
+        return None
+    left, bottom, right, top = image.get_bounds()
+    crop_left, crop_bottom, crop_right, crop_top = page.get_cropbox()
+    overlap_w = max(0.0, min(right, crop_right) - max(left, crop_left))
+    overlap_h = max(0.0, min(top, crop_top) - max(bottom, crop_bottom))
+    page_area = (crop_right - crop_left) * (crop_top - crop_bottom)
+    if page_area <= 0 or overlap_w * overlap_h < SCAN_MIN_COVERAGE * page_area:
+        return None
+    return image
+
+
+def extract_page_image(pdf, index, image_format="jpg", max_dim=None):
+    """
+    Take a scanned page's embedded image without rasterising the page.
+
+    Embedded JPEGs in gray or RGB are returned byte for byte. Other encodings
+    (JBIG2, CCITT, Flate, JPEG 2000, CMYK JPEG) are decoded once: bilevel and
+    gray images become lossless PNG, everything else is encoded as
+    image_format. Returns (data, extension, size, mode), or None when the
+    page has text, vector or mixed content and must be rendered instead.
+    """
+    page = pdf[index]
+    try:
+        image_obj = _single_scan_image(page)
+        if image_obj is None:
+            return None
+        buf = io.BytesIO()
+        image_obj.extract(buf, fb_format="png")
+        data = buf.getvalue()
+    finally:
+        page.close()
+
+    image = Image.open(io.BytesIO(data))
+    too_big = max_dim and (image.size[0] > max_dim or image.size[1] > max_dim)
+    if image.format == "JPEG" and image.mode in ("L", "RGB") and not too_big:
+        return data, "jpg", image.size, MODE_EMBEDDED
+
+    if too_big:
+        if image.mode == "1":
+            image = image.convert("L")
+        image.thumbnail((max_dim, max_dim))
+    if image.mode in ("1", "L") and not too_big:
+        out_format, ext = "PNG", "png"
+    else:
+        out_format, ext = save_format_for(image_format), image_format
+        if image.mode not in ("L", "RGB"):
+            image = image.convert("RGB")
+    out = io.BytesIO()
+    image.save(out, format=out_format)
+    return out.getvalue(), ext, image.size, MODE_DECODED
+
+
+def convert(
+    pdf_path,
+    output_dir,
+    dpi=144,
+    start_index=0,
+    image_format="jpg",
+    max_dim=None,
+    workers=1,
+    passthrough=False,
+):
     os.makedirs(output_dir, exist_ok=True)
     pdf = pdfium.PdfDocument(pdf_path)
     page_count = len(pdf)
     scale = dpi / 72.0
+    mode_counts = {MODE_EMBEDDED: 0, MODE_DECODED: 0, MODE_RENDERED: 0}
 
-    for i in range(page_count):
-        page = pdf[i]
-        image = page.render(scale=scale).to_pil()
-        page.close()
-
-        if max_dim:
-            width, height = image.size
-            if width > max_dim or height > max_dim:
-                scale_factor = min(max_dim / width, max_dim / height)
-                new_width = int(width * scale_factor)
-                new_height = int(height * scale_factor)
-                image = image.resize((new_width, new_height))
+    def _report(page_num, image_path, size, mode):
+        mode_counts[mode] += 1
+        suffix = f", {mode}" if passthrough else ""
+        print(f"Saved page {page_num} as {image_path} (size: {size}{suffix})")
 
-        filename = f"{start_index + i}.{image_format}"
-        image_path = os.path.join(output_dir, filename)
-        save_format = "JPEG" if image_format.lower() in {"jpg", "jpeg"} else image_format.upper()
-        image.save(image_path, format=save_format)
-        print(f"Saved page {start_index + i} as {image_path} (size: {image.size})")
+    if workers <= 1 or page_count <= 1:
+        for i in range(page_count):
+            _report(*_save_page(pdf, i, output_dir, scale, start_index, image_format, max_dim, passthrough))
+        pdf.close()
+    else:
+        pdf.close()
+        workers = min(workers, page_count)
+        tasks = [
+            (first, last, output_dir, scale, start_index, image_format, max_dim, passthrough)
+            for first, last in _page_ranges(page_count, workers)
+        ]
+        with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(pdf_path,)) as pool:
+            for saved in pool.imap_unordered(_render_range, tasks):
+                for result in saved:
+                    _report(*result)
 
-    pdf.close()
-
-    print(f"Converted {page_count} pages to {image_format} images")
+    if passthrough:
+        print(
+            f"Converted {page_count} pages: {mode_counts[MODE_EMBEDDED]} embedded images copied, "
+            f"{mode_counts[MODE_DECODED]} decoded, {mode_counts[MODE_RENDERED]} rendered"
+        )
+    else:
+        print(f"Converted {page_count} pages to {image_format} images")
+    return mode_counts
 
 
 if __name__ == "__main__":
@@ -52,6 +222,17 @@ if __name__ == "__main__":
         default=None,
         help="Optional max dimension for scaling (default: no scaling).",
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of render processes, each with its own PdfDocument (default: 1).",
+    )
+    parser.add_argument(
+        "--passthrough",
+        action="store_true",
+        help="Copy the embedded image of single-image scan pages instead of rendering them.",
+    )
     args = parser.parse_args()
 
     convert(
@@ -61,4 +242,6 @@ if __name__ == "__main__":
         start_index=args.start,
         image_format=args.format,
         max_dim=args.max_dim,
+        workers=args.workers,
+        passthrough=args.passthrough,
     )
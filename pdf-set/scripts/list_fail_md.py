@@ -2,15 +2,19 @@ import argparse
 import os
 import re
 
+from ocr_journal import FAIL_MD_STATES, OcrJournal, journal_path
+
 DEFAULT_OCR_DIRNAME = "ocr-result"
 FAIL_SUFFIX = ".fail.md"
 FAIL_PATTERN = re.compile(r"^\d+\.fail\.md$")
 IMAGE_DIRNAME = "图片"
 
 
-def list_fail_files(ocr_dir):
+def list_fail_files(ocr_dir, use_journal=True):
     if not os.path.isdir(ocr_dir):
         return []
+    if use_journal and os.path.isfile(journal_path(ocr_dir)):
+        return list_fail_files_from_journal(ocr_dir)
     names = []
     for name in os.listdir(ocr_dir):
         if name.endswith(FAIL_SUFFIX) and FAIL_PATTERN.match(name):
@@ -19,6 +23,21 @@ def list_fail_files(ocr_dir):
     return names
 
 
+def list_fail_files_from_journal(ocr_dir):
+    """
+    Ask the OCR journal written by ocr.py for prohibited and truncated pages
+    instead of scanning the directory. Pages retried successfully since are not listed.
+    """
+    journal = OcrJournal(ocr_dir)
+    try:
+        journal.import_existing_outputs()
+        pages = [row[0] for row in journal.rows(FAIL_MD_STATES)]
+    finally:
+        journal.close()
+    names = [f"{page}{FAIL_SUFFIX}" for page in pages]
+    return [name for name in names if FAIL_PATTERN.match(name)]
+
+
 def format_image_path(base_dir, ocr_dir, name, basename_only):
     number = name.split(".", 1)[0]
     book_dir = os.path.dirname(ocr_dir)
@@ -50,8 +69,13 @@ if __name__ == "__main__":
         action="store_true",
         help="Print only filenames without paths.",
     )
+    parser.add_argument(
+        "--scan-dir",
+        action="store_true",
+        help="Scan the folder for *.fail.md files even if an OCR journal exists.",
+    )
     args = parser.parse_args()
 
     ocr_dir = args.ocr_dir or os.path.join(args.base_dir, DEFAULT_OCR_DIRNAME)
-    for name in list_fail_files(ocr_dir):
+    for name in list_fail_files(ocr_dir, use_journal=not args.scan_dir):
         print(format_image_path(args.base_dir, ocr_dir, name, args.basename_only))
@@ -1,11 +1,34 @@
 # -*- coding: utf-8 -*-
 import argparse
+import bisect
+import hashlib
+import json
 import os
 import re
+from collections import Counter
+
+from ocr_journal import OcrJournal, journal_path, text_hash
 
 DEFAULT_INPUT_DIRNAME = 'ocr-result'
 DEFAULT_OUTPUT_DIRNAME = 'merge-result'
 DEFAULT_OUTPUT_FILENAME = '0.rough.md'
+DEFAULT_REPORT_FILENAME = '0.rough.strip.json'
+MAP_VERSION = 1
+COPY_BLOCK = 1 << 20
+
+# Running heads, titles and folios are looked for among the first and last
+# HEADER_LINES non-blank lines of each page. A line there is stripped when
+# it is short and at least HEADER_GRAM_SHARE of its character n-grams
+# (digits folded together) occur in the same place on HEADER_MIN_PAGES pages.
+HEADER_LINES = 2
+HEADER_MIN_PAGES = 4
+HEADER_MAX_CHARS = 40
+HEADER_NGRAM = 3
+HEADER_GRAM_SHARE = 0.6
+DIGITS_RE = re.compile(r'[0-9０-９]+')
+# Running heads do not end a sentence; body lines that happen to recur often do.
+SENTENCE_END_RE = re.compile(r'[。！？；：，、」』”…!?;:,]\s*$')
+SPACE_RE = re.compile(r'\s+')
 
 def read_single_path(path):
     with open(path, 'r', encoding='utf-8') as f:
@@ -18,40 +41,412 @@ def read_single_path(path):
 def get_natural_sort_key(s):
     return [int(text) if text.isdigit() else text.lower() for text in re.split('([0-9]+)', s)]
 
-def _dedupe_headings(merged_text):
-    lines = merged_text.splitlines()
-    seen_titles = set()
-    out_lines = []
-    # Allow leading whitespace before markdown headings from OCR output.
-    heading_re = re.compile(r'^\s*(#{1,6})\s+(.+?)\s*$')
-
-    for line in lines:
-        m = heading_re.match(line)
-        if m:
-            title = m.group(2).strip()
-            if title in seen_titles:
-                # Remove duplicate heading and ensure single blank line separation
-                if out_lines and out_lines[-1].strip() != "":
-                    out_lines.append("")
-                continue
-            seen_titles.add(title)
-        out_lines.append(line)
-
-    # Collapse consecutive blank lines to a single blank line
-    cleaned = []
-    prev_blank = False
-    for line in out_lines:
-        is_blank = (line.strip() == "")
-        if is_blank:
-            if not prev_blank:
-                cleaned.append("")
-            prev_blank = True
+# Allow leading whitespace before markdown headings from OCR output.
+HEADING_RE = re.compile(r'^\s*(#{1,6})\s+(.+?)\s*$')
+
+def read_page(input_dir, filename):
+    with open(os.path.join(input_dir, filename), 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+def iter_pages(input_dir, md_files):
+    """
+    Yield (filename, stripped text) of each non-empty page in order, one file at a time.
+    """
+    for filename in md_files:
+        content = read_page(input_dir, filename)
+        if content:
+            yield filename, content
+
+def normalise_line(line):
+    """
+    A line with whitespace removed and every run of digits folded to 0, so
+    running heads match whatever page number they carry.
+    """
+    return DIGITS_RE.sub('0', SPACE_RE.sub('', line)).lower()
+
+def _grams(norm):
+    if len(norm) <= HEADER_NGRAM:
+        return {norm}
+    return {norm[i:i + HEADER_NGRAM] for i in range(len(norm) - HEADER_NGRAM + 1)}
+
+def _edge_lines(lines, count):
+    """
+    Indices of the first and of the last count non-blank lines.
+    """
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return filled[:count], filled[::-1][:count]
+
+class HeaderIndex:
+    """
+    How many pages carry each normalised n-gram near their top and near
+    their bottom, used to recognise lines that recur across the book:
+    book titles, chapter running heads and page numbers. Markdown headings
+    are never stripped; repeated ones are removed by _dedupe_headings.
+    """
+
+    def __init__(self, edge_lines=HEADER_LINES, min_pages=HEADER_MIN_PAGES):
+        self.edge_lines = edge_lines
+        self.min_pages = min_pages
+        self.counts = {"top": Counter(), "bottom": Counter()}
+        self.pages = 0
+        self.removed = Counter()
+        self.examples = {}
+
+    def add_page(self, content):
+        lines = content.splitlines()
+        top, bottom = _edge_lines(lines, self.edge_lines)
+        self.pages += 1
+        for zone, indices in (("top", top), ("bottom", bottom)):
+            grams = set()
+            for i in indices:
+                grams |= _grams(normalise_line(lines[i]))
+            self.counts[zone].update(grams)
+
+    def is_running(self, zone, line):
+        if HEADING_RE.match(line) or SENTENCE_END_RE.search(line):
+            return False
+        norm = normalise_line(line)
+        if not norm or len(norm) > HEADER_MAX_CHARS:
+            return False
+        grams = _grams(norm)
+        frequent = sum(1 for gram in grams if self.counts[zone][gram] >= self.min_pages)
+        return frequent >= HEADER_GRAM_SHARE * len(grams)
+
+    def strip(self, content):
+        """
+        content without the recurring lines at its top and bottom, and the
+        lines removed. Lines go from each edge inwards and stop at the
+        first line that is not a recurring one.
+        """
+        lines = content.splitlines()
+        top, bottom = _edge_lines(lines, self.edge_lines)
+        drop = set()
+        for zone, indices in (("top", top), ("bottom", bottom)):
+            for i in indices:
+                if i in drop:
+                    continue
+                if not self.is_running(zone, lines[i]):
+                    break
+                drop.add(i)
+                key = (zone, normalise_line(lines[i]))
+                self.removed[key] += 1
+                self.examples.setdefault(key, lines[i].strip())
+        if not drop:
+            return content, []
+        removed = [lines[i].strip() for i in sorted(drop)]
+        return "\n".join(line for i, line in enumerate(lines) if i not in drop).strip(), removed
+
+    def report(self):
+        return [
+            {"zone": zone, "text": self.examples[(zone, norm)], "normalised": norm, "pages": count}
+            for (zone, norm), count in self.removed.most_common()
+        ]
+
+def build_header_index(input_dir, md_files, edge_lines=HEADER_LINES, min_pages=HEADER_MIN_PAGES):
+    index = HeaderIndex(edge_lines, min_pages)
+    for _, content in iter_pages(input_dir, md_files):
+        index.add_page(content)
+    return index
+
+class HeadingDeduper:
+    """
+    Drops headings whose title already appeared (leaving a blank line in
+    their place) and collapses runs of blank lines into one, in one pass,
+    carrying its state from one page's lines to the next. after_blank
+    starts it as if a blank line had just been fed. titles lists the
+    heading titles of the lines last fed, duplicates included.
+    """
+
+    def __init__(self, seen_titles=(), after_blank=False):
+        self.seen_titles = set(seen_titles)
+        self.last_blank = True if after_blank else None
+        self.prev_blank = after_blank
+        self.titles = []
+
+    def feed(self, lines):
+        self.titles = []
+        for line in lines:
+            m = HEADING_RE.match(line)
+            if m:
+                title = m.group(2).strip()
+                if title not in self.titles:
+                    self.titles.append(title)
+                if title in self.seen_titles:
+                    # Remove duplicate heading and ensure single blank line separation
+                    if self.last_blank is False:
+                        self.last_blank = True
+                        if not self.prev_blank:
+                            self.prev_blank = True
+                            yield ""
+                    continue
+                self.seen_titles.add(title)
+            self.last_blank = line.strip() == ""
+            # Collapse consecutive blank lines to a single blank line
+            if self.last_blank:
+                if not self.prev_blank:
+                    yield ""
+                self.prev_blank = True
+            else:
+                yield line
+                self.prev_blank = False
+
+def _encode(text):
+    # The same bytes a text-mode file would write.
+    return text.replace("\n", os.linesep).encode('utf-8')
+
+class MergeWriter:
+    """
+    Writes lines joined by newlines to a binary file, with surrounding
+    whitespace stripped and one final newline, holding back only trailing
+    whitespace that later text may still follow. Text is buffered until
+    flush(), which writes it out and counts and hashes the bytes for the
+    page map.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.pending = None
+        self.buffer = []
+        self.bytes = 0
+        self.newlines = 0
+        self.hash = hashlib.sha256()
+
+    def write(self, line):
+        if self.pending is None:
+            line = line.lstrip()
+            if not line:
+                return
+            chunk = line
         else:
-            cleaned.append(line)
-            prev_blank = False
-    return "\n".join(cleaned).strip() + "\n"
+            chunk = self.pending + "\n" + line
+        text = chunk.rstrip()
+        if text:
+            self.buffer.append(text)
+        self.pending = chunk[len(text):]
+
+    def flush(self):
+        text = "".join(self.buffer)
+        self.buffer = []
+        data = _encode(text)
+        self.f.write(data)
+        self.hash.update(data)
+        self.bytes += len(data)
+        self.newlines += text.count("\n")
+
+    def close(self):
+        self.buffer.append("\n")
+        self.flush()
+
+def _page_lines(rendered, first):
+    # Drop the blank line that separates this page from the one before.
+    if not first and rendered and rendered[0] == "":
+        return rendered[1:]
+    return rendered
+
+def _is_clean(page_lines):
+    """
+    A page whose output starts and ends with text can be re-rendered on its
+    own and spliced in without touching its neighbours.
+    """
+    return bool(page_lines) and page_lines[0].strip() != "" and page_lines[-1] == page_lines[-1].rstrip() != ""
+
+def map_path_for(output_file):
+    return os.path.splitext(output_file)[0] + '.map.json'
+
+def load_page_map(map_path):
+    if not os.path.isfile(map_path):
+        return None
+    try:
+        with open(map_path, 'r', encoding='utf-8') as f:
+            page_map = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return page_map if page_map.get("version") == MAP_VERSION else None
+
+def save_page_map(map_path, page_map):
+    part_file = map_path + '.part'
+    with open(part_file, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(page_map, ensure_ascii=False))
+    os.replace(part_file, map_path)
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BLOCK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def _page_image(images, filename):
+    page = filename[:-len('.md')]
+    if page.endswith('.fail'):
+        page = page[:-len('.fail')]
+    return images.get(page)
+
+def _image_paths(input_dir):
+    if not os.path.isfile(journal_path(input_dir)):
+        return {}
+    journal = OcrJournal(input_dir)
+    try:
+        return journal.image_paths()
+    finally:
+        journal.close()
 
-def merge_ocr_results(input_dir, output_dir, output_file):
+def _page_entry(input_dir, filename, content, images):
+    st = os.stat(os.path.join(input_dir, filename))
+    return {
+        "file": filename,
+        "image": _page_image(images, filename),
+        "hash": text_hash(content),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "empty": not content,
+        "titles": [],
+    }
+
+def _place(entry, writer, page_lines):
+    """
+    Record where page_lines, just written, ended up in the output.
+    """
+    writer.flush()
+    text = "\n".join(page_lines).rstrip()
+    entry["clean"] = _is_clean(page_lines)
+    entry["end"] = writer.bytes
+    entry["start"] = writer.bytes - len(_encode(text))
+    entry["lines"] = text.count("\n") + 1 if text else 0
+    entry["line"] = writer.newlines + 2 - entry["lines"] if text else writer.newlines + 1
+
+def splice_changed_pages(input_dir, md_files, output_file, map_path):
+    """
+    Bring output_file up to date by re-rendering only the pages whose files
+    changed since map_path was written and splicing their bytes in. Returns
+    False, leaving everything untouched, when that cannot give the same
+    result as a full merge: no usable map, output_file edited since, pages
+    added or removed, or a changed page whose headings changed or whose
+    output does not start and end with text.
+    """
+    page_map = load_page_map(map_path)
+    if page_map is None or page_map.get("strip_headers"):
+        return False
+    entries = page_map["pages"]
+    if [entry["file"] for entry in entries] != md_files:
+        return False
+    if not os.path.isfile(output_file) or file_hash(output_file) != page_map["output_hash"]:
+        return False
+
+    seen_titles = set()
+    started = False
+    changes = []
+    for entry in entries:
+        st = os.stat(os.path.join(input_dir, entry["file"]))
+        if (st.st_size, st.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+            content = read_page(input_dir, entry["file"])
+            entry["size"], entry["mtime_ns"] = st.st_size, st.st_mtime_ns
+            if text_hash(content) != entry["hash"]:
+                if not entry["clean"]:
+                    return False
+                deduper = HeadingDeduper(seen_titles, after_blank=started)
+                page_lines = _page_lines(list(deduper.feed(content.splitlines())), not started)
+                if not _is_clean(page_lines) or set(deduper.titles) != set(entry["titles"]):
+                    return False
+                entry["hash"] = text_hash(content)
+                entry["titles"] = deduper.titles
+                changes.append((entry, "\n".join(page_lines)))
+        seen_titles.update(entry["titles"])
+        started = started or not entry["empty"]
+
+    if changes:
+        h = hashlib.sha256()
+        part_file = output_file + '.part'
+        with open(output_file, 'rb') as src, open(part_file, 'wb') as dst:
+            cursor = 0
+            for entry, text in changes:
+                _copy_range(src, dst, cursor, entry["start"], h)
+                data = _encode(text)
+                dst.write(data)
+                h.update(data)
+                cursor = entry["end"]
+            _copy_range(src, dst, cursor, None, h)
+            page_map["output_bytes"] = dst.tell()
+        os.replace(part_file, output_file)
+        page_map["output_hash"] = h.hexdigest()
+
+        texts = {id(entry): text for entry, text in changes}
+        shift = line_shift = 0
+        for entry in entries:
+            entry["start"] += shift
+            entry["end"] += shift
+            entry["line"] += line_shift
+            if id(entry) in texts:
+                text = texts[id(entry)]
+                old_bytes, old_lines = entry["end"] - entry["start"], entry["lines"]
+                entry["end"] = entry["start"] + len(_encode(text))
+                entry["lines"] = text.count("\n") + 1
+                shift += entry["end"] - entry["start"] - old_bytes
+                line_shift += entry["lines"] - old_lines
+    save_page_map(map_path, page_map)
+    if changes:
+        names = ", ".join(entry["file"] for entry, _ in changes)
+        print(f"Spliced {len(changes)} changed pages into {output_file}: {names}")
+    else:
+        print(f"No pages changed; {output_file} is up to date.")
+    return True
+
+def _copy_range(src, dst, start, end, h):
+    src.seek(start)
+    remaining = None if end is None else end - start
+    while remaining is None or remaining > 0:
+        block = src.read(COPY_BLOCK if remaining is None else min(COPY_BLOCK, remaining))
+        if not block:
+            break
+        dst.write(block)
+        h.update(block)
+        if remaining is not None:
+            remaining -= len(block)
+
+def locate(map_path, output_file, query):
+    """
+    The page entry (file, image, ...) a line of output_file came from;
+    query is a 1-based line number or a piece of text to find.
+    """
+    page_map = load_page_map(map_path)
+    if page_map is None:
+        return None, None
+    if str(query).isdigit():
+        line_no = int(query)
+    else:
+        line_no = None
+        with open(output_file, 'r', encoding='utf-8') as f:
+            for n, line in enumerate(f, start=1):
+                if query in line:
+                    line_no = n
+                    break
+        if line_no is None:
+            return None, None
+    entries = [entry for entry in page_map["pages"] if entry["lines"]]
+    i = bisect.bisect_right([entry["line"] for entry in entries], line_no) - 1
+    if i < 0 or line_no >= entries[i]["line"] + entries[i]["lines"]:
+        return line_no, None
+    return line_no, entries[i]
+
+def merge_ocr_results(
+    input_dir,
+    output_dir,
+    output_file,
+    strip_headers=False,
+    header_lines=HEADER_LINES,
+    header_min_pages=HEADER_MIN_PAGES,
+    report_file=None,
+    full=False,
+):
+    """
+    Merge the pages of input_dir into output_file and write its page map
+    (0.rough.map.json): each page's byte range and first line in the output,
+    content hash and image. On a rerun only changed pages are spliced in
+    when that gives the same result; full=True always merges everything.
+    With strip_headers, running heads, titles and page numbers found by a
+    first pass over the page edges are removed, and what was removed is
+    written to report_file (default: <output_dir>/0.rough.strip.json).
+    """
     if not os.path.exists(input_dir):
         print(f"Error: Input directory {input_dir} does not exist.")
         return
@@ -62,22 +457,74 @@ def merge_ocr_results(input_dir, output_dir, output_file):
 
     print(f"Found {len(md_files)} files to merge.")
 
-    all_content = []
-    for filename in md_files:
-        filepath = os.path.join(input_dir, filename)
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read().strip()
-            if content:
-                all_content.append(content)
-
-    # Join with a single blank line (two newlines)
-    merged_content = "\n\n".join(all_content)
-    merged_content = _dedupe_headings(merged_content)
+    map_path = map_path_for(output_file)
+    if not full and not strip_headers and splice_changed_pages(input_dir, md_files, output_file, map_path):
+        return
 
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(merged_content)
+    if strip_headers:
+        index = build_header_index(input_dir, md_files, header_lines, header_min_pages)
+        removed_by_page = {}
+    images = _image_paths(input_dir)
+    entries = []
+    deduper = HeadingDeduper()
+    started = False
+    # Pages are streamed through and written as they go, so memory stays at
+    # one page; the output appears under its name only once complete.
+    part_file = output_file + '.part'
+    with open(part_file, 'wb') as f:
+        writer = MergeWriter(f)
+        for filename in md_files:
+            content = read_page(input_dir, filename)
+            entry = _page_entry(input_dir, filename, content, images)
+            entries.append(entry)
+            if strip_headers and content:
+                content, removed = index.strip(content)
+                if removed:
+                    removed_by_page[filename] = removed
+            page_lines = []
+            if content:
+                lines = content.splitlines()
+                if started:
+                    # A single blank line between pages.
+                    lines.insert(0, "")
+                rendered = list(deduper.feed(lines))
+                for line in rendered:
+                    writer.write(line)
+                page_lines = _page_lines(rendered, not started)
+                entry["titles"] = deduper.titles
+                started = True
+            _place(entry, writer, page_lines)
+        writer.close()
+    os.replace(part_file, output_file)
+    save_page_map(
+        map_path,
+        {
+            "version": MAP_VERSION,
+            "output": os.path.basename(output_file),
+            "output_hash": writer.hash.hexdigest(),
+            "output_bytes": writer.bytes,
+            "strip_headers": bool(strip_headers),
+            "pages": entries,
+        },
+    )
 
     print(f"Successfully merged {len(md_files)} files into {output_file}")
+    if strip_headers:
+        report_file = report_file or os.path.join(output_dir, DEFAULT_REPORT_FILENAME)
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump(
+                {
+                    "pages": index.pages,
+                    "min_pages": header_min_pages,
+                    "running_lines": index.report(),
+                    "removed": removed_by_page,
+                },
+                f,
+                ensure_ascii=False,
+                indent=2,
+            )
+        removed = sum(len(lines) for lines in removed_by_page.values())
+        print(f"Stripped {removed} header/footer lines from {len(removed_by_page)} pages; report: {report_file}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -123,6 +570,39 @@ if __name__ == "__main__":
         default=None,
         help="UTF-8 text file containing output filename or path (first non-empty line).",
     )
+    parser.add_argument(
+        "--strip-headers",
+        action="store_true",
+        help="Remove running heads, book titles and page numbers that recur at the top or bottom of many pages.",
+    )
+    parser.add_argument(
+        "--header-lines",
+        type=int,
+        default=HEADER_LINES,
+        help=f"With --strip-headers, non-blank lines at each page's top and bottom to examine (default: {HEADER_LINES}).",
+    )
+    parser.add_argument(
+        "--header-min-pages",
+        type=int,
+        default=HEADER_MIN_PAGES,
+        help=f"With --strip-headers, pages a line must recur on to be stripped (default: {HEADER_MIN_PAGES}).",
+    )
+    parser.add_argument(
+        "--report-file",
+        default=None,
+        help=f"With --strip-headers, where to write what was removed (default: <output-dir>/{DEFAULT_REPORT_FILENAME}).",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Merge every page again instead of splicing in only the pages that changed.",
+    )
+    parser.add_argument(
+        "--locate",
+        default=None,
+        metavar="LINE_OR_TEXT",
+        help="Do not merge; print which page file and image a line of the output came from (a line number or text on it).",
+    )
     args = parser.parse_args()
 
     base_dir = args.base_dir
@@ -153,7 +633,26 @@ if __name__ == "__main__":
     if not os.path.isabs(output_filename):
         output_file = os.path.join(output_dir, output_filename)
 
+    if args.locate is not None:
+        line_no, entry = locate(map_path_for(output_file), output_file, args.locate)
+        if line_no is None:
+            print(f"Not found in {output_file} (or no page map; run the merge first): {args.locate}")
+        elif entry is None:
+            print(f"Line {line_no} of {output_file} is not part of any page.")
+        else:
+            print(f"Line {line_no}: {entry['file']} (lines {entry['line']}-{entry['line'] + entry['lines'] - 1}), image: {entry['image'] or 'unknown'}")
+        raise SystemExit(0)
+
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    merge_ocr_results(input_dir, output_dir, output_file)
+    merge_ocr_results(
+        input_dir,
+        output_dir,
+        output_file,
+        strip_headers=args.strip_headers,
+        header_lines=args.header_lines,
+        header_min_pages=args.header_min_pages,
+        report_file=args.report_file,
+        full=args.full,
+    )
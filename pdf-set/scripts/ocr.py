@@ -2,12 +2,40 @@ import os
 import sys
 import time
 import re
+import random
+import hashlib
+import threading
+from collections import deque
 from datetime import datetime
+from email.utils import parsedate_to_datetime
 import glob
+import hmac
+import io
+import json
+import queue
+import secrets
+import socketserver
 import argparse
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import pypdfium2 as pdfium
 from google import genai
 from google.genai import types
+
+from convert_pdf_to_images import encode_image, render_page
+from text_layer import extract_text_layer
+from precheck_images import DEFAULT_BLANK_INK, analyze_image, apply_duplicates, load_report, precheck
+from upload_prep import prepare_upload, settings_key, sniff_mime_type
+from quota_budget import DEFAULT_BUDGET_PATH, WINDOW_SECONDS, QuotaBudget, quota_id, usage_tokens
+
+from ocr_journal import (
+    FAIL_MD_STATES,
+    FINISHED_STATES,
+    OcrJournal,
+    STATE_DONE,
+    STATE_FAIL,
+    STATE_PROHIBITED,
+    STATE_TRUNCATED,
+)
  
 def _load_secrets_text(path):
     if not os.path.isfile(path):
@@ -33,37 +61,78 @@ def _load_secrets_or_exit(path):
 
 
 secrets_path = os.path.join(os.path.dirname(__file__), "secrets.txt")
-secrets_text = _load_secrets_or_exit(secrets_path)
-
-BASE_URL = _extract_secret(
-    [
-        r"api_endpoint\s*[:=]\s*['\"]([^'\"]+)['\"]",
-        r"['\"]api_endpoint['\"]\s*[:=]\s*['\"]([^'\"]+)['\"]",
-        r"client_options\s*=\s*{[^}]*api_endpoint\s*:\s*['\"]([^'\"]+)['\"][^}]*}",
-        r"client_options\s*=\s*{[^}]*['\"]api_endpoint['\"]\s*:\s*['\"]([^'\"]+)['\"][^}]*}",
-    ],
-    secrets_text,
-)
-API_KEY = _extract_secret(
-    [
-        r"api_key\s*=\s*['\"]([^'\"]+)['\"]",
-        r"api_key\s*:\s*['\"]([^'\"]+)['\"]",
-    ],
-    secrets_text,
-)
-MODEL = _extract_secret([r"GenerativeModel\s*\(\s*['\"]([^'\"]+)['\"]\s*\)"], secrets_text)
 
-if not BASE_URL or not API_KEY or not MODEL:
-    print("secrets.txt missing required values: api_endpoint, api_key, or model.")
-    sys.exit(1)
+BASE_URL = ""
+API_KEY = ""
+MODEL = ""
+client = None
 
-if BASE_URL.endswith("/v1"):
-    BASE_URL = BASE_URL[:-3]
 
-client = genai.Client(
-    api_key=API_KEY,
-    http_options={"base_url": BASE_URL},
-)
+def _split_credential_blocks(text):
+    """
+    Split secrets.txt into one block per api_key, each starting at the line
+    that holds its key (the first block also keeps everything above it).
+    """
+    starts = [text.rfind("\n", 0, m.start()) + 1 for m in re.finditer(r"api_key['\"]?\s*[:=]", text, re.IGNORECASE)]
+    if not starts:
+        return [text]
+    starts[0] = 0
+    return [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+
+
+def parse_credentials(secrets_text):
+    """
+    Return (base_url, api_key, model) for every credential block. A block
+    without an endpoint or model uses the one from the block before it.
+    """
+    credentials = []
+    base_url = ""
+    model = ""
+    for block in _split_credential_blocks(secrets_text):
+        base_url = _extract_secret(
+            [
+                r"api_endpoint\s*[:=]\s*['\"]([^'\"]+)['\"]",
+                r"['\"]api_endpoint['\"]\s*[:=]\s*['\"]([^'\"]+)['\"]",
+                r"client_options\s*=\s*{[^}]*api_endpoint\s*:\s*['\"]([^'\"]+)['\"][^}]*}",
+                r"client_options\s*=\s*{[^}]*['\"]api_endpoint['\"]\s*:\s*['\"]([^'\"]+)['\"][^}]*}",
+            ],
+            block,
+        ) or base_url
+        api_key = _extract_secret(
+            [
+                r"api_key\s*=\s*['\"]([^'\"]+)['\"]",
+                r"api_key\s*:\s*['\"]([^'\"]+)['\"]",
+            ],
+            block,
+        )
+        model = _extract_secret([r"GenerativeModel\s*\(\s*['\"]([^'\"]+)['\"]\s*\)"], block) or model
+        if base_url.endswith("/v1"):
+            base_url = base_url[:-3]
+        credentials.append((base_url, api_key, model))
+    return credentials
+
+
+def init_client(path=secrets_path):
+    """
+    Parse secrets.txt and build one GenAI client per credential block. The
+    first block also sets the module-level client and MODEL.
+    """
+    global BASE_URL, API_KEY, MODEL, client, client_pool
+    secrets_text = _load_secrets_or_exit(path)
+
+    credentials = parse_credentials(secrets_text)
+    if not all(base_url and api_key and model for base_url, api_key, model in credentials):
+        print("secrets.txt missing required values: api_endpoint, api_key, or model.")
+        sys.exit(1)
+
+    keys = [
+        ApiKey(f"#{i} ...{api_key[-4:]}", base_url, api_key, model)
+        for i, (base_url, api_key, model) in enumerate(credentials, start=1)
+    ]
+    client_pool = ClientPool(keys)
+    BASE_URL, API_KEY, MODEL = credentials[0]
+    client = keys[0].client
+    return client
 
 SAFETY_SETTINGS = {
     "HARM_CATEGORY_HARASSMENT": "OFF",
@@ -83,7 +152,7 @@ def countdown_timer(seconds):
     sys.stdout.write("\rWait complete!            \n")
     sys.stdout.flush()
  
-def update_progress(completed, total):
+def update_progress(completed, total, extra=""):
     """
     Displays a simple single-line progress bar in the console.
     """
@@ -96,6 +165,8 @@ def update_progress(completed, total):
     pct = round(progress * 100, 2)
     status = "OVER" if completed >= total else "RUNNING"
     text = f"[{completed}/{total}][{bar}][{pct:.2f}%][{status}]"
+    if extra:
+        text += f"[{extra}]"
     sys.stdout.write("\r\033[K" + text)
     sys.stdout.flush()
     if completed >= total:
@@ -107,7 +178,11 @@ def _read_image_bytes(image_path):
         return f.read()
 
 
-def _guess_mime_type(image_path):
+def _guess_mime_type(image_path, image_bytes=None):
+    if image_bytes is not None:
+        mime_type = sniff_mime_type(image_bytes)
+        if mime_type:
+            return mime_type
     ext = os.path.splitext(image_path)[1].lower()
     if ext in (".jpg", ".jpeg"):
         return "image/jpeg"
@@ -119,7 +194,7 @@ def _guess_mime_type(image_path):
         return "image/tiff"
     if ext == ".bmp":
         return "image/bmp"
-    return "image/jpeg"
+    raise ValueError(f"Unrecognised image format: {image_path}")
 
 
 def _extract_text_from_response(response):
@@ -160,119 +235,1899 @@ def _get_finish_reason(response):
                 pass
     return ""
 
-def read_single_path(path):
-    with open(path, 'r', encoding='utf-8') as f:
-        for line in f:
-            value = line.strip()
-            if value:
-                return value
-    return ""
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter for the GenAI calls made with one API key.
+
+    The concurrency limit grows by one for every `limit` successful calls and
+    is cut multiplicatively on throttling (429 / quota errors). Retry-After
+    hints pause the key's calls until they expire. After `breaker_threshold`
+    consecutive server or network failures the circuit opens: calls wait
+    for `breaker_cooldown` seconds, then a single probe call is let
+    through and the limit regrows from min_limit.
+    """
+
+    def __init__(
+        self,
+        initial=3,
+        min_limit=1,
+        max_limit=8,
+        decrease=0.5,
+        breaker_threshold=5,
+        breaker_cooldown=30.0,
+        backoff_base=1.0,
+        backoff_cap=60.0,
+    ):
+        self.min_limit = max(1, int(min_limit))
+        self.max_limit = max(self.min_limit, int(max_limit))
+        self.limit = float(min(max(int(initial), self.min_limit), self.max_limit))
+        self.decrease = decrease
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.in_flight = 0
+        self.paused_until = 0.0
+        self.consecutive_failures = 0
+        self.breaker_trips = 0
+        self.counts = {"ok": 0, "throttled": 0, "server": 0, "network": 0, "other": 0}
+        self._last_decrease = 0.0
+        self._completions = deque()
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    self._cond.wait(self.paused_until - now)
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self._cond.wait()
+
+    def try_acquire(self, extra=False):
+        """
+        Take a slot if one is free right now; never blocks. An extra slot
+        is taken even at the limit, unless the limiter is paused.
+        """
+        with self._cond:
+            if time.monotonic() < self.paused_until or (not extra and self.in_flight >= int(self.limit)):
+                return False
+            self.in_flight += 1
+            return True
+
+    def load(self):
+        with self._cond:
+            return self.in_flight / max(self.limit, 1.0)
+
+    def release(self, outcome, retry_after=None):
+        """
+        Record the outcome of one call: ok, throttled, server, network, other,
+        or cancelled for a hedged call whose twin answered first.
+        """
+        with self._cond:
+            now = time.monotonic()
+            self.in_flight = max(0, self.in_flight - 1)
+            self.counts[outcome] = self.counts.get(outcome, 0) + 1
+            if outcome != "cancelled":
+                self._completions.append(now)
+            if outcome == "ok":
+                self.consecutive_failures = 0
+                self.limit = min(float(self.max_limit), self.limit + 1.0 / max(self.limit, 1.0))
+            elif outcome == "throttled":
+                # Calls already in flight when the first 429 lands will fail too;
+                # only cut once per cooldown so one burst does not collapse the limit.
+                if now - self._last_decrease >= 1.0:
+                    self.limit = max(float(self.min_limit), self.limit * self.decrease)
+                    self._last_decrease = now
+            elif outcome in ("server", "network"):
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= self.breaker_threshold:
+                    self.consecutive_failures = 0
+                    self.breaker_trips += 1
+                    self.limit = float(self.min_limit)
+                    self.paused_until = max(self.paused_until, now + self.breaker_cooldown)
+                    sys.stdout.write(
+                        f"\nEndpoint unavailable, pausing its requests for {self.breaker_cooldown:.0f}s.\n"
+                    )
+                    sys.stdout.flush()
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+            self._cond.notify_all()
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """
+        Exponential backoff with full jitter, never shorter than a Retry-After hint.
+        """
+        cap = min(self.backoff_cap, self.backoff_base * (2 ** max(0, attempt - 1)))
+        delay = random.uniform(0, cap)
+        if retry_after:
+            delay = max(delay, retry_after)
+        return delay
+
+    def rate_per_minute(self, window=60.0):
+        with self._cond:
+            now = time.monotonic()
+            while self._completions and now - self._completions[0] > window:
+                self._completions.popleft()
+            return len(self._completions) * 60.0 / window
+
+    def status_text(self):
+        return f"c={int(self.limit)}/{self.max_limit} r={self.rate_per_minute():.1f}/min"
+
+    def summary(self):
+        counts = ", ".join(f"{k}={v}" for k, v in self.counts.items())
+        return (
+            f"Limiter: concurrency={int(self.limit)}/{self.max_limit}, "
+            f"rate={self.rate_per_minute():.1f} req/min, breaker trips={self.breaker_trips}, {counts}"
+        )
+
+
+limiter_settings = {}
+
+
+def configure_limiter(initial, max_limit, breaker_cooldown=30.0):
+    """
+    Give every API key a fresh limiter, e.g. with values from the command line.
+    """
+    limiter_settings.update(
+        initial=initial,
+        max_limit=max(int(initial), int(max_limit)),
+        breaker_cooldown=breaker_cooldown,
+    )
+    for key in client_pool.keys:
+        key.limiter = AdaptiveLimiter(**limiter_settings)
+    return client_pool
+
+
+# A Retry-After at least this long means the key's quota is spent, not a rate spike.
+QUOTA_RETRY_AFTER = 60.0
+# Throttled this many times in a row, a key is benched even without a hint;
+# throttled again when it comes back, it is out of quota for its window.
+QUOTA_STREAK = 3
+
+quota_budget = None
+
+
+def configure_quota(path=DEFAULT_BUDGET_PATH, max_requests=None, max_tokens=None):
+    """
+    Track each key's use per quota window in path; pass None to disable.
+    """
+    global quota_budget
+    quota_budget = QuotaBudget(path, max_requests, max_tokens) if path else None
+    return quota_budget
+
+
+def _format_duration(seconds):
+    seconds = int(max(0, seconds))
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+def _percentile(values, q):
+    """
+    The q-quantile (0..1) of the sorted list values.
+    """
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+class ApiKey:
+    """
+    One credential block from secrets.txt: its client and model, its own
+    adaptive limiter and prompt cache, and whether it is in rotation.
+    """
+
+    def __init__(self, label, base_url, api_key, model):
+        self.label = label
+        self.base_url = base_url
+        self.model = model
+        self.quota_id = quota_id(api_key)
+        self._api_key = api_key
+        self.client = self.make_client()
+        self.limiter = AdaptiveLimiter(**limiter_settings)
+        self.prompt_cache = None
+        self.benched_until = 0.0
+        self.throttle_streak = 0
+        self._last_throttle = 0.0
+        self.disabled = False
+
+    def make_client(self):
+        http_options = {"base_url": self.base_url}
+        if request_timeout:
+            # HttpOptions takes milliseconds; it bounds connecting and each read.
+            http_options["timeout"] = int(request_timeout * 1000)
+        return genai.Client(api_key=self._api_key, http_options=http_options)
+
+    def state_text(self, now):
+        if self.disabled:
+            return "disabled"
+        if now < self.benched_until:
+            return f"benched {_format_duration(self.benched_until - now)}"
+        return "ok"
+
+
+class ClientPool:
+    """
+    The API keys from secrets.txt. Each request goes to the usable key with
+    the most spare concurrency. A key told to come back after a long
+    Retry-After leaves rotation for that long. A key throttled QUOTA_STREAK
+    times in a row rests briefly; throttled again when it returns, it is out
+    of quota and rests until quota_budget says its window refreshes (or, with
+    no budget, for a pause that doubles up to WINDOW_SECONDS). A rejected key
+    leaves for the rest of the run. While every key rests, requests wait
+    instead of failing and resume on their own.
+    """
+
+    def __init__(self, keys=()):
+        self.keys = list(keys)
+        self._cond = threading.Condition()
+        self._paused_since = None
+        self._pause_reported = False
+        self.paused_seconds = 0.0
+
+    @property
+    def max_limit(self):
+        if not self.keys:
+            return limiter_settings.get("max_limit", 8)
+        return sum(key.limiter.max_limit for key in self.keys)
+
+    def _usable(self, now):
+        return [key for key in self.keys if not key.disabled and now >= key.benched_until]
+
+    def acquire(self):
+        """
+        Block until some key has a free slot and return that key.
+        """
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                usable = self._usable(now)
+                if quota_budget is not None:
+                    for key in usable:
+                        reset_in = quota_budget.over_limit(key.quota_id)
+                        if reset_in is not None:
+                            self._bench(key, now, reset_in, "used its quota budget")
+                    usable = self._usable(now)
+                for key in sorted(usable, key=lambda k: k.limiter.load()):
+                    if key.limiter.try_acquire():
+                        return key
+                wake = [key.limiter.paused_until for key in usable if key.limiter.paused_until > now]
+                if not usable:
+                    wake = [key.benched_until for key in self.keys if not key.disabled]
+                    if not wake:
+                        raise RuntimeError("Every API key in secrets.txt was rejected.")
+                    self._pause(now, min(wake) - now)
+                self._cond.wait(min(wake) - now if wake else None)
+
+    def acquire_extra(self, avoid=None):
+        """
+        A slot beyond the limiters' for a hedged duplicate, on the
+        least-loaded usable key other than avoid when there is one, or None;
+        never waits.
+        """
+        with self._cond:
+            usable = self._usable(time.monotonic())
+            for key in sorted(usable, key=lambda k: (k is avoid, k.limiter.load())):
+                if key.limiter.try_acquire(extra=True):
+                    return key
+        return None
+
+    def _pause(self, now, seconds):
+        if self._paused_since is None:
+            self._paused_since = now
+            self._pause_reported = False
+        # Keys resting for a moment after a burst of 429s are not worth a message.
+        if self._pause_reported or seconds < QUOTA_RETRY_AFTER:
+            return
+        self._pause_reported = True
+        if quota_budget is not None:
+            quota_budget.save()
+        resume_at = datetime.fromtimestamp(time.time() + seconds).strftime("%H:%M")
+        sys.stdout.write(
+            f"\nAll API keys are out of quota; pausing until {resume_at} ({_format_duration(seconds)}). "
+            "Finished pages are saved, so stopping and rerunning later also resumes.\n"
+        )
+        sys.stdout.flush()
+
+    def _bench(self, key, now, pause, reason):
+        if now + pause > key.benched_until:
+            key.benched_until = now + pause
+            sys.stdout.write(f"\nAPI key {key.label} {reason}, resting {_format_duration(pause)}.\n")
+            sys.stdout.flush()
+
+    def release(self, key, outcome, retry_after=None, error=None):
+        """
+        Record a call's outcome on its key's limiter and bench or drop the key
+        when it is out of quota or rejected. Returns True when the key is
+        resting, so the failed call can wait for it without counting it as
+        an attempt.
+        """
+        key.limiter.release(outcome, retry_after=retry_after)
+        now = time.monotonic()
+        with self._cond:
+            if outcome == "ok":
+                key.throttle_streak = 0
+                if self._paused_since is not None:
+                    self.paused_seconds += now - self._paused_since
+                    self._paused_since = None
+                    if self._pause_reported:
+                        sys.stdout.write("\nQuota refreshed, resuming.\n")
+                        sys.stdout.flush()
+            # Calls that were in flight when the key was benched, or that land
+            # in the same burst, say nothing new about its quota.
+            elif outcome == "throttled" and now >= key.benched_until and now - key._last_throttle >= 1.0:
+                key._last_throttle = now
+                key.throttle_streak += 1
+                exhausted = False
+                pause = 0.0
+                if retry_after and retry_after >= QUOTA_RETRY_AFTER:
+                    exhausted = True
+                    pause = retry_after
+                elif key.throttle_streak > QUOTA_STREAK:
+                    exhausted = True
+                    pause = min(WINDOW_SECONDS, QUOTA_RETRY_AFTER * 2 ** (key.throttle_streak - QUOTA_STREAK))
+                elif key.throttle_streak == QUOTA_STREAK:
+                    pause = QUOTA_RETRY_AFTER
+                if exhausted and quota_budget is not None:
+                    reset_in = quota_budget.exhausted(key.quota_id)
+                    if reset_in is not None and not retry_after:
+                        pause = max(QUOTA_RETRY_AFTER, reset_in)
+                if pause:
+                    self._bench(key, now, pause, "out of quota" if exhausted else "throttled repeatedly")
+            elif error is not None and _is_auth_error(error) and not key.disabled:
+                key.disabled = True
+                sys.stdout.write(f"\nAPI key {key.label} was rejected and is out of rotation: {error}\n")
+                sys.stdout.flush()
+            self._cond.notify_all()
+            return key.disabled or now < key.benched_until
+
+    def backoff_delay(self, key, attempt, retry_after=None):
+        """
+        Backoff before retrying a call that failed on key. A Retry-After hint
+        only applies while no other key can take the retry, and a retry off a
+        resting key goes straight back to acquire(), which waits for a key.
+        """
+        now = time.monotonic()
+        with self._cond:
+            if key.disabled or now < key.benched_until:
+                return 0.0
+            others = [k for k in self._usable(now) if k is not key]
+        return key.limiter.backoff_delay(attempt, None if others else retry_after)
+
+    def quota_ids(self):
+        return [key.quota_id for key in self.keys if not key.disabled]
+
+    def active_seconds(self, since):
+        """
+        Seconds since the monotonic time since, leaving out quota pauses.
+        """
+        now = time.monotonic()
+        with self._cond:
+            paused = self.paused_seconds
+            if self._paused_since is not None:
+                paused += now - self._paused_since
+        return max(0.0, now - since - paused)
+
+    def status_text(self):
+        if not self.keys:
+            return ""
+        limit = sum(int(key.limiter.limit) for key in self.keys)
+        rate = sum(key.limiter.rate_per_minute() for key in self.keys)
+        text = f"c={limit}/{self.max_limit} r={rate:.1f}/min"
+        if len(self.keys) > 1:
+            text += f" k={len(self._usable(time.monotonic()))}/{len(self.keys)}"
+        return text
+
+    def summary(self):
+        if len(self.keys) == 1:
+            return self.keys[0].limiter.summary()
+        now = time.monotonic()
+        lines = [f"API keys: {len(self.keys)}"]
+        for key in self.keys:
+            lines.append(f"  {key.label} [{key.state_text(now)}] {key.limiter.summary()}")
+        return "\n".join(lines)
+
+
+client_pool = ClientPool()
+
+
+def _is_auth_error(e):
+    code = _error_status_code(e)
+    return code == 401 or (code == 403 and "key" in str(e).lower())
+
+
+def _error_status_code(e):
+    for attr in ("code", "status_code"):
+        val = getattr(e, attr, None)
+        if isinstance(val, int):
+            return val
+    response = getattr(e, "response", None)
+    val = getattr(response, "status_code", None)
+    return val if isinstance(val, int) else None
+
+
+def _classify_error(e):
+    """
+    Map an exception from generate_content to throttled, server, network or other.
+    """
+    code = _error_status_code(e)
+    text = f"{getattr(e, 'status', '')} {e}".upper()
+    if code == 429 or "RESOURCE_EXHAUSTED" in text or "QUOTA" in text or "RATE LIMIT" in text:
+        return "throttled"
+    if code is not None and 500 <= code < 600:
+        return "server"
+    if code is None and isinstance(e, (ConnectionError, TimeoutError, OSError)):
+        return "network"
+    if code is None and type(e).__module__.startswith(("httpx", "httpcore", "requests", "urllib3")):
+        return "network"
+    return "other"
+
+
+def _retry_after_seconds(e):
+    """
+    Read a Retry-After header or a google.rpc.RetryInfo retryDelay from an API error.
+    """
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None)
+    value = None
+    if headers is not None:
+        try:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+        except Exception:
+            value = None
+    if value:
+        value = str(value).strip()
+        if value.replace(".", "", 1).isdigit():
+            return float(value)
+        try:
+            when = parsedate_to_datetime(value)
+            return max(0.0, when.timestamp() - time.time())
+        except Exception:
+            pass
+    details = getattr(e, "details", None)
+    match = re.search(r"retryDelay['\"]?\s*[:=]\s*['\"]?([\d.]+)s", str(details or ""))
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def _page_name(image_path):
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+
+def read_single_path(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            value = line.strip()
+            if value:
+                return value
+    return ""
+
+
+def _load_prompt(prompt_path):
+    if prompt_path and os.path.isfile(prompt_path):
+        with open(prompt_path, "r", encoding="utf-8") as f:
+            content = f.read().strip()
+            if content:
+                return content
+    return "Extract and transcribe any visible text from this image, exactly as it appears."
+
+
+MAX_ATTEMPTS = 5
+MAX_THROTTLED_ATTEMPTS = 30
+
+
+def extract_text_from_gemini_api(
+    image_path, page_num, prompt_text, image_bytes=None, mime_type=None, partial_path=None, first_tier=0
+):
+    """
+    Sends the image to a GenAI-compatible API and retrieves the extracted text.
+    Added detailed logging and error information. With a model chain the
+    page starts at model_chain[first_tier] and escalates from there.
+    """
+    if image_bytes is None:
+        image_bytes = _read_image_bytes(image_path)
+    if mime_type is None:
+        mime_type = _guess_mime_type(image_path, image_bytes)
+    parts = [types.Part.from_bytes(data=image_bytes, mime_type=mime_type)]
+    return ocr_with_models(prompt_text, parts, page_num, image_bytes, partial_path=partial_path, first_tier=first_tier)
+
+
+class PromptCache:
+    """
+    Server-side cached content holding the OCR prompt as system instruction,
+    so requests only carry their images. The handle is created on the first
+    request that needs it, and its TTL is refreshed once
+    half of it has passed, which keeps it alive through long books. When the
+    endpoint does not support caching, or the handle stops working, requests
+    go back to sending the prompt inline.
+    """
+
+    def __init__(self, key, prompt_text, ttl_seconds=3600):
+        self.key = key
+        self.prompt_text = prompt_text
+        self.ttl_seconds = int(ttl_seconds)
+        self.name = None
+        self._started = False
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def _ttl(self):
+        return f"{self.ttl_seconds}s"
+
+    def start(self):
+        try:
+            cached = self.key.client.caches.create(
+                model=self.key.model,
+                config=types.CreateCachedContentConfig(
+                    system_instruction=self.prompt_text,
+                    display_name="pdf-set-ocr-prompt",
+                    ttl=self._ttl(),
+                ),
+            )
+        except Exception as e:
+            print(f"\nPrompt cache unavailable for {self.key.label}, sending the prompt with every request: {e}")
+            return None
+        self.name = cached.name
+        self._refreshed = time.monotonic()
+        print(f"\nPrompt cache: {self.name} (ttl {self.ttl_seconds}s)")
+        return self.name
+
+    def current(self):
+        """
+        Name of the live handle, or None to send the prompt inline.
+        """
+        with self._lock:
+            if not self._started:
+                self._started = True
+                self.start()
+            elif self.name and time.monotonic() - self._refreshed > self.ttl_seconds / 2:
+                try:
+                    self.key.client.caches.update(name=self.name, config=types.UpdateCachedContentConfig(ttl=self._ttl()))
+                    self._refreshed = time.monotonic()
+                except Exception as e:
+                    print(f"\nPrompt cache refresh failed, sending the prompt inline: {e}")
+                    self.name = None
+            return self.name
+
+    def drop(self, name, reason):
+        with self._lock:
+            if self.name == name:
+                print(f"\nPrompt cache {name} stopped working, sending the prompt inline: {reason}")
+                self.name = None
+
+    def close(self):
+        with self._lock:
+            name, self.name = self.name, None
+        if name:
+            try:
+                self.key.client.caches.delete(name=name)
+            except Exception:
+                pass
+
+
+def configure_prompt_cache(prompt_text, ttl_seconds=3600):
+    """
+    Use a server-side cache for prompt_text on every API key (cached content
+    belongs to one key's project); pass None to disable it.
+    """
+    close_prompt_caches()
+    for key in client_pool.keys:
+        key.prompt_cache = PromptCache(key, prompt_text, ttl_seconds) if prompt_text else None
+
+
+def close_prompt_caches():
+    for key in client_pool.keys:
+        if key.prompt_cache is not None:
+            key.prompt_cache.close()
+
+
+def _is_cache_error(e):
+    return _error_status_code(e) in (400, 403, 404) and "cache" in str(e).lower()
+
+
+use_streaming = True
+MAX_CONTINUATIONS = 3
+CONTINUE_PROMPT = "上面的输出因长度限制被截断。请从截断处原样接着输出本页剩余内容，不要重复已输出的文字，不要添加任何说明。"
+
+
+def configure_streaming(enabled):
+    global use_streaming
+    use_streaming = bool(enabled)
+    return use_streaming
+
+
+# Seconds a request may take before it is abandoned and retried; None waits
+# as long as the server takes.
+request_timeout = None
+
+
+def configure_timeout(seconds):
+    """
+    Give every API key a client whose requests give up after seconds.
+    """
+    global request_timeout
+    request_timeout = float(seconds) if seconds and seconds > 0 else None
+    for key in client_pool.keys:
+        key.client = key.make_client()
+    return request_timeout
+
+
+class RequestCancelled(Exception):
+    """
+    Raised inside a hedged request whose twin has already answered.
+    """
+
+
+# A request running longer than the p95 of the last HEDGE_SAMPLES latencies
+# (and at least HEDGE_MIN_DELAY seconds) gets a duplicate.
+HEDGE_SAMPLES = 200
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 5.0
+
+hedger = None
+
+
+class Hedger:
+    """
+    Decides when a slow request gets a duplicate: once it has run past the
+    p95 of recent request latencies, as long as duplicates stay within
+    fraction of all requests sent.
+    """
+
+    def __init__(self, fraction, min_delay=HEDGE_MIN_DELAY):
+        self.fraction = fraction
+        self.min_delay = min_delay
+        self._latencies = deque(maxlen=HEDGE_SAMPLES)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+
+    def observe(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def delay(self):
+        """
+        Seconds to wait before duplicating a request, or None while too few
+        latencies have been seen to know the p95.
+        """
+        with self._lock:
+            self.requests += 1
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            p95 = _percentile(sorted(self._latencies), 0.95)
+        return max(self.min_delay, p95)
+
+    def allow(self):
+        with self._lock:
+            if self.hedged + 1 > self.fraction * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def refund(self):
+        with self._lock:
+            self.hedged -= 1
+
+
+def configure_hedging(fraction):
+    """
+    Duplicate requests slower than the observed p95, up to fraction of all
+    requests; 0 turns hedging off.
+    """
+    global hedger
+    hedger = Hedger(fraction) if fraction and fraction > 0 else None
+    return hedger
+
+
+class _Sink:
+    """
+    Where a hedged request's streamed text goes: the page's partial file for
+    the original request, nowhere for the duplicate. Once cancelled, the
+    next write raises RequestCancelled, so a losing stream stops at its next
+    chunk.
+    """
+
+    def __init__(self, partial=None):
+        self.partial = partial
+        self.cancelled = False
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            if self.cancelled:
+                raise RequestCancelled()
+            if self.partial is not None:
+                self.partial.write(text)
+
+    def flush(self):
+        with self._lock:
+            if self.partial is not None and not self.cancelled:
+                self.partial.flush()
+
+    def cancel(self, replacement=None):
+        """
+        Stop the request; with replacement, the partial file now holds that
+        text instead of what this request streamed.
+        """
+        with self._lock:
+            self.cancelled = True
+            if replacement is not None and self.partial is not None:
+                self.partial.seek(0)
+                self.partial.truncate()
+                self.partial.write(replacement)
+                self.partial.flush()
+
+
+def _hedged_request(key, contents, config, partial, model, hedge_contents):
+    """
+    _request on key, with a duplicate of it (hedge_contents, no prompt cache)
+    on another key once it runs past hedger's delay; the first answer wins
+    and the other request is cancelled. Returns (winner, text,
+    finish_reason, usage): winner is key when the original answered first,
+    else the duplicate's key, and it is the caller's to release. Raises the
+    original's error when both fail.
+    """
+    cond = threading.Condition()
+    results = {}
+    sinks = {"original": _Sink(partial), "hedge": _Sink()}
+    keys = {"original": key}
+    closed = False
+
+    def _run(name, run_contents, run_config):
+        try:
+            result = (True, _request(keys[name], run_contents, run_config, sinks[name], model))
+        except Exception as e:
+            result = (False, e)
+        with cond:
+            results[name] = result
+            cond.notify_all()
+            if not closed:
+                return
+        # This request lost and was left running; its key is ours to release.
+        _settle(keys[name], result)
+
+    def _settle(run_key, result):
+        ok, value = result
+        if ok:
+            client_pool.release(run_key, "ok")
+        elif isinstance(value, RequestCancelled):
+            client_pool.release(run_key, "cancelled")
+        else:
+            client_pool.release(run_key, _classify_error(value), retry_after=_retry_after_seconds(value), error=value)
+
+    threading.Thread(target=_run, args=("original", contents, config), daemon=True).start()
+    delay = hedger.delay()
+    if delay is not None:
+        with cond:
+            cond.wait_for(lambda: "original" in results, timeout=delay)
+            slow = "original" not in results
+        if slow and hedger.allow():
+            hedge_key = client_pool.acquire_extra(avoid=key)
+            if hedge_key is None:
+                hedger.refund()
+            else:
+                keys["hedge"] = hedge_key
+                request_stats.record_hedge()
+                threading.Thread(target=_run, args=("hedge", hedge_contents, None), daemon=True).start()
+
+    with cond:
+        while True:
+            winner = next((name for name in ("original", "hedge") if results.get(name, (False,))[0]), None)
+            if winner is not None or all(name in results for name in keys):
+                break
+            cond.wait()
+        closed = True
+        done = dict(results)
+    for name in keys:
+        if name == winner or (name == "original" and winner is None):
+            continue
+        if name in done:
+            _settle(keys[name], done[name])
+        else:
+            sinks[name].cancel()
+    if winner is None:
+        raise done["original"][1]
+    text, finish_reason, usage = done[winner][1]
+    if winner == "hedge":
+        request_stats.record_hedge(won=True)
+        sinks["original"].cancel(replacement=text)
+    return keys[winner], text, finish_reason, usage
+
+
+def _is_truncated(finish_reason):
+    reason = (finish_reason or "").upper()
+    return "MAX_TOKENS" in reason or reason.endswith("LENGTH")
+
+
+def _is_blocked(finish_reason):
+    reason = (finish_reason or "").upper()
+    return "PROHIBITED_CONTENT" in reason or "RECITATION" in reason
+
+
+def _request(key, contents, config, partial=None, model=None):
+    """
+    Run one request on key, with model or else the key's own, and return
+    (text, finish_reason, usage_metadata). With streaming on, text is
+    appended to the open file partial as it arrives. A stream still running
+    after request_timeout raises TimeoutError; the client's own timeout
+    covers a stream that stalls.
+    """
+    started = time.monotonic()
+    model = model or key.model
+    if not use_streaming:
+        response = key.client.models.generate_content(model=model, contents=contents, config=config)
+        _record_latency(time.monotonic() - started)
+        text = _extract_text_from_response(response)
+        if partial is not None and text:
+            partial.write(text)
+            partial.flush()
+        usage = getattr(response, "usage_metadata", None)
+        if quota_budget is not None:
+            quota_budget.record(key.quota_id, usage_tokens(usage))
+        return text, _get_finish_reason(response), usage
+    pieces = []
+    finish_reason = ""
+    usage = None
+    for chunk in key.client.models.generate_content_stream(model=model, contents=contents, config=config):
+        if not pieces and not finish_reason:
+            request_stats.record_first_byte(time.monotonic() - started)
+        if request_timeout and time.monotonic() - started > request_timeout:
+            raise TimeoutError(f"request still streaming after {request_timeout:.0f}s")
+        piece = getattr(chunk, "text", None) or ""
+        if piece:
+            pieces.append(piece)
+            if partial is not None:
+                partial.write(piece)
+                partial.flush()
+        finish_reason = _get_finish_reason(chunk) or finish_reason
+        usage = getattr(chunk, "usage_metadata", None) or usage
+    _record_latency(time.monotonic() - started)
+    if quota_budget is not None:
+        quota_budget.record(key.quota_id, usage_tokens(usage))
+    return "".join(pieces), finish_reason, usage
+
+
+def _record_latency(seconds):
+    request_stats.record_latency(seconds)
+    if hedger is not None:
+        hedger.observe(seconds)
+
+
+def _join_continuation(text, more):
+    """
+    Append a continuation, dropping any text it repeats from the end of the
+    output so far.
+    """
+    for k in range(min(len(text), len(more), 200), 7, -1):
+        if text.endswith(more[:k]):
+            return text + more[k:]
+    return text + more
+
+
+class TruncatedText(str):
+    """
+    OCR text that was still cut off at the token limit after
+    MAX_CONTINUATIONS continuations; written as N.fail.txt, not N.md.
+    """
+
+
+# Where a truncated page's text is kept; not *.md, so merging skips it.
+PARTIAL_TEXT_SUFFIX = ".fail.txt"
+
+
+def _continue_text(key, contents, config, text, finish_reason, partial, page_num, pages, model=None):
+    """
+    Ask the model to carry on from truncated output until it stops on its
+    own, up to MAX_CONTINUATIONS times. Continuations stay on the key that
+    started the page. Returns (text, finish_reason), with text a
+    TruncatedText when it never stopped.
+    """
+    for _ in range(MAX_CONTINUATIONS):
+        if not _is_truncated(finish_reason):
+            break
+        request_stats.record_continuation()
+        follow_up = contents + [
+            types.Content(role="model", parts=[types.Part.from_text(text=text)]),
+            types.Content(role="user", parts=[types.Part.from_text(text=CONTINUE_PROMPT)]),
+        ]
+        key.limiter.acquire()
+        try:
+            more, finish_reason, usage = _request(key, follow_up, config, model=model)
+        except Exception as e:
+            client_pool.release(key, _classify_error(e), retry_after=_retry_after_seconds(e), error=e)
+            raise
+        client_pool.release(key, "ok")
+        request_stats.record_usage(pages, usage, continuation=True)
+        if _is_blocked(finish_reason) or not more:
+            break
+        joined = _join_continuation(text, more)
+        if partial is not None:
+            partial.write(joined[len(text):])
+            partial.flush()
+        text = joined
+    if _is_truncated(finish_reason):
+        print(f"\nWarning: page {page_num} still truncated after {MAX_CONTINUATIONS} continuations.")
+        text = TruncatedText(text)
+    return text, finish_reason
+
+
+def _generate_text(prompt_text, parts, page_num, pages=1, partial_path=None, model=None):
+    """
+    Send prompt_text followed by parts as one request to model (default:
+    each key's model from secrets.txt) and return its text, the prohibited
+    sentinel, or None when every attempt came back empty. The prompt comes
+    from the server-side prompt cache when it holds this prompt for that
+    model. Output cut off at the token limit is continued with follow-up
+    requests; while it streams in it is written to partial_path.
+
+    Each attempt goes to the least-loaded usable API key in client_pool,
+    through that key's AdaptiveLimiter. Throttled calls (429/quota) are
+    retried up to MAX_THROTTLED_ATTEMPTS times and do not use up the
+    MAX_ATTEMPTS budget kept for server, network and other errors. A call
+    that sent its key to rest counts as neither: it waits for the quota to
+    refresh and tries again. With hedging on, a request slower than the
+    recent p95 is duplicated onto another key and the first answer is kept.
+    """
+    prohibited_sentinel = "__PROHIBITED_CONTENT__"
+    last_error_message = None
+    attempt = 0
+    throttled_attempts = 0
+    while attempt < MAX_ATTEMPTS:
+        retry_after = None
+        released = False
+        resting = False
+        cache_name = None
+        partial = None
+        key = client_pool.acquire()
+        try:
+            if (
+                key.prompt_cache is not None
+                and key.prompt_cache.prompt_text == prompt_text
+                and model in (None, key.model)
+            ):
+                cache_name = key.prompt_cache.current()
+            if cache_name:
+                content = types.Content(role="user", parts=parts)
+                config = types.GenerateContentConfig(cached_content=cache_name)
+            else:
+                content = types.Content(role="user", parts=[types.Part.from_text(text=prompt_text)] + parts)
+                config = None
+            if partial_path:
+                partial = open(partial_path, "w", encoding="utf-8")
+            if hedger is None:
+                content_text, finish_reason, usage = _request(key, [content], config, partial, model)
+            else:
+                inline = types.Content(role="user", parts=[types.Part.from_text(text=prompt_text)] + parts)
+                winner, content_text, finish_reason, usage = _hedged_request(
+                    key, [content], config, partial, model, [inline]
+                )
+                if winner is not key:
+                    # The duplicate answered first; the original releases its own key when it stops.
+                    key, content, config, cache_name = winner, inline, None, None
+            client_pool.release(key, "ok")
+            released = True
+            request_stats.record_usage(pages, usage)
+
+            if _is_blocked(finish_reason):
+                return prohibited_sentinel
+            if content_text and _is_truncated(finish_reason):
+                content_text, finish_reason = _continue_text(
+                    key, [content], config, content_text, finish_reason, partial, page_num, pages, model
+                )
+                if _is_blocked(finish_reason):
+                    return prohibited_sentinel
+
+            if content_text:
+                return content_text
+            attempt += 1
+
+        except Exception as e:
+            outcome = _classify_error(e)
+            retry_after = _retry_after_seconds(e)
+            if not released:
+                resting = client_pool.release(key, outcome, retry_after=retry_after, error=e)
+            if cache_name and _is_cache_error(e):
+                key.prompt_cache.drop(cache_name, e)
+
+            error_message = f"\nError processing page {page_num}:\n"
+            error_message += f"API Key: {key.label}\n"
+            error_message += f"Error Type: {type(e).__name__}\n"
+            error_message += f"Error Message: {str(e)}\n"
+            error_message += f"Error Class: {outcome}\n"
+
+            if hasattr(e, 'status_code'):
+                error_message += f"Status Code: {e.status_code}\n"
+            if hasattr(e, 'response'):
+                error_message += f"Response: {e.response}\n"
+            if hasattr(e, 'details'):
+                error_message += f"Details: {e.details}\n"
+            last_error_message = error_message
+            if outcome == "throttled" and resting:
+                pass
+            elif outcome == "throttled" and throttled_attempts < MAX_THROTTLED_ATTEMPTS:
+                throttled_attempts += 1
+            else:
+                attempt += 1
+            if attempt >= MAX_ATTEMPTS:
+                if last_error_message:
+                    print(last_error_message)
+                raise RuntimeError(last_error_message or error_message) from e
+
+        finally:
+            if partial is not None:
+                partial.close()
+
+        if attempt < MAX_ATTEMPTS:
+            time.sleep(client_pool.backoff_delay(key, attempt + throttled_attempts, retry_after))
+
+    return None
+ 
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "pdf-set", "ocr")
+
+
+class OcrCache:
+    """
+    Persistent content-addressed cache of OCR results.
+
+    Entries live in <cache_dir>/<key[:2]>/<key><suffix> where key is a sha256
+    over the image bytes, the prompt text and the model name. A hit refreshes
+    the entry's mtime; once the cache grows past max_bytes the least recently
+    used entries are evicted. The same class with a different suffix holds
+    preprocessed upload images.
+    """
+
+    def __init__(self, cache_dir, max_bytes, suffix=".md"):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(size for _, size, _ in self._entries())
+
+    @staticmethod
+    def make_key(image_bytes, prompt_text, model):
+        h = hashlib.sha256()
+        for part in (image_bytes, prompt_text.encode("utf-8"), model.encode("utf-8")):
+            h.update(len(part).to_bytes(8, "big"))
+            h.update(part)
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.suffix}")
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(self.suffix):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def get(self, key):
+        data = self.get_bytes(key)
+        return data.decode("utf-8") if data is not None else None
+
+    def put(self, key, text):
+        self.put_bytes(key, text.encode("utf-8"))
+
+    def get_bytes(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put_bytes(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            self._size += len(data)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+ocr_cache = None
+upload_cache = None
+
+
+def configure_cache(cache_dir, max_mb):
+    """
+    Enable the shared OCR result cache, and next to it the cache of
+    preprocessed upload images (each limited to max_mb); pass cache_dir=None
+    to disable both.
+    """
+    global ocr_cache, upload_cache
+    max_bytes = int(max_mb * 1024 * 1024)
+    ocr_cache = OcrCache(cache_dir, max_bytes) if cache_dir else None
+    upload_cache = OcrCache(os.path.join(cache_dir, "upload"), max_bytes, suffix=".img") if cache_dir else None
+    return ocr_cache
+
+
+class RequestStats:
+    """
+    Upload sizes, API call latencies and token usage, summarised at the end
+    of a run so runs with and without upload preprocessing or multi-page
+    packing can be compared.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.pages = 0
+        self.original_bytes = 0
+        self.sent_bytes = 0
+        self.latencies = []
+        self.first_bytes = []
+        # Seconds from a page's start to its result, queueing and retries included.
+        self.page_latencies = []
+        self.continuations = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        # "single" / "packed" -> [requests, pages, prompt tokens, output tokens, cached tokens]
+        self.usage = {}
+        # model -> pages kept from it, and {reason: count} of pages escalated
+        # away from it or kept from the last model despite failing the checks
+        self.tiers = {}
+
+    def record_upload(self, original_bytes, sent_bytes):
+        with self._lock:
+            self.pages += 1
+            self.original_bytes += original_bytes
+            self.sent_bytes += sent_bytes
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self.latencies.append(seconds)
+
+    def record_page(self, seconds):
+        with self._lock:
+            self.page_latencies.append(seconds)
+
+    def record_hedge(self, won=False):
+        with self._lock:
+            if won:
+                self.hedges_won += 1
+            else:
+                self.hedges += 1
+
+    def record_first_byte(self, seconds):
+        with self._lock:
+            self.first_bytes.append(seconds)
+
+    def record_continuation(self):
+        with self._lock:
+            self.continuations += 1
+
+    def _tier(self, model):
+        return self.tiers.setdefault(model, {"pages": 0, "escalated": {}, "kept_failing": {}})
+
+    def record_tier(self, model, reason=""):
+        """
+        Count a page whose output was kept from model; reason is set when it
+        still failed the checks on the last model.
+        """
+        with self._lock:
+            tier = self._tier(model)
+            tier["pages"] += 1
+            if reason:
+                tier["kept_failing"][reason] = tier["kept_failing"].get(reason, 0) + 1
+
+    def record_escalation(self, model, reason):
+        with self._lock:
+            escalated = self._tier(model)["escalated"]
+            escalated[reason] = escalated.get(reason, 0) + 1
+
+    def record_usage(self, pages, usage_metadata, continuation=False):
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+        output_tokens = getattr(usage_metadata, "candidates_token_count", None) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        with self._lock:
+            totals = self.usage.setdefault("single" if pages == 1 else "packed", [0, 0, 0, 0, 0])
+            totals[0] += 1
+            # Continuations add tokens to pages already counted.
+            totals[1] += 0 if continuation else pages
+            totals[2] += prompt_tokens
+            totals[3] += output_tokens
+            totals[4] += cached_tokens
+
+    def per_page(self):
+        """
+        Requests and tokens per OCR'd page so far, or None before the first.
+        """
+        with self._lock:
+            totals = [sum(values) for values in zip(*self.usage.values())]
+        if not totals or not totals[1]:
+            return None
+        return {"requests": totals[0] / totals[1], "tokens": (totals[2] + totals[3]) / totals[1]}
+
+    def summary(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            pages, original, sent = self.pages, self.original_bytes, self.sent_bytes
+        saved = (1 - sent / original) * 100 if original else 0.0
+        text = (
+            f"Upload: {pages} pages, {original / 1048576:.1f} MB -> {sent / 1048576:.1f} MB "
+            f"({saved:.0f}% saved)"
+        )
+        if latencies:
+            mean = sum(latencies) / len(latencies)
+            text += (
+                f"; API latency over {len(latencies)} calls: mean {mean:.2f}s, "
+                f"p50 {_percentile(latencies, 0.5):.2f}s, p95 {_percentile(latencies, 0.95):.2f}s, "
+                f"p99 {_percentile(latencies, 0.99):.2f}s"
+            )
+        with self._lock:
+            first_bytes = sorted(self.first_bytes)
+            page_latencies = sorted(self.page_latencies)
+            continuations = self.continuations
+            hedges, hedges_won = self.hedges, self.hedges_won
+        if first_bytes:
+            text += f", first byte p50 {first_bytes[len(first_bytes) // 2]:.2f}s"
+        if page_latencies:
+            text += (
+                f"\nPage latency over {len(page_latencies)} pages: p50 {_percentile(page_latencies, 0.5):.2f}s, "
+                f"p95 {_percentile(page_latencies, 0.95):.2f}s, p99 {_percentile(page_latencies, 0.99):.2f}s, "
+                f"max {page_latencies[-1]:.2f}s"
+            )
+        if hedges:
+            text += f"\nHedged requests: {hedges} duplicates sent, {hedges_won} answered first"
+        if continuations:
+            text += f"\nTruncated output continued: {continuations} follow-up requests"
+        with self._lock:
+            usage = {mode: list(totals) for mode, totals in self.usage.items()}
+        for mode in ("single", "packed"):
+            if mode not in usage:
+                continue
+            requests, pages, prompt_tokens, output_tokens, _ = usage[mode]
+            text += (
+                f"\nTokens ({mode}): {requests} requests, {pages} pages, "
+                f"{prompt_tokens / pages:.0f} input + {output_tokens / pages:.0f} output per page"
+            )
+        with self._lock:
+            tiers = [(model, dict(tier)) for model, tier in self.tiers.items()]
+        for model, tier in tiers:
+            text += f"\nModel {model}: {tier['pages']} pages kept"
+            for label, reasons in (("escalated", tier["escalated"]), ("kept despite", tier["kept_failing"])):
+                if reasons:
+                    detail = ", ".join(f"{reason} {count}" for reason, count in sorted(reasons.items()))
+                    text += f", {sum(reasons.values())} {label} ({detail})"
+        cached = sum(totals[4] for totals in usage.values())
+        if cached:
+            prompt_total = sum(totals[2] for totals in usage.values())
+            text += (
+                f"\nPrompt cache: {cached} of {prompt_total} input tokens served from cache "
+                f"({cached / prompt_total * 100:.0f}%)"
+            )
+        return text
+
+
+request_stats = RequestStats()
+
+upload_settings = None
+
+
+def configure_upload(grayscale=True, trim=True, max_edge=1600, max_kb=300, fmt="jpeg"):
+    """
+    Enable upload preprocessing (see upload_prep.prepare_upload).
+    """
+    global upload_settings
+    upload_settings = dict(grayscale=grayscale, trim=trim, max_edge=max_edge, max_kb=max_kb, fmt=fmt)
+    return upload_settings
+
+
+def _prepare_image(image_bytes):
+    """
+    Return (bytes, mime_type) to upload; mime_type is None when preprocessing
+    is off and the original bytes are sent as they are.
+    """
+    if upload_settings is None:
+        return image_bytes, None
+    key = OcrCache.make_key(image_bytes, settings_key(**upload_settings), "")
+    if upload_cache is not None:
+        data = upload_cache.get_bytes(key)
+        if data is not None:
+            return data, sniff_mime_type(data)
+    data, mime_type = prepare_upload(image_bytes, **upload_settings)
+    if upload_cache is not None:
+        upload_cache.put_bytes(key, data)
+    return data, mime_type
+
+
+def _upload_bytes(image_path, image_bytes=None):
+    """
+    Return (bytes, mime_type) to send for one page, after preprocessing.
+    """
+    if image_bytes is None:
+        image_bytes = _read_image_bytes(image_path)
+    original_size = len(image_bytes)
+    image_bytes, mime_type = _prepare_image(image_bytes)
+    request_stats.record_upload(original_size, len(image_bytes))
+    return image_bytes, mime_type
+
+
+def _cache_model():
+    """
+    The models a page's text may come from, for the cache key: the model
+    chain, else every key's own model, since any key may answer.
+    """
+    if model_chain:
+        return ",".join(model_chain)
+    return ",".join(sorted({key.model for key in client_pool.keys})) or MODEL
+
+
+def _cached_text(image_bytes, prompt_text):
+    if ocr_cache is None:
+        return None
+    return ocr_cache.get(OcrCache.make_key(image_bytes, prompt_text, _cache_model()))
+
+
+def _cache_text(image_bytes, prompt_text, text):
+    if ocr_cache is not None and text and text != "__PROHIBITED_CONTENT__" and not isinstance(text, TruncatedText):
+        ocr_cache.put(OcrCache.make_key(image_bytes, prompt_text, _cache_model()), text)
+
+
+def ocr_image(image_path, page_num, prompt_text, image_bytes=None, partial_path=None):
+    """
+    OCR one image, answering from the result cache when the same image,
+    prompt and model were transcribed before. image_bytes may be given for
+    pages that only exist in memory; image_path is then just a label. With
+    upload preprocessing on, the processed image is what is sent and cached.
+    Pages in fallback_pages skip the first model of the chain.
+    """
+    image_bytes, mime_type = _upload_bytes(image_path, image_bytes)
+    text = _cached_text(image_bytes, prompt_text)
+    if text is not None:
+        return text
+    text = extract_text_from_gemini_api(
+        image_path,
+        page_num,
+        prompt_text,
+        image_bytes=image_bytes,
+        mime_type=mime_type,
+        partial_path=partial_path,
+        first_tier=1 if _page_name(image_path) in fallback_pages else 0,
+    )
+    _cache_text(image_bytes, prompt_text, text)
+    return text
+
+
+model_chain = []
+# Pages an earlier run left prohibited, retried from the chain's second model.
+fallback_pages = set()
+
+# Local checks that send a page on to the next model in the chain.
+LOOP_MIN_REPEATS = 20
+LOOP_MIN_SPAN = 200
+LOOP_RE = re.compile(r"(.{1,50}?)\1{%d,}" % (LOOP_MIN_REPEATS - 1), re.DOTALL)
+# Characters per unit of ink, compared with the median of recently accepted pages.
+DENSITY_LOW = 0.25
+DENSITY_HIGH = 4.0
+DENSITY_SAMPLES = 25
+DENSITY_MIN_SAMPLES = 5
+
+_recent_density = deque(maxlen=DENSITY_SAMPLES)
+_density_lock = threading.Lock()
+
+
+def configure_models(models):
+    """
+    OCR every page with models[0] first and move it to the next model when
+    the output fails check_page_text; None or [] uses each key's own model.
+    """
+    global model_chain
+    model_chain = [m.strip() for m in models or [] if m.strip()]
+    fallback_pages.clear()
+    _recent_density.clear()
+    return model_chain
+
+
+def page_ink(image_bytes):
+    return analyze_image(io.BytesIO(image_bytes))["ink"]
+
+
+def _has_loop(text):
+    for match in LOOP_RE.finditer(text):
+        if len(match.group(0)) >= LOOP_MIN_SPAN and any(ch.isalnum() for ch in match.group(1)):
+            return True
+    return False
+
+
+def check_page_text(text, ink):
+    """
+    Why one page's OCR text looks wrong, or "" when it passes: prohibited,
+    truncated, empty on a page with ink, a repetition loop, or far fewer or
+    more characters for its ink than the recently accepted pages.
+    """
+    if text == "__PROHIBITED_CONTENT__":
+        return "prohibited"
+    if isinstance(text, TruncatedText):
+        return "truncated"
+    if not text or not text.strip():
+        return "empty" if text is None or ink >= DEFAULT_BLANK_INK else ""
+    if _has_loop(text):
+        return "loop"
+    if ink >= DEFAULT_BLANK_INK:
+        with _density_lock:
+            densities = sorted(_recent_density)
+        if len(densities) >= DENSITY_MIN_SAMPLES:
+            median = densities[len(densities) // 2]
+            density = len(text.strip()) / ink
+            if density < median * DENSITY_LOW:
+                return "short"
+            if density > median * DENSITY_HIGH:
+                return "long"
+    return ""
+
+
+def _accept_page(text, ink, model, reason=""):
+    if text and text != "__PROHIBITED_CONTENT__" and not reason and ink >= DEFAULT_BLANK_INK:
+        with _density_lock:
+            _recent_density.append(len(text.strip()) / ink)
+    request_stats.record_tier(model, reason)
+
+
+def ocr_with_models(prompt_text, parts, page_num, image_bytes, partial_path=None, first_tier=0):
+    """
+    OCR one page's parts down the model chain from first_tier: the first
+    output that passes check_page_text is kept, and the last model's output
+    is kept whatever it is. Without a chain this is one _generate_text call.
+    """
+    if not model_chain:
+        return _generate_text(prompt_text, parts, page_num, partial_path=partial_path)
+    ink = page_ink(image_bytes)
+    last = len(model_chain) - 1
+    text = None
+    for tier in range(min(first_tier, last), last + 1):
+        model = model_chain[tier]
+        text = _generate_text(prompt_text, parts, page_num, partial_path=partial_path, model=model)
+        reason = check_page_text(text, ink)
+        if not reason or tier == last:
+            _accept_page(text, ink, model, reason)
+            return text
+        request_stats.record_escalation(model, reason)
+        print(f"\nPage {page_num}: {reason} output from {model}, retrying on {model_chain[tier + 1]}.")
+    return text
+
+
+pages_per_request = 1
+
+PAGE_MARKER = "<<<PAGE {}>>>"
+PAGE_MARKER_RE = re.compile(r"^[ \t]*<<<PAGE (\d+)>>>[ \t]*$", re.MULTILINE)
+PACKED_INSTRUCTIONS = """
+
+## 多页模式
+下面依次给出同一本书中连续的 {count} 页图片，分别标为「第 1 页」到「第 {count} 页」。
+请按以上规则逐页单独识别，每页各自从起始字符写到结束字符，不要把相邻两页的内容合并或挪动。
+每页的识别结果前单独输出一行分隔标记 `{marker}`（例如第 1 页为 `{first_marker}`），按页序输出；
+空页也要输出它的分隔标记。除分隔标记外不要输出任何其他说明。
+"""
+
+
+def configure_packing(count):
+    """
+    OCR up to count consecutive pages per request (1 disables packing).
+    """
+    global pages_per_request
+    pages_per_request = max(1, int(count))
+    return pages_per_request
+
+
+def split_packed_response(text, count):
+    """
+    Split a packed response into count page texts, or return None unless
+    every page's marker appears exactly once and in order.
+    """
+    markers = list(PAGE_MARKER_RE.finditer(text))
+    if [int(m.group(1)) for m in markers] != list(range(1, count + 1)):
+        return None
+    if text[:markers[0].start()].strip():
+        return None
+    pages = []
+    for i, marker in enumerate(markers):
+        end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+        pages.append(text[marker.end():end].strip("\n"))
+    return pages
+
+
+def ocr_packed(pages, prompt_text):
+    """
+    OCR several (image_path, page_num, image_bytes, mime_type) pages in one
+    request. Returns their texts in order, or None when the response cannot
+    be split back into exactly those pages.
+    """
+    instructions = PACKED_INSTRUCTIONS.format(
+        count=len(pages), marker=PAGE_MARKER.format("序号"), first_marker=PAGE_MARKER.format(1)
+    )
+    parts = [types.Part.from_text(text=instructions)]
+    for k, (image_path, _, image_bytes, mime_type) in enumerate(pages, start=1):
+        parts.append(types.Part.from_text(text=f"第 {k} 页："))
+        parts.append(
+            types.Part.from_bytes(data=image_bytes, mime_type=mime_type or _guess_mime_type(image_path, image_bytes))
+        )
+    label = f"{pages[0][1]}-{pages[-1][1]}"
+    text = _generate_text(prompt_text, parts, label, pages=len(pages), model=model_chain[0] if model_chain else None)
+    if not text or text == "__PROHIBITED_CONTENT__" or isinstance(text, TruncatedText):
+        return None
+    return split_packed_response(text, len(pages))
+
+
+def run_sliding_window(items, worker, max_in_flight, on_done):
+    """
+    Run worker(item) for every item on a fixed thread pool, keeping at most
+    max_in_flight calls outstanding and starting the next item as soon as any
+    slot frees up. on_done(item, future) is called in completion order on the
+    calling thread; if it raises, no further items are started.
+    """
+    max_in_flight = max(1, int(max_in_flight))
+    pending = iter(items)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = {}
+
+        def _submit_next():
+            for item in pending:
+                in_flight[executor.submit(worker, item)] = item
+                return True
+            return False
+
+        for _ in range(max_in_flight):
+            if not _submit_next():
+                break
+        while in_flight:
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                item = in_flight.pop(future)
+                on_done(item, future)
+                _submit_next()
+
+
+def _ocr_page(journal, output_dir, prompt_text, idx, image_path, image_bytes=None):
+    """
+    OCR one page, write N.md (or N.fail.md) and record it in the journal.
+    Returns the journal state; raises when the page cannot be OCR'd at all.
+    """
+    base_name = _page_name(image_path)
+    journal.start(base_name, image_path)
+    started = time.monotonic()
+    try:
+        text = ocr_image(
+            image_path, idx, prompt_text, image_bytes=image_bytes, partial_path=_partial_path(output_dir, base_name)
+        )
+    except Exception:
+        journal.finish(base_name, STATE_FAIL, time.monotonic() - started)
+        raise
+    return _write_page_result(journal, output_dir, idx, base_name, text, time.monotonic() - started)
+
+
+def _ocr_chunk(journal, output_dir, prompt_text, chunk):
+    """
+    OCR a chunk of consecutive (idx, image_path, image_bytes) pages, packing
+    the ones not in the cache into one request. Pages fall back to their own
+    requests when the packed response cannot be split, and with a model chain
+    pages whose packed output fails the checks go to the next model on
+    their own. Returns the states.
+    """
+    if len(chunk) == 1 or any(_page_name(image_path) in fallback_pages for _, image_path, _ in chunk):
+        return [_ocr_page(journal, output_dir, prompt_text, *page) for page in chunk]
+    started = time.monotonic()
+    texts = {}
+    to_send = []
+    for idx, image_path, image_bytes in chunk:
+        journal.start(_page_name(image_path), image_path)
+        image_bytes, mime_type = _upload_bytes(image_path, image_bytes)
+        text = _cached_text(image_bytes, prompt_text)
+        if text is not None:
+            texts[idx] = text
+        else:
+            to_send.append((image_path, idx, image_bytes, mime_type))
+    try:
+        packed = ocr_packed(to_send, prompt_text) if len(to_send) > 1 else None
+        # Pages sent on their own, with the chain tier each starts at.
+        single = []
+        if packed is not None:
+            for page, text in zip(to_send, packed):
+                image_path, idx, image_bytes, _ = page
+                if model_chain:
+                    ink = page_ink(image_bytes)
+                    reason = check_page_text(text, ink)
+                    if reason and len(model_chain) > 1:
+                        request_stats.record_escalation(model_chain[0], reason)
+                        print(f"\nPage {idx}: {reason} output from {model_chain[0]}, retrying on {model_chain[1]}.")
+                        single.append((page, 1))
+                        continue
+                    _accept_page(text, ink, model_chain[0], reason)
+                texts[idx] = text
+                _cache_text(image_bytes, prompt_text, text)
+        else:
+            single = [(page, 0) for page in to_send]
+        for (image_path, idx, image_bytes, mime_type), first_tier in single:
+            text = extract_text_from_gemini_api(
+                image_path,
+                idx,
+                prompt_text,
+                image_bytes=image_bytes,
+                mime_type=mime_type,
+                partial_path=_partial_path(output_dir, _page_name(image_path)),
+                first_tier=first_tier,
+            )
+            texts[idx] = text
+            _cache_text(image_bytes, prompt_text, text)
+    except Exception:
+        latency = time.monotonic() - started
+        for idx, image_path, _ in chunk:
+            if idx not in texts:
+                journal.finish(_page_name(image_path), STATE_FAIL, latency)
+        raise
+    # Packed pages share the request's latency.
+    latency = (time.monotonic() - started) / len(chunk)
+    states = []
+    error = None
+    for idx, image_path, _ in chunk:
+        try:
+            states.append(_write_page_result(journal, output_dir, idx, _page_name(image_path), texts[idx], latency))
+        except RuntimeError as e:
+            error = error or e
+    if error:
+        raise error
+    return states
+
+
+def _chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _partial_path(output_dir, base_name):
+    return os.path.join(output_dir, f"{base_name}.md.part")
+
+
+def _write_page_result(journal, output_dir, idx, base_name, text, latency):
+    """
+    Write a page's OCR text as N.md and record it. A prohibited or
+    truncated page gets an empty N.fail.md instead; a truncated page's text
+    so far goes to N.fail.txt, out of the way of merge_rough.py.
+    N.md is written to N.md.part first and renamed into place, so it is
+    never seen half-written.
+    """
+    part_path = _partial_path(output_dir, base_name)
+    request_stats.record_page(latency)
+    if text == "__PROHIBITED_CONTENT__" or text is None or isinstance(text, TruncatedText):
+        # Drop whatever streamed in before the request was blocked, came back empty or ran out.
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+    if isinstance(text, TruncatedText):
+        _write_truncated(output_dir, base_name, text)
+        journal.finish(base_name, STATE_TRUNCATED, latency)
+        return STATE_TRUNCATED
+    if text == "__PROHIBITED_CONTENT__":
+        out_path = os.path.join(output_dir, f"{base_name}.fail.md")
+        try:
+            with open(out_path, 'w', encoding='utf-8') as md_file:
+                md_file.write("")
+        except Exception as e:
+            # Suppress write errors during processing
+            pass
+        journal.finish(base_name, STATE_PROHIBITED, latency)
+        return STATE_PROHIBITED
+    if text is None:
+        journal.finish(base_name, STATE_FAIL, latency)
+        raise RuntimeError(f"No content after {MAX_ATTEMPTS} attempts on page {idx}. Please intervene.")
+    out_path = os.path.join(output_dir, f"{base_name}.md")
+    try:
+        with open(part_path, 'w', encoding='utf-8') as md_file:
+            md_file.write(text)
+        os.replace(part_path, out_path)
+    except Exception as e:
+        # Suppress write errors during processing
+        journal.finish(base_name, STATE_FAIL, latency)
+        return STATE_FAIL
+    journal.finish(base_name, STATE_DONE, latency, text)
+    return STATE_DONE
+
+
+def _write_truncated(output_dir, base_name, text):
+    """
+    Write an empty N.fail.md for a truncated page and the text it got to
+    N.fail.txt. Returns the N.fail.md path.
+    """
+    fail_path = os.path.join(output_dir, f"{base_name}.fail.md")
+    try:
+        with open(fail_path, "w", encoding="utf-8") as md_file:
+            md_file.write("")
+        with open(os.path.join(output_dir, f"{base_name}{PARTIAL_TEXT_SUFFIX}"), "w", encoding="utf-8") as txt_file:
+            txt_file.write(text)
+    except Exception as e:
+        # Suppress write errors during processing
+        pass
+    return fail_path
 
 
-def find_max_index(output_dir):
+def _per_page_usage():
     """
-    Find the last continuous numeric index starting from 0 in output_dir.
-    Returns -1 if 0 is missing or directory doesn't exist.
+    Requests and tokens per page from this run, else from the last run the
+    quota budget remembers, else one request per packed chunk.
     """
-    if not os.path.isdir(output_dir):
-        return -1
-    nums = set()
-    for name in os.listdir(output_dir):
-        if name.endswith(".md"):
-            stem = os.path.splitext(name)[0]
-            if stem.isdigit():
-                nums.add(int(stem))
-    idx = 0
-    while idx in nums:
-        idx += 1
-    return idx - 1
+    usage = request_stats.per_page()
+    if usage is None and quota_budget is not None:
+        usage = quota_budget.per_page or None
+    return usage or {"requests": 1.0 / pages_per_request}
 
 
-def find_max_image_index(images_dir):
+def quota_projection(pages_left):
     """
-    Find the maximum numeric index from image filenames in images_dir.
-    Returns -1 if no numeric image files are found.
+    Say whether pages_left fit in the API keys' current quota windows, or
+    None when the budget does not know the keys' limits yet.
     """
-    if not os.path.isdir(images_dir):
-        return -1
-    exts = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
-    max_idx = -1
-    for name in os.listdir(images_dir):
-        if name.lower().endswith(exts):
-            stem = os.path.splitext(name)[0]
-            if stem.isdigit():
-                max_idx = max(max_idx, int(stem))
-    return max_idx
+    if quota_budget is None:
+        return None
+    usage = _per_page_usage()
+    tokens_per_request = usage.get("tokens", 0) / usage["requests"] or None
+    outlook = quota_budget.outlook(client_pool.quota_ids(), tokens_per_request)
+    if outlook is None:
+        return None
+    left, capacity, reset_in = outlook
+    needed = int(pages_left * usage["requests"] + 0.5)
+    text = f"Quota: about {left} requests left in this window, {capacity} per window (refresh in {_format_duration(reset_in)}); "
+    if needed <= left:
+        return text + f"{pages_left} pages need about {needed}, which fits."
+    windows = -(-(needed - left) // max(1, capacity))
+    return text + f"{pages_left} pages need about {needed}, expect {windows} pause(s) for the quota to refresh."
 
 
-def _load_prompt(prompt_path):
-    if prompt_path and os.path.isfile(prompt_path):
-        with open(prompt_path, "r", encoding="utf-8") as f:
-            content = f.read().strip()
-            if content:
-                return content
-    return "Extract and transcribe any visible text from this image, exactly as it appears."
+def _eta_text(pages_left, pages_done, active_seconds):
+    if not pages_done or active_seconds <= 0 or not pages_left:
+        return ""
+    usage = _per_page_usage()
+    pages_per_second = pages_done / active_seconds
+    if quota_budget is None:
+        return f"eta={_format_duration(pages_left / pages_per_second)}"
+    tokens_per_request = usage.get("tokens", 0) / usage["requests"] or None
+    seconds, pauses = quota_budget.eta(
+        client_pool.quota_ids(),
+        pages_left * usage["requests"],
+        pages_per_second * usage["requests"],
+        tokens_per_request,
+    )
+    text = f"eta={_format_duration(seconds)}"
+    if pauses:
+        text += f" ({pauses} quota pause{'s' if pauses > 1 else ''})"
+    return text
 
 
-def extract_text_from_gemini_api(image_path, page_num, prompt_text):
+def _run_pages(items, total, journal, output_dir, prompt_text, batch_size, duplicates=None):
     """
-    Sends the image to a GenAI-compatible API and retrieves the extracted text.
-    Added detailed logging and error information.
+    OCR (idx, image_path, image_bytes) items on the sliding-window scheduler
+    with progress reporting; exits on the first page that cannot be OCR'd.
+    When every API key is out of quota the run pauses until the quota
+    refreshes; the ETA counts those pauses. Pages in duplicates
+    (page -> original) are then filled from their originals.
     """
-    prohibited_sentinel = "__PROHIBITED_CONTENT__"
-    last_error_message = None
-    for attempt in range(1, 6):
+    completed = 0
+    fail_count = 0
+    batch_size = max(1, int(batch_size))
+    # Keep enough pages in flight for the limiter to grow into; it gates the actual calls.
+    max_in_flight = max(batch_size, client_pool.max_limit)
+    started = time.monotonic()
+    projection = quota_projection(total)
+    if projection:
+        print(projection)
+    update_progress(0, total, client_pool.status_text())
+
+    def _on_done(chunk, future):
+        nonlocal completed, fail_count
         try:
-            image_bytes = _read_image_bytes(image_path)
-            content = types.Content(
-                role="user",
-                parts=[
-                    types.Part.from_text(text=prompt_text),
-                    types.Part.from_bytes(data=image_bytes, mime_type=_guess_mime_type(image_path)),
-                ],
-            )
-            response = client.models.generate_content(
-                model=MODEL,
-                contents=[content],
-            )
+            states = future.result()
+        except Exception as e:
+            print(f"\n{e}")
+            sys.exit(1)
+        fail_count += states.count(STATE_PROHIBITED) + states.count(STATE_TRUNCATED)
+        completed += len(states)
+        eta = _eta_text(total - completed, completed, client_pool.active_seconds(started))
+        update_progress(completed, total, f"{client_pool.status_text()} {eta}".strip())
 
-            finish_reason = _get_finish_reason(response)
-            if finish_reason and "PROHIBITED_CONTENT" in finish_reason.upper():
-                return prohibited_sentinel
-            if finish_reason and "RECITATION" in finish_reason.upper():
-                return prohibited_sentinel
+    # With packing each window slot holds one request of up to pages_per_request pages.
+    run_sliding_window(
+        _chunked(items, pages_per_request),
+        lambda chunk: _ocr_chunk(journal, output_dir, prompt_text, chunk),
+        max_in_flight,
+        _on_done,
+    )
+    elapsed = time.monotonic() - started
 
-            content_text = _extract_text_from_response(response)
-            if content_text:
-                return content_text
+    if duplicates:
+        print(f"Duplicate pages filled from their originals: {apply_duplicates(output_dir, journal, duplicates)}")
+    journal.close()
+    if quota_budget is not None:
+        quota_budget.per_page = request_stats.per_page() or quota_budget.per_page
+        quota_budget.save()
+    print(client_pool.summary())
+    print(request_stats.summary())
+    if completed and elapsed > 0:
+        print(f"Throughput: {completed / elapsed * 60:.1f} pages/min ({pages_per_request} pages per request)")
+    if client_pool.paused_seconds:
+        print(f"Paused for quota: {_format_duration(client_pool.paused_seconds)}")
+    if ocr_cache is not None:
+        print(f"Cache hits: {ocr_cache.hits}, misses: {ocr_cache.misses}")
+    if fail_count:
+        print(f"Fail pages: {fail_count}")
 
-        except Exception as e:
-            error_message = f"\nError processing page {page_num}:\n"
-            error_message += f"Error Type: {type(e).__name__}\n"
-            error_message += f"Error Message: {str(e)}\n"
 
-            if hasattr(e, 'status_code'):
-                error_message += f"Status Code: {e.status_code}\n"
-            if hasattr(e, 'response'):
-                error_message += f"Response: {e.response}\n"
-            if hasattr(e, 'details'):
-                error_message += f"Details: {e.details}\n"
-            last_error_message = error_message
-            if attempt >= 5:
-                if last_error_message:
-                    print(last_error_message)
-                raise RuntimeError(last_error_message or error_message) from e
+def _resume_pages(journal, pages):
+    """
+    The pages still to OCR on resume. With a model chain, pages an earlier
+    run left prohibited or truncated are retried as well, starting at the
+    second model.
+    """
+    missing = set(journal.missing_pages(pages))
+    if len(model_chain) > 1:
+        prohibited = {row[0] for row in journal.rows(FAIL_MD_STATES)} & set(pages)
+        if prohibited:
+            print(f"Retrying {len(prohibited)} prohibited or truncated pages on {model_chain[1]}.")
+        fallback_pages.update(prohibited)
+        missing |= prohibited
+    return missing
 
-        if attempt < 5:
-            delay = 2.0
-            time.sleep(delay)
 
-    return None
- 
-def process_images(images_dir, output_dir, prompt_text, start_idx=None, end_idx=None, batch_size=3):
+def process_images(images_dir, output_dir, prompt_text, start_idx=None, end_idx=None, batch_size=3, resume=False):
     """
     Reads JPG images from images_dir, extracts text using the API,
     and writes one Markdown file per image into output_dir.
+
+    Every page's state is recorded in the book's OCR journal. With resume=True,
+    pages the journal already has as done or prohibited are skipped, so gaps
+    left by failed pages are filled without re-OCRing the pages after them.
+
+    When precheck_images.py has written a report for images_dir, blank pages
+    are never sent and duplicate pages reuse their original page's result.
     """
     if not os.path.isdir(images_dir):
         print(f"Images directory not found: {images_dir}")
@@ -306,55 +2161,208 @@ def process_images(images_dir, output_dir, prompt_text, start_idx=None, end_idx=
         else os.path.basename(p)
     )
 
-    total = len(image_files)
-    fail_count = 0
-    from threading import Lock
-    fail_lock = Lock()
+    journal = OcrJournal(output_dir)
+    journal.import_existing_outputs()
+    duplicates = {}
+    report = load_report(output_dir, images_dir)
+    if report:
+        blank = set(report["blank"])
+        finished = {page for page, state in journal.states().items() if state in FINISHED_STATES}
+        names = {_page_name(p) for p in image_files}
+        # A duplicate is skipped only if its original is OCR'd in this run or already finished.
+        duplicates = {
+            page: original
+            for page, original in report["duplicates"].items()
+            if page in names and (original in names or original in finished)
+        }
+        before = len(image_files)
+        image_files = [p for p in image_files if _page_name(p) not in blank and _page_name(p) not in duplicates]
+        print(f"Precheck: skipping {before - len(image_files)} blank or duplicate pages.")
+    if resume:
+        missing = _resume_pages(journal, [_page_name(p) for p in image_files])
+        skipped = len(image_files) - len(missing)
+        image_files = [p for p in image_files if _page_name(p) in missing]
+        print(f"Resume: {skipped} pages already done, {len(image_files)} pages to OCR.")
+    if not image_files:
+        if duplicates:
+            apply_duplicates(output_dir, journal, duplicates)
+        journal.close()
+        return
+    journal.mark_pending([(_page_name(p), p) for p in image_files])
+
+    items = [(idx, path, None) for idx, path in enumerate(image_files, start=1)]
+    _run_pages(items, len(items), journal, output_dir, prompt_text, batch_size, duplicates)
 
-    def _process_one(image_path, idx):
-        nonlocal fail_count
-        text = extract_text_from_gemini_api(image_path, idx, prompt_text)
+
+def process_pdf_stream(
+    pdf_path,
+    images_dir,
+    output_dir,
+    prompt_text,
+    start_idx=None,
+    end_idx=None,
+    batch_size=3,
+    resume=False,
+    dpi=144,
+    save_images=False,
+    queue_size=8,
+    text_layer=False,
+):
+    """
+    Render PDF pages with pypdfium2 and feed them to the OCR workers through a
+    bounded queue, without writing intermediate image files. Rendering and
+    OCR overlap, so the first pages are transcribed while later pages are
+    still being rendered. Pages are named from 0 as in convert_pdf_to_images.py
+    and encoded to the same JPEG bytes, so OCR cache entries are shared with
+    the images/ workflow. With save_images the images are also written to
+    images_dir; otherwise images_dir only names the pages in the journal.
+    With text_layer, pages whose PDF text layer passes text_layer.py's quality
+    checks are written directly and never rendered or sent to the API.
+    A page that cannot be rendered stops the rendering: the pages already
+    queued are OCR'd, then the error is raised.
+    """
+    if not os.path.isfile(pdf_path):
+        print(f"PDF file not found: {pdf_path}")
+        return
+
+    os.makedirs(output_dir, exist_ok=True)
+    if save_images:
+        os.makedirs(images_dir, exist_ok=True)
+    from_text_layer = set()
+    if text_layer:
+        ranged = start_idx is not None and end_idx is not None
+        report = extract_text_layer(
+            pdf_path,
+            output_dir,
+            first_page=start_idx if ranged else None,
+            last_page=end_idx if ranged else None,
+        )
+        from_text_layer = {int(entry["page"]) for entry in report if entry["accepted"]}
+
+    pdf = pdfium.PdfDocument(pdf_path)
+    page_count = len(pdf)
+    pdf.close()
+    indices = [i for i in range(page_count) if i not in from_text_layer]
+    if start_idx is not None and end_idx is not None:
+        indices = [i for i in indices if start_idx <= i <= end_idx]
+
+    journal = OcrJournal(output_dir)
+    journal.import_existing_outputs()
+    if resume:
+        missing = _resume_pages(journal, [str(i) for i in indices])
+        skipped = len(indices) - len(missing)
+        indices = [i for i in indices if str(i) in missing]
+        print(f"Resume: {skipped} pages already done, {len(indices)} pages to OCR.")
+    if not indices:
+        journal.close()
+        return
+    image_paths = {i: os.path.join(images_dir, f"{i}.jpg") for i in indices}
+    journal.mark_pending([(str(i), image_paths[i]) for i in indices])
+
+    pages = queue.Queue(maxsize=max(1, int(queue_size)))
+    done_marker = object()
+    stop = threading.Event()
+    # Set by the renderer when a page cannot be rendered; raised once the OCR'd pages are in.
+    render_error = []
+
+    def _render():
+        # pdfium is not thread-safe: this thread is the only one touching the document.
+        doc = None
+        i = None
+        try:
+            doc = pdfium.PdfDocument(pdf_path)
+            for idx, i in enumerate(indices, start=1):
+                if stop.is_set():
+                    break
+                image_bytes = encode_image(render_page(doc, i, dpi / 72.0), "jpg")
+                if save_images:
+                    with open(image_paths[i], "wb") as f:
+                        f.write(image_bytes)
+                pages.put((idx, image_paths[i], image_bytes))
+        except Exception as e:
+            render_error.append((i, e))
+        finally:
+            if doc is not None:
+                doc.close()
+            pages.put(done_marker)
+
+    renderer = threading.Thread(target=_render, daemon=True)
+    renderer.start()
+    try:
+        _run_pages(iter(pages.get, done_marker), len(indices), journal, output_dir, prompt_text, batch_size)
+        if render_error:
+            page, error = render_error[0]
+            raise RuntimeError(f"Could not render page {page} of {pdf_path}: {error}") from error
+    finally:
+        stop.set()
+        # Unblock the renderer if it is waiting on a full queue.
+        while renderer.is_alive():
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                renderer.join(0.1)
+
+
+def ocr_single_image(image_path, output_dir, output_file, prompt_text):
+    """
+    OCR one image into output_file (default <output_dir>/<name>.md) and
+    record it in output_dir's journal. Returns (state, path written);
+    raises RuntimeError when every attempt came back empty.
+    """
+    if output_file:
+        out_path = output_file
+        out_dir = os.path.dirname(out_path)
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+    else:
+        os.makedirs(output_dir, exist_ok=True)
         base_name = os.path.splitext(os.path.basename(image_path))[0]
+        out_path = os.path.join(output_dir, f"{base_name}.md")
+
+    base_name = _page_name(image_path)
+    journal = OcrJournal(output_dir)
+    try:
+        journal.start(base_name, image_path)
+        started = time.monotonic()
+        try:
+            text = ocr_image(image_path, 1, prompt_text, partial_path=f"{out_path}.part")
+        except Exception:
+            journal.finish(base_name, STATE_FAIL, time.monotonic() - started)
+            raise
+        latency = time.monotonic() - started
+        if isinstance(text, TruncatedText):
+            fail_path = _write_truncated(output_dir, base_name, text)
+            try:
+                os.remove(f"{out_path}.part")
+            except OSError:
+                pass
+            journal.finish(base_name, STATE_TRUNCATED, latency)
+            return STATE_TRUNCATED, fail_path
         if text == "__PROHIBITED_CONTENT__":
-            out_path = os.path.join(output_dir, f"{base_name}.fail.md")
+            fail_path = os.path.join(output_dir, f"{base_name}.fail.md")
             try:
-                with open(out_path, 'w', encoding='utf-8') as md_file:
+                with open(fail_path, "w", encoding="utf-8") as md_file:
                     md_file.write("")
             except Exception as e:
                 # Suppress write errors during processing
                 pass
-            with fail_lock:
-                fail_count += 1
-            return
+            journal.finish(base_name, STATE_PROHIBITED, latency)
+            return STATE_PROHIBITED, fail_path
         if text is None:
-            raise RuntimeError(f"No content after 5 attempts on page {idx}. Please intervene.")
-        out_path = os.path.join(output_dir, f"{base_name}.md")
+            journal.finish(base_name, STATE_FAIL, latency)
+            raise RuntimeError(f"No content after {MAX_ATTEMPTS} attempts on {image_path}. Please intervene.")
         try:
-            with open(out_path, 'w', encoding='utf-8') as md_file:
+            with open(f"{out_path}.part", "w", encoding="utf-8") as md_file:
                 md_file.write(text)
+            os.replace(f"{out_path}.part", out_path)
         except Exception as e:
             # Suppress write errors during processing
-            pass
-
-    completed = 0
-    batch_size = max(1, int(batch_size))
-    items = list(enumerate(image_files, start=1))
-    update_progress(0, total)
-    for i in range(0, total, batch_size):
-        batch = items[i:i + batch_size]
-        with ThreadPoolExecutor(max_workers=batch_size) as executor:
-            futures = [executor.submit(_process_one, image_path, idx) for idx, image_path in batch]
-            for future in as_completed(futures):
-                try:
-                    future.result()
-                except Exception as e:
-                    print(f"\n{e}")
-                    sys.exit(1)
-                completed += 1
-                update_progress(completed, total)
-
-    if fail_count:
-        print(f"Fail pages: {fail_count}")
+            journal.finish(base_name, STATE_FAIL, latency)
+            return STATE_FAIL, out_path
+        journal.finish(base_name, STATE_DONE, latency, text)
+        return STATE_DONE, out_path
+    finally:
+        journal.close()
 
 
 def process_single_image(image_path, output_dir, output_file, prompt_text):
@@ -364,41 +2372,112 @@ def process_single_image(image_path, output_dir, output_file, prompt_text):
     if not os.path.isfile(image_path):
         print(f"Image file not found: {image_path}")
         return
+    try:
+        ocr_single_image(image_path, output_dir, output_file, prompt_text)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(1)
 
-    if output_file:
-        out_path = output_file
-        out_dir = os.path.dirname(out_path)
-        if out_dir:
-            os.makedirs(out_dir, exist_ok=True)
-    else:
-        os.makedirs(output_dir, exist_ok=True)
-        base_name = os.path.splitext(os.path.basename(image_path))[0]
-        out_path = os.path.join(output_dir, f"{base_name}.md")
 
-    text = extract_text_from_gemini_api(image_path, 1, prompt_text)
-    if text == "__PROHIBITED_CONTENT__":
-        fail_path = os.path.join(output_dir, f"{os.path.splitext(os.path.basename(image_path))[0]}.fail.md")
+DEFAULT_DAEMON_FILE = os.path.join(os.path.expanduser("~"), ".cache", "pdf-set", "ocr-daemon.json")
+
+
+class OcrRequestHandler(socketserver.StreamRequestHandler):
+    """
+    One client connection to the OCR daemon. The client sends a JSON line
+    {"token", "cmd", ...}; for "ocr" with "images" (absolute paths),
+    "output_dir" and optionally "output_file" or "prompt_file", the images
+    are OCR'd concurrently and one JSON line per image is sent back as it
+    finishes, then {"done": true}. "ping" and "shutdown" answer one line.
+    """
+
+    def _send(self, **message):
+        self.wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.wfile.flush()
+
+    def handle(self):
         try:
-            with open(fail_path, "w", encoding="utf-8") as md_file:
-                md_file.write("")
-        except Exception as e:
-            # Suppress write errors during processing
-            pass
-        return
-    if text is None:
-        print("No content after 5 attempts. Please intervene.")
-        sys.exit(1)
+            request = json.loads(self.rfile.readline().decode("utf-8"))
+        except ValueError:
+            self._send(error="request is not JSON")
+            return
+        if not hmac.compare_digest(str(request.get("token", "")), self.server.token):
+            self._send(error="wrong token")
+            return
+        cmd = request.get("cmd", "ocr")
+        if cmd == "ping":
+            self._send(ok=True, pid=os.getpid(), keys=len(client_pool.keys), status=client_pool.status_text())
+            return
+        if cmd == "shutdown":
+            self._send(ok=True)
+            threading.Thread(target=self.server.shutdown).start()
+            return
+
+        images = request.get("images") or []
+        output_dir = request.get("output_dir")
+        output_file = request.get("output_file")
+        if not output_dir or (output_file and len(images) != 1):
+            self._send(error="ocr needs output_dir, and output_file only with a single image")
+            return
+        prompt_text = self.server.prompt_text
+        if request.get("prompt_file"):
+            prompt_text = _load_prompt(request["prompt_file"])
+
+        def _worker(image_path):
+            if not os.path.isfile(image_path):
+                raise FileNotFoundError(f"Image file not found: {image_path}")
+            return ocr_single_image(image_path, output_dir, output_file, prompt_text)
+
+        def _on_done(image_path, future):
+            try:
+                state, path = future.result()
+            except Exception as e:
+                self._send(image=image_path, state=STATE_FAIL, error=str(e))
+            else:
+                self._send(image=image_path, state=state, output=path)
+
+        run_sliding_window(images, _worker, client_pool.max_limit, _on_done)
+        self._send(done=True)
+
+
+def serve(prompt_text, host="127.0.0.1", port=0, daemon_file=DEFAULT_DAEMON_FILE):
+    """
+    Keep the API clients, their connection pools and prompt caches warm and
+    OCR images sent by ocr_client.py until it asks to shut down. The port
+    and a per-run token are written to daemon_file, which only the local
+    user can read.
+    """
+    server = socketserver.ThreadingTCPServer((host, port), OcrRequestHandler, bind_and_activate=False)
+    server.daemon_threads = True
+    server.allow_reuse_address = True
+    server.server_bind()
+    server.server_activate()
+    server.token = secrets.token_hex(16)
+    server.prompt_text = prompt_text
+    host, port = server.server_address[:2]
+    os.makedirs(os.path.dirname(daemon_file) or ".", exist_ok=True)
+    fd = os.open(daemon_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"host": host, "port": port, "pid": os.getpid(), "token": server.token}, f)
+    print(f"OCR daemon listening on {host}:{port} (pid {os.getpid()}); details in {daemon_file}")
     try:
-        with open(out_path, "w", encoding="utf-8") as md_file:
-            md_file.write(text)
-    except Exception as e:
-        # Suppress write errors during processing
+        server.serve_forever()
+    except KeyboardInterrupt:
         pass
- 
+    finally:
+        server.server_close()
+        try:
+            os.remove(daemon_file)
+        except OSError:
+            pass
+        print("OCR daemon stopped.")
+
+
 def main():
     """
     Main function to execute the PDF to TXT conversion.
     """
+    init_client()
     print('\n********************************')
     print('*** Image OCR to Markdown ***')
     print('********************************\n')
@@ -477,7 +2556,19 @@ def main():
         "--batch-size",
         type=int,
         default=3,
-        help="Concurrent batch size (default: 3).",
+        help="Initial number of concurrent API calls (default: 3).",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="Upper bound the adaptive limiter may raise each API key's concurrency to (default: 8).",
+    )
+    parser.add_argument(
+        "--breaker-cooldown",
+        type=float,
+        default=30.0,
+        help="Seconds all workers pause after repeated server/network failures (default: 30).",
     )
     parser.add_argument(
         "--prompt-file",
@@ -489,6 +2580,175 @@ def main():
         default=None,
         help="UTF-8 text file containing prompt file path (first non-empty line).",
     )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help=f"OCR result cache directory (default: {DEFAULT_CACHE_DIR}).",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=float,
+        default=512,
+        help="Evict least recently used cache entries beyond this size in MB (default: 512).",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always call the API, ignoring and not updating the result cache.",
+    )
+    parser.add_argument(
+        "--pdf",
+        default=None,
+        help="Render pages of this PDF in memory and OCR them as they are rendered (skips images/).",
+    )
+    parser.add_argument(
+        "--pdf-from",
+        default=None,
+        help="UTF-8 text file containing the PDF path (first non-empty line).",
+    )
+    parser.add_argument(
+        "--save-images",
+        action="store_true",
+        help="With --pdf, also save the rendered pages to the images folder.",
+    )
+    parser.add_argument(
+        "--dpi",
+        type=int,
+        default=144,
+        help="With --pdf, render DPI (default: 144).",
+    )
+    parser.add_argument(
+        "--render-queue",
+        type=int,
+        default=8,
+        help="With --pdf, maximum rendered pages waiting for OCR (default: 8).",
+    )
+    parser.add_argument(
+        "--text-layer",
+        action="store_true",
+        help="With --pdf, take pages with a good text layer from the PDF instead of OCR'ing them.",
+    )
+    parser.add_argument(
+        "--models",
+        default=None,
+        help="Comma-separated model chain, cheapest first; pages failing local checks move to the next model "
+        "(default: the model in secrets.txt).",
+    )
+    parser.add_argument(
+        "--pages-per-request",
+        type=int,
+        default=1,
+        help="Pack up to N consecutive pages into one API request (default: 1).",
+    )
+    parser.add_argument(
+        "--no-prompt-cache",
+        action="store_true",
+        help="Send the prompt with every request instead of caching it on the server.",
+    )
+    parser.add_argument(
+        "--prompt-cache-ttl",
+        type=int,
+        default=3600,
+        help="Lifetime in seconds of the server-side prompt cache, refreshed while running (default: 3600).",
+    )
+    parser.add_argument(
+        "--no-stream",
+        action="store_true",
+        help="Use plain instead of streaming requests (for endpoints without streaming).",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=300.0,
+        help="Abandon and retry a request after this many seconds; 0 waits indefinitely (default: 300).",
+    )
+    parser.add_argument(
+        "--hedge",
+        type=float,
+        default=0.0,
+        metavar="FRACTION",
+        help=(
+            "Send a duplicate of a request slower than the recent p95 latency to another key and keep "
+            "the first answer; duplicates are capped at this fraction of all requests, e.g. 0.05 "
+            "(default: 0, off)."
+        ),
+    )
+    parser.add_argument(
+        "--upload-prep",
+        action="store_true",
+        help="Shrink images before upload: grayscale, trim margins, cap size, fit a byte budget.",
+    )
+    parser.add_argument(
+        "--upload-max-edge",
+        type=int,
+        default=1600,
+        help="With --upload-prep, maximum long edge in pixels (default: 1600).",
+    )
+    parser.add_argument(
+        "--upload-max-kb",
+        type=int,
+        default=300,
+        help="With --upload-prep, byte budget per page in KB (default: 300).",
+    )
+    parser.add_argument(
+        "--upload-format",
+        choices=("jpeg", "webp"),
+        default="jpeg",
+        help="With --upload-prep, upload encoding (default: jpeg).",
+    )
+    parser.add_argument(
+        "--upload-keep-color",
+        action="store_true",
+        help="With --upload-prep, do not convert to grayscale.",
+    )
+    parser.add_argument(
+        "--upload-keep-margins",
+        action="store_true",
+        help="With --upload-prep, do not trim page margins.",
+    )
+    parser.add_argument(
+        "--quota-file",
+        default=DEFAULT_BUDGET_PATH,
+        help=f"JSON file tracking each API key's use per 5-hour quota window (default: {DEFAULT_BUDGET_PATH}).",
+    )
+    parser.add_argument(
+        "--quota-requests",
+        type=int,
+        default=None,
+        help="Requests each API key may make per quota window (default: learned when a key runs out).",
+    )
+    parser.add_argument(
+        "--quota-tokens",
+        type=int,
+        default=None,
+        help="Tokens each API key may use per quota window (default: learned when a key runs out).",
+    )
+    parser.add_argument(
+        "--no-quota",
+        action="store_true",
+        help="Do not track quota use; a key that runs out still pauses, but without a known refresh time.",
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as a local OCR daemon for ocr_client.py, keeping the API clients warm.",
+    )
+    parser.add_argument(
+        "--serve-port",
+        type=int,
+        default=0,
+        help="With --serve, localhost port to listen on (default: any free port).",
+    )
+    parser.add_argument(
+        "--daemon-file",
+        default=DEFAULT_DAEMON_FILE,
+        help=f"With --serve, where to write the daemon's port and token (default: {DEFAULT_DAEMON_FILE}).",
+    )
+    parser.add_argument(
+        "--precheck",
+        action="store_true",
+        help="Run precheck_images.py on the images first to skip blank and duplicate pages.",
+    )
     args = parser.parse_args()
 
     base_dir = args.base_dir
@@ -509,6 +2769,11 @@ def main():
         input_file_from = read_single_path(args.input_file_from)
         if input_file_from:
             input_file = input_file_from
+    pdf_path = args.pdf
+    if args.pdf_from:
+        pdf_from = read_single_path(args.pdf_from)
+        if pdf_from:
+            pdf_path = pdf_from
 
     output_dir = args.output_dir or os.path.join(base_dir, "ocr-result")
     if args.output_dir_from:
@@ -529,58 +2794,106 @@ def main():
 
     start_idx = args.start
     end_idx = args.end
-    if input_file:
-        start_idx = None
-        end_idx = None
-    auto_range = False
-    auto_start_from = None
-    auto_end_from = None
+    resume = False
     if input_file:
         start_idx = None
         end_idx = None
     elif start_idx is None and end_idx is None:
-        auto_range = True
-        max_idx = find_max_index(output_dir)
-        start_idx = max_idx + 1
-        auto_start_from = max_idx
-        images_max_idx = find_max_image_index(images_dir)
-        if images_max_idx >= start_idx:
-            end_idx = images_max_idx
-            auto_end_from = images_max_idx
-        else:
-            end_idx = start_idx + 49
-            auto_end_from = end_idx
+        # No explicit range: OCR every image the journal does not have as finished.
+        resume = True
 
     prompt_text = _load_prompt(prompt_path)
 
     print(f"Images directory: {images_dir}")
     print(f"Input file: {input_file or '(none)'}")
+    if pdf_path:
+        print(f"PDF file: {pdf_path} (streaming, save images: {'yes' if args.save_images else 'no'})")
     print(f"Output directory: {output_dir}")
     print(f"Output file: {output_file or '(auto)'}")
-    if auto_range:
-        print(f"Auto start from (last continuous output index): {auto_start_from}")
-        print(f"Auto end from (max image index or fallback): {auto_end_from}")
-    print(f"Image index range: {start_idx}-{end_idx}")
+    if resume:
+        print("Image index range: (auto, resume from OCR journal)")
+    else:
+        print(f"Image index range: {start_idx}-{end_idx}")
     print(f"Prompt file: {prompt_path}")
+    print(f"API keys: {len(client_pool.keys)}")
+    print(f"Models: {args.models or MODEL}")
     print(f"Batch size: {args.batch_size}")
-
-    if input_file:
-        process_single_image(
-            input_file,
-            output_dir,
-            output_file,
-            prompt_text,
+    print(f"Pages per request: {max(1, args.pages_per_request)}")
+    print(f"Max concurrency: {max(args.batch_size, args.max_concurrency)}")
+    print(f"Cache directory: {'(disabled)' if args.no_cache else args.cache_dir}")
+    print(f"Quota file: {'(disabled)' if args.no_quota else args.quota_file}")
+    print(f"Request timeout: {f'{args.request_timeout:g}s' if args.request_timeout > 0 else '(none)'}")
+    if args.hedge > 0:
+        print(f"Hedging: up to {args.hedge:.0%} duplicate requests")
+    if args.upload_prep:
+        print(
+            f"Upload prep: {'color' if args.upload_keep_color else 'grayscale'}, "
+            f"{'margins kept' if args.upload_keep_margins else 'margins trimmed'}, "
+            f"max edge {args.upload_max_edge}px, {args.upload_max_kb} KB {args.upload_format}"
         )
-    else:
-        # Process images and extract text
-        process_images(
-            images_dir,
-            output_dir,
-            prompt_text,
-            start_idx=start_idx,
-            end_idx=end_idx,
-            batch_size=args.batch_size,
+
+    configure_limiter(args.batch_size, args.max_concurrency, args.breaker_cooldown)
+    configure_quota(None if args.no_quota else args.quota_file, args.quota_requests, args.quota_tokens)
+    configure_cache(None if args.no_cache else args.cache_dir, args.cache_max_mb)
+    configure_packing(args.pages_per_request)
+    configure_models(args.models.split(",") if args.models else None)
+    configure_streaming(not args.no_stream)
+    configure_timeout(args.request_timeout)
+    configure_hedging(args.hedge)
+    if args.upload_prep:
+        configure_upload(
+            grayscale=not args.upload_keep_color,
+            trim=not args.upload_keep_margins,
+            max_edge=args.upload_max_edge,
+            max_kb=args.upload_max_kb,
+            fmt=args.upload_format,
         )
+    # Caching the prompt only pays off over many pages.
+    if not args.no_prompt_cache and not input_file:
+        configure_prompt_cache(prompt_text, args.prompt_cache_ttl)
+
+    try:
+        if args.serve:
+            serve(prompt_text, port=args.serve_port, daemon_file=args.daemon_file)
+        elif input_file:
+            process_single_image(
+                input_file,
+                output_dir,
+                output_file,
+                prompt_text,
+            )
+        elif pdf_path:
+            process_pdf_stream(
+                pdf_path,
+                images_dir,
+                output_dir,
+                prompt_text,
+                start_idx=start_idx,
+                end_idx=end_idx,
+                batch_size=args.batch_size,
+                resume=resume,
+                dpi=args.dpi,
+                save_images=args.save_images,
+                queue_size=args.render_queue,
+                text_layer=args.text_layer,
+            )
+        else:
+            if args.precheck:
+                precheck(images_dir, output_dir)
+            # Process images and extract text
+            process_images(
+                images_dir,
+                output_dir,
+                prompt_text,
+                start_idx=start_idx,
+                end_idx=end_idx,
+                batch_size=args.batch_size,
+                resume=resume,
+            )
+    finally:
+        close_prompt_caches()
+        if quota_budget is not None:
+            quota_budget.save()
  
 if __name__ == "__main__":
     main()
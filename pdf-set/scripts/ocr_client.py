@@ -0,0 +1,136 @@
+import argparse
+import json
+import os
+import socket
+import sys
+
+DEFAULT_DAEMON_FILE = os.path.join(os.path.expanduser("~"), ".cache", "pdf-set", "ocr-daemon.json")
+
+
+def read_image_list(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_daemon_info(daemon_file=DEFAULT_DAEMON_FILE):
+    """
+    Host, port and token of the running `ocr.py --serve`, or None when it is
+    not running.
+    """
+    if not os.path.isfile(daemon_file):
+        return None
+    with open(daemon_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def send_request(info, request, timeout=None):
+    """
+    Send one request to the daemon and yield its JSON reply lines.
+    """
+    request = dict(request, token=info["token"])
+    with socket.create_connection((info["host"], info["port"]), timeout=timeout) as sock:
+        sock.sendall((json.dumps(request, ensure_ascii=False) + "\n").encode("utf-8"))
+        with sock.makefile("r", encoding="utf-8") as replies:
+            for line in replies:
+                yield json.loads(line)
+
+
+def ocr_images(info, images, output_dir, output_file=None, prompt_file=None, timeout=None):
+    """
+    OCR images through the daemon, yielding one result per image as it
+    finishes: {"image", "state", "output"} or {"image", "state", "error"}.
+    """
+    request = {
+        "cmd": "ocr",
+        "images": [os.path.abspath(path) for path in images],
+        "output_dir": os.path.abspath(output_dir),
+    }
+    if output_file:
+        request["output_file"] = os.path.abspath(output_file)
+    if prompt_file:
+        request["prompt_file"] = os.path.abspath(prompt_file)
+    for reply in send_request(info, request, timeout):
+        if reply.get("done"):
+            return
+        if "error" in reply and "image" not in reply:
+            raise RuntimeError(reply["error"])
+        yield reply
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Send images to a running `ocr.py --serve` daemon and wait for their Markdown."
+    )
+    parser.add_argument("images", nargs="*", help="Image files to OCR.")
+    parser.add_argument(
+        "--images-from",
+        default=None,
+        help="UTF-8 text file listing image paths, one per line (e.g. the output of list_fail_md.py).",
+    )
+    parser.add_argument(
+        "--base-dir",
+        default=os.getcwd(),
+        help="Directory relative image paths are resolved against (default: current directory).",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Path to output folder (default: <base-dir>/ocr-result).",
+    )
+    parser.add_argument(
+        "--output-file",
+        default=None,
+        help="Path to output Markdown file when OCR'ing a single image.",
+    )
+    parser.add_argument(
+        "--prompt-file",
+        default=None,
+        help="Prompt file to use instead of the daemon's.",
+    )
+    parser.add_argument(
+        "--daemon-file",
+        default=DEFAULT_DAEMON_FILE,
+        help=f"File the daemon wrote its port and token to (default: {DEFAULT_DAEMON_FILE}).",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=None,
+        help="Give up after this many seconds without a reply (default: wait).",
+    )
+    parser.add_argument("--ping", action="store_true", help="Only check that the daemon is running.")
+    parser.add_argument("--shutdown", action="store_true", help="Stop the daemon.")
+    args = parser.parse_args()
+
+    info = load_daemon_info(args.daemon_file)
+    if info is None:
+        print(f"No OCR daemon running ({args.daemon_file} not found). Start one with: python ocr.py --serve")
+        sys.exit(1)
+
+    try:
+        if args.ping or args.shutdown:
+            for reply in send_request(info, {"cmd": "shutdown" if args.shutdown else "ping"}, args.timeout):
+                print(json.dumps(reply, ensure_ascii=False))
+            sys.exit(0)
+
+        images = list(args.images)
+        if args.images_from:
+            images.extend(read_image_list(args.images_from))
+        if not images:
+            parser.error("no images given")
+        images = [path if os.path.isabs(path) else os.path.join(args.base_dir, path) for path in images]
+        if args.output_file and len(images) != 1:
+            parser.error("--output-file needs exactly one image")
+        output_dir = args.output_dir or os.path.join(args.base_dir, "ocr-result")
+
+        failed = 0
+        for result in ocr_images(info, images, output_dir, args.output_file, args.prompt_file, args.timeout):
+            if result.get("error"):
+                failed += 1
+                print(f"{result['image']}: {result['state']} ({result['error']})")
+            else:
+                print(f"{result['image']}: {result['state']} -> {result['output']}")
+    except ConnectionRefusedError:
+        print(f"OCR daemon in {args.daemon_file} is not answering; start it again with: python ocr.py --serve")
+        sys.exit(1)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,192 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+
+JOURNAL_FILENAME = "ocr-journal.sqlite"
+
+STATE_PENDING = "pending"
+STATE_IN_FLIGHT = "in-flight"
+STATE_DONE = "done"
+STATE_FAIL = "fail"
+STATE_PROHIBITED = "prohibited"
+# Output still cut off at the token limit after every continuation.
+STATE_TRUNCATED = "truncated"
+# Written from the PDF's own text layer by text_layer.py: no OCR, and not in
+# the prompt's format (no headings or footnote markup, running heads kept).
+STATE_TEXT_LAYER = "text-layer"
+STATES = (STATE_PENDING, STATE_IN_FLIGHT, STATE_DONE, STATE_FAIL, STATE_PROHIBITED, STATE_TRUNCATED, STATE_TEXT_LAYER)
+
+# Pages in these states need no further API calls on resume.
+FINISHED_STATES = (STATE_DONE, STATE_PROHIBITED, STATE_TRUNCATED, STATE_TEXT_LAYER)
+# Pages left with an N.fail.md for remediation.
+FAIL_MD_STATES = (STATE_PROHIBITED, STATE_TRUNCATED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page TEXT PRIMARY KEY,
+    num INTEGER,
+    image_path TEXT,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    latency REAL,
+    output_hash TEXT,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def journal_path(ocr_dir):
+    return os.path.join(ocr_dir, JOURNAL_FILENAME)
+
+
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _page_num(page):
+    return int(page) if page.isdigit() else None
+
+
+class OcrJournal:
+    """
+    Durable per-book record of each page's OCR state, stored as SQLite next
+    to the per-page Markdown files. Every update is committed immediately so
+    a crash or Ctrl+C loses at most the pages that were in flight.
+    """
+
+    def __init__(self, ocr_dir):
+        os.makedirs(ocr_dir, exist_ok=True)
+        self.ocr_dir = ocr_dir
+        self.path = journal_path(ocr_dir)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _upsert(self, page, **fields):
+        fields["updated_at"] = time.time()
+        columns = ", ".join(fields)
+        placeholders = ", ".join("?" for _ in fields)
+        updates = ", ".join(f"{name} = excluded.{name}" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"INSERT INTO pages (page, num, {columns}) VALUES (?, ?, {placeholders}) "
+                f"ON CONFLICT(page) DO UPDATE SET {updates}",
+                (page, _page_num(page), *fields.values()),
+            )
+            self._conn.commit()
+
+    def mark_pending(self, pages):
+        """
+        Mark (page, image_path) pairs as queued for this run in one transaction.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO pages (page, num, image_path, state, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(page) DO UPDATE SET image_path = excluded.image_path, "
+                "state = excluded.state, updated_at = excluded.updated_at",
+                [(page, _page_num(page), image_path, STATE_PENDING, now) for page, image_path in pages],
+            )
+            self._conn.commit()
+
+    def start(self, page, image_path):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO pages (page, num, image_path, state, attempts, updated_at) "
+                "VALUES (?, ?, ?, ?, 1, ?) "
+                "ON CONFLICT(page) DO UPDATE SET image_path = excluded.image_path, "
+                "state = excluded.state, attempts = attempts + 1, updated_at = excluded.updated_at",
+                (page, _page_num(page), image_path, STATE_IN_FLIGHT, time.time()),
+            )
+            self._conn.commit()
+
+    def finish(self, page, state, latency=None, text=None):
+        self._upsert(
+            page,
+            state=state,
+            latency=latency,
+            output_hash=text_hash(text) if text is not None else None,
+        )
+
+    def rows(self, states=None):
+        """
+        Return (page, state, attempts, latency, output_hash) tuples in page order.
+        """
+        query = "SELECT page, state, attempts, latency, output_hash FROM pages"
+        params = ()
+        if states:
+            query += f" WHERE state IN ({', '.join('?' for _ in states)})"
+            params = tuple(states)
+        query += " ORDER BY num IS NULL, num, page"
+        with self._lock:
+            return self._conn.execute(query, params).fetchall()
+
+    def image_paths(self):
+        """
+        The image each page was OCR'd from, for pages that have one recorded.
+        """
+        with self._lock:
+            return dict(self._conn.execute("SELECT page, image_path FROM pages WHERE image_path IS NOT NULL"))
+
+    def states(self):
+        return {page: state for page, state, _, _, _ in self.rows()}
+
+    def counts(self):
+        with self._lock:
+            found = dict(self._conn.execute("SELECT state, COUNT(*) FROM pages GROUP BY state"))
+        return {state: found.get(state, 0) for state in STATES}
+
+    def import_existing_outputs(self):
+        """
+        Record pages OCR'd before the journal existed (or outside ocr.py) from
+        the N.md / N.fail.md files already in the output directory. A page
+        still recorded as prohibited or truncated whose N.md has turned up
+        since (fixed by hand) is recorded as done.
+        """
+        known = self.states()
+        imported = 0
+        # A remediated page has both N.md and N.fail.md; N.md wins.
+        names = sorted(os.listdir(self.ocr_dir), key=lambda n: n.endswith(".fail.md"))
+        for name in names:
+            match = re.match(r"^(.+?)(\.fail)?\.md$", name)
+            if not match:
+                continue
+            if not match.group(2) and known.get(match.group(1)) in FAIL_MD_STATES:
+                del known[match.group(1)]
+            if match.group(1) in known:
+                continue
+            page = match.group(1)
+            if match.group(2):
+                state = STATE_PROHIBITED
+                self.finish(page, state)
+            else:
+                state = STATE_DONE
+                with open(os.path.join(self.ocr_dir, name), "r", encoding="utf-8") as f:
+                    self.finish(page, state, text=f.read())
+            known[page] = state
+            imported += 1
+        return imported
+
+    def missing_pages(self, pages):
+        """
+        Filter pages (base names) down to the ones that still need OCR: never
+        finished, or marked done (or text-layer) but whose N.md has since
+        disappeared.
+        """
+        states = self.states()
+        missing = []
+        for page in pages:
+            state = states.get(page)
+            if state in (STATE_DONE, STATE_TEXT_LAYER) and not os.path.isfile(os.path.join(self.ocr_dir, f"{page}.md")):
+                state = None
+            if state not in FINISHED_STATES:
+                missing.append(page)
+        return missing
@@ -0,0 +1,307 @@
+import argparse
+import glob
+import json
+import os
+import shutil
+
+from PIL import Image, ImageChops, ImageOps
+
+from ocr_journal import FAIL_MD_STATES, FINISHED_STATES, OcrJournal, STATE_DONE, STATE_TEXT_LAYER
+
+REPORT_FILENAME = "precheck.json"
+
+# Share of the page (inside the border) that must be ink for it to count as
+# non-blank. A bare page number stays under it; a single line of text does not.
+DEFAULT_BLANK_INK = 0.0005
+# Maximum differing bits between 256-bit difference hashes of duplicate candidates.
+DEFAULT_DUP_DISTANCE = 24
+# Maximum mean absolute difference (0-255) between aligned thumbnails of duplicates.
+DEFAULT_DUP_MAD = 8.0
+
+ANALYSIS_SIZE = 600
+BORDER = 0.04
+HASH_SIZE = 16
+THUMB_SIZE = 96
+
+
+def _sort_key(path):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return (0, int(stem), "") if stem.isdigit() else (1, 0, stem)
+
+
+def list_images(images_dir):
+    exts = ("*.jpg", "*.jpeg", "*.png", "*.bmp", "*.tif", "*.tiff", "*.webp")
+    paths = []
+    for ext in exts:
+        paths.extend(glob.glob(os.path.join(images_dir, ext)))
+    return sorted(paths, key=_sort_key)
+
+
+def _load_gray(path):
+    image = Image.open(path)
+    # JPEG can decode straight to a reduced size, which is most of the speed-up.
+    image.draft("L", (ANALYSIS_SIZE, ANALYSIS_SIZE))
+    image = image.convert("L")
+    image.thumbnail((ANALYSIS_SIZE, ANALYSIS_SIZE))
+    w, h = image.size
+    bx, by = int(w * BORDER), int(h * BORDER)
+    # Scanner edges and gutter shadows live in the border; leave them out.
+    return image.crop((bx, by, w - bx, h - by))
+
+
+def paper_level(gray):
+    """
+    Median brightness of a grayscale page, which on a text page is the paper.
+    """
+    hist = gray.histogram()
+    total = sum(hist)
+    running = 0
+    for level, count in enumerate(hist):
+        running += count
+        if running * 2 >= total:
+            return level
+    return 255
+
+
+def ink_mask(gray):
+    """
+    255 where a grayscale page is clearly darker than its paper, else 0.
+    """
+    paper = paper_level(gray)
+    # Ink is anything clearly darker than the paper; this ignores scan noise
+    # and faint bleed-through from the other side of the leaf.
+    threshold = max(0, paper - 60)
+    return gray.point(lambda v: 255 if v < threshold else 0)
+
+
+def _dhash(image):
+    small = image.resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    px = small.tobytes()
+    bits = 0
+    row = HASH_SIZE + 1
+    for y in range(HASH_SIZE):
+        base = y * row
+        for x in range(HASH_SIZE):
+            bits = (bits << 1) | (px[base + x] > px[base + x + 1])
+    return bits
+
+
+def analyze_image(path):
+    """
+    Ink coverage, a 256-bit difference hash and a small thumbnail of the
+    page's inked area, which makes the hash insensitive to where the scan
+    sits on the sheet.
+    """
+    gray = _load_gray(path)
+    mask = ink_mask(gray)
+    ink_pixels = mask.histogram()[255]
+    ink = ink_pixels / (gray.size[0] * gray.size[1])
+    bbox = mask.getbbox()
+    content = gray.crop(bbox) if bbox else gray
+    content = ImageOps.autocontrast(content)
+    thumb = content.resize((THUMB_SIZE, THUMB_SIZE), Image.BILINEAR)
+    return {"ink": ink, "hash": _dhash(content), "thumb": thumb}
+
+
+def _mad(a, b):
+    hist = ImageChops.difference(a, b).histogram()
+    return sum(level * count for level, count in enumerate(hist)) / (THUMB_SIZE * THUMB_SIZE)
+
+
+def find_blank_and_duplicates(
+    image_paths,
+    blank_ink=DEFAULT_BLANK_INK,
+    dup_distance=DEFAULT_DUP_DISTANCE,
+    dup_mad=DEFAULT_DUP_MAD,
+):
+    """
+    Return (blank_pages, duplicates, stats). duplicates maps a page to the
+    first earlier page it repeats. Candidates come from the hash distance and
+    are confirmed on aligned thumbnails, so pages that merely share a layout
+    are not merged.
+    """
+    pages = []
+    stats = {}
+    for path in image_paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        info = analyze_image(path)
+        pages.append((name, info))
+        stats[name] = {"ink": round(info["ink"], 5), "hash": f"{info['hash']:064x}"}
+
+    blank = [name for name, info in pages if info["ink"] < blank_ink]
+    blank_set = set(blank)
+    duplicates = {}
+    originals = []
+    for name, info in pages:
+        if name in blank_set:
+            continue
+        for orig_name, orig in originals:
+            if (info["hash"] ^ orig["hash"]).bit_count() > dup_distance:
+                continue
+            if _mad(info["thumb"], orig["thumb"]) <= dup_mad:
+                duplicates[name] = orig_name
+                break
+        else:
+            originals.append((name, info))
+    return blank, duplicates, stats
+
+
+def load_report(output_dir, images_dir=None):
+    """
+    Return the precheck report in output_dir, or None when there is none or
+    it was made for a different images directory.
+    """
+    path = os.path.join(output_dir, REPORT_FILENAME)
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        report = json.load(f)
+    if images_dir is not None and report.get("images_dir") != os.path.abspath(images_dir):
+        return None
+    return report
+
+
+def apply_duplicates(output_dir, journal, duplicates):
+    """
+    Give every duplicate page its original's result once the original is
+    finished. Returns the number of pages filled in.
+    """
+    states = journal.states()
+    filled = 0
+    for page, original in duplicates.items():
+        if states.get(page) in FINISHED_STATES:
+            continue
+        state = states.get(original)
+        if state in (STATE_DONE, STATE_TEXT_LAYER):
+            src = os.path.join(output_dir, f"{original}.md")
+            if not os.path.isfile(src):
+                continue
+            shutil.copyfile(src, os.path.join(output_dir, f"{page}.md"))
+            with open(src, "r", encoding="utf-8") as f:
+                journal.finish(page, state, 0.0, f.read())
+        elif state in FAIL_MD_STATES:
+            with open(os.path.join(output_dir, f"{page}.fail.md"), "w", encoding="utf-8") as f:
+                f.write("")
+            journal.finish(page, state, 0.0)
+        else:
+            continue
+        filled += 1
+    return filled
+
+
+def precheck(
+    images_dir,
+    output_dir,
+    blank_ink=DEFAULT_BLANK_INK,
+    dup_distance=DEFAULT_DUP_DISTANCE,
+    dup_mad=DEFAULT_DUP_MAD,
+    dry_run=False,
+):
+    """
+    Find near-blank and near-duplicate pages in images_dir, write the report
+    to <output_dir>/precheck.json, write empty N.md for blank pages and fill
+    in duplicates whose original is already OCR'd. ocr.py reads the report
+    to skip the remaining duplicates and fills them after their originals.
+    """
+    image_paths = list_images(images_dir)
+    if not image_paths:
+        print(f"No images found in: {images_dir}")
+        return None
+    blank, duplicates, stats = find_blank_and_duplicates(image_paths, blank_ink, dup_distance, dup_mad)
+    report = {
+        "images_dir": os.path.abspath(images_dir),
+        "blank_ink": blank_ink,
+        "dup_distance": dup_distance,
+        "dup_mad": dup_mad,
+        "blank": blank,
+        "duplicates": duplicates,
+        "pages": stats,
+    }
+    print(f"Checked {len(image_paths)} images: {len(blank)} blank, {len(duplicates)} duplicates.")
+    for page, original in duplicates.items():
+        print(f"  {page} duplicates {original}")
+    if dry_run:
+        return report
+
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, REPORT_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    journal = OcrJournal(output_dir)
+    journal.import_existing_outputs()
+    states = journal.states()
+    for page in blank:
+        if states.get(page) in (STATE_DONE, STATE_TEXT_LAYER):
+            continue
+        with open(os.path.join(output_dir, f"{page}.md"), "w", encoding="utf-8") as f:
+            f.write("")
+        journal.finish(page, STATE_DONE, 0.0, "")
+    filled = apply_duplicates(output_dir, journal, duplicates)
+    journal.close()
+    print(f"Wrote {len(blank)} blank pages, filled {filled} duplicates from earlier results.")
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find blank and duplicate page images before OCR to save API calls."
+    )
+    parser.add_argument(
+        "--base-dir",
+        default=os.getcwd(),
+        help="Book root directory (default: current directory).",
+    )
+    parser.add_argument(
+        "--book-name",
+        default=None,
+        help="Book name (used to resolve <base-dir>/<book-name>).",
+    )
+    parser.add_argument(
+        "--input-dir",
+        default=None,
+        help="Path to input images folder (default: <base-dir>/images).",
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Path to OCR output folder (default: <base-dir>/ocr-result).",
+    )
+    parser.add_argument(
+        "--blank-ink",
+        type=float,
+        default=DEFAULT_BLANK_INK,
+        help=f"Pages with less ink coverage than this are blank (default: {DEFAULT_BLANK_INK}).",
+    )
+    parser.add_argument(
+        "--dup-distance",
+        type=int,
+        default=DEFAULT_DUP_DISTANCE,
+        help=f"Maximum hash distance for duplicate candidates (default: {DEFAULT_DUP_DISTANCE}).",
+    )
+    parser.add_argument(
+        "--dup-mad",
+        type=float,
+        default=DEFAULT_DUP_MAD,
+        help=f"Maximum mean pixel difference for confirmed duplicates (default: {DEFAULT_DUP_MAD}).",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only print what would be skipped; write nothing.",
+    )
+    args = parser.parse_args()
+
+    base_dir = args.base_dir
+    if args.book_name:
+        base_dir = os.path.join(base_dir, args.book_name)
+    images_dir = args.input_dir or os.path.join(base_dir, "images")
+    output_dir = args.output_dir or os.path.join(base_dir, "ocr-result")
+
+    precheck(
+        images_dir,
+        output_dir,
+        blank_ink=args.blank_ink,
+        dup_distance=args.dup_distance,
+        dup_mad=args.dup_mad,
+        dry_run=args.dry_run,
+    )
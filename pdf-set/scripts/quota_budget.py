@@ -0,0 +1,227 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_BUDGET_PATH = os.path.join(os.path.expanduser("~"), ".cache", "pdf-set", "quota.json")
+
+# Free-tier quota refreshes every 5 hours per account.
+WINDOW_SECONDS = 5 * 3600
+SAVE_INTERVAL = 10.0
+
+
+def quota_id(api_key):
+    """
+    Stable name for an API key in the budget file, without storing the key.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:16]
+
+
+def usage_tokens(usage_metadata):
+    total = getattr(usage_metadata, "total_token_count", None)
+    if total:
+        return total
+    prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+    output_tokens = getattr(usage_metadata, "candidates_token_count", None) or 0
+    return prompt_tokens + output_tokens
+
+
+class QuotaBudget:
+    """
+    Requests and tokens each API key has used in its current quota window,
+    kept in a JSON file so the counts survive restarts and are shared by
+    every book. A window opens with a key's first request after the previous
+    window ended and refreshes WINDOW_SECONDS later.
+
+    A key's limit per window is max_requests / max_tokens when given, else
+    what it had used the last time it ran out of quota. Explicit limits also
+    stop a key before the server starts refusing it.
+    """
+
+    def __init__(self, path=DEFAULT_BUDGET_PATH, max_requests=None, max_tokens=None, window=WINDOW_SECONDS):
+        self.path = path
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.window = window
+        self.keys = {}
+        # Averages from the last run: requests and tokens per OCR'd page.
+        self.per_page = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._saved = 0.0
+        if path and os.path.isfile(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                self.keys = data.get("keys", {})
+                self.per_page = data.get("per_page", {})
+            except (OSError, ValueError):
+                pass
+
+    def _entry(self, kid, now):
+        entry = self.keys.setdefault(kid, {"window_start": None, "requests": 0, "tokens": 0})
+        if entry["window_start"] is not None and now >= entry["window_start"] + self.window:
+            entry.update(window_start=None, requests=0, tokens=0, exhausted=False)
+        return entry
+
+    def save(self, force=True):
+        """
+        Write the counts to the budget file; a periodic save (force=False)
+        is skipped when the last one was recent or another is in progress.
+        Errors are reported, never raised, so bookkeeping cannot fail a
+        request that was answered.
+        """
+        if not self.path:
+            return
+        # One writer at a time, each writing the snapshot it took while
+        # holding the lock, so an older snapshot never replaces a newer one.
+        if not self._write_lock.acquire(blocking=force):
+            return
+        tmp_path = None
+        try:
+            with self._lock:
+                now = time.monotonic()
+                if not force and now - self._saved < SAVE_INTERVAL:
+                    return
+                self._saved = now
+                data = json.dumps({"keys": self.keys, "per_page": self.per_page}, indent=2)
+            directory = os.path.dirname(self.path) or "."
+            os.makedirs(directory, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                "w", encoding="utf-8", dir=directory, prefix=os.path.basename(self.path) + ".", suffix=".tmp", delete=False
+            ) as f:
+                tmp_path = f.name
+                f.write(data)
+            os.replace(tmp_path, self.path)
+            tmp_path = None
+        except OSError as e:
+            print(f"Warning: could not save quota budget {self.path}: {e}")
+        finally:
+            if tmp_path is not None:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            self._write_lock.release()
+
+    def record(self, kid, tokens):
+        """
+        Count one answered request and its tokens against kid's window.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entry(kid, now)
+            if entry["window_start"] is None:
+                entry["window_start"] = now
+            entry["requests"] += 1
+            entry["tokens"] += tokens
+        self.save(force=False)
+
+    def exhausted(self, kid):
+        """
+        Note that kid ran out of quota and remember what it had used as its
+        capacity. Returns the seconds until its window refreshes, or None
+        when no request of this window was seen.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entry(kid, now)
+            if entry["window_start"] is None:
+                return None
+            if not entry.get("exhausted"):
+                entry["exhausted"] = True
+                entry["capacity_requests"] = entry["requests"]
+                entry["capacity_tokens"] = entry["tokens"]
+            reset_in = entry["window_start"] + self.window - now
+        self.save()
+        return reset_in
+
+    def _limits(self, entry):
+        requests = self.max_requests or entry.get("capacity_requests")
+        tokens = self.max_tokens or entry.get("capacity_tokens")
+        return requests, tokens
+
+    def over_limit(self, kid):
+        """
+        Seconds until kid's window refreshes when it has used up an explicit
+        max_requests / max_tokens, else None.
+        """
+        if not self.max_requests and not self.max_tokens:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entry(kid, now)
+            if entry["window_start"] is None:
+                return None
+            if (self.max_requests and entry["requests"] >= self.max_requests) or (
+                self.max_tokens and entry["tokens"] >= self.max_tokens
+            ):
+                return entry["window_start"] + self.window - now
+        return None
+
+    def _key_outlook(self, kid, now, tokens_per_request):
+        """
+        (requests left now, requests per full window, seconds until refresh)
+        for kid, with None for the first two when its limit is unknown.
+        """
+        entry = self._entry(kid, now)
+        limit_requests, limit_tokens = self._limits(entry)
+        capacity = None
+        if limit_requests:
+            capacity = limit_requests
+        if limit_tokens and tokens_per_request:
+            by_tokens = int(limit_tokens / tokens_per_request)
+            capacity = by_tokens if capacity is None else min(capacity, by_tokens)
+        if capacity is None:
+            return None, None, 0.0
+        if entry["window_start"] is None:
+            return capacity, capacity, self.window
+        used = entry["requests"]
+        if limit_tokens and tokens_per_request:
+            used = max(used, int(entry["tokens"] / tokens_per_request))
+        if entry.get("exhausted"):
+            used = capacity
+        return max(0, capacity - used), capacity, entry["window_start"] + self.window - now
+
+    def outlook(self, kids, tokens_per_request=None):
+        """
+        Requests left across kids in their current windows, requests per
+        full window and seconds until the last of them refreshes; None when
+        any key's limit is unknown.
+        """
+        now = time.time()
+        left = capacity = 0
+        reset_in = 0.0
+        with self._lock:
+            for kid in kids:
+                key_left, key_capacity, key_reset = self._key_outlook(kid, now, tokens_per_request)
+                if key_capacity is None:
+                    return None
+                left += key_left
+                capacity += key_capacity
+                reset_in = max(reset_in, key_reset)
+        return left, capacity, reset_in
+
+    def eta(self, kids, requests_needed, requests_per_second, tokens_per_request=None):
+        """
+        (seconds, pauses) to send requests_needed at requests_per_second,
+        waiting for the quota to refresh whenever the keys run dry.
+        """
+        if requests_per_second <= 0:
+            return None, 0
+        outlook = self.outlook(kids, tokens_per_request)
+        if outlook is None:
+            return requests_needed / requests_per_second, 0
+        left, capacity, refresh = outlook
+        elapsed = 0.0
+        pauses = 0
+        while requests_needed > left and capacity > 0:
+            requests_needed -= left
+            elapsed = max(elapsed + left / requests_per_second, elapsed + refresh)
+            # The next window opens with the first request after the refresh.
+            refresh = self.window
+            left = capacity
+            pauses += 1
+        return elapsed + requests_needed / requests_per_second, pauses
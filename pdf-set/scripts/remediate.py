@@ -0,0 +1,277 @@
+import argparse
+import json
+import os
+import time
+
+from google.genai import types
+
+import ocr
+from list_fail_md import DEFAULT_OCR_DIRNAME, FAIL_SUFFIX, IMAGE_DIRNAME, list_fail_files
+from ocr_journal import OcrJournal, STATE_DONE, STATE_FAIL
+
+REPORT_FILENAME = "remediate.json"
+DEFAULT_CONTEXT_CHARS = 300
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+CONTEXT_INSTRUCTIONS = """## 补漏模式
+这一页此前未能识别成功，现在单独重新识别。下面是同一本书前后两页已经识别出的文字，仅用于判断本页开头与结尾如何与前后文衔接（是否为上一页段落的续接、是否需要首行缩进、简繁体是否一致）。
+只输出本页图片中的内容：从本页正文最初的字符开始，到本页正文最后的字符为止；不要输出前后页的文字，不要补全或续写句子。
+
+上一页（{prev_name}）末尾：
+<<<
+{prev_text}
+>>>
+
+下一页（{next_name}）开头：
+<<<
+{next_text}
+>>>
+"""
+
+
+def find_image(images_dirs, page):
+    for images_dir in images_dirs:
+        for ext in IMAGE_EXTS:
+            path = os.path.join(images_dir, f"{page}{ext}")
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def _read_md(ocr_dir, page):
+    path = os.path.join(ocr_dir, f"{page}.md")
+    if not os.path.isfile(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def neighbour_context(ocr_dir, page, chars=DEFAULT_CONTEXT_CHARS):
+    """
+    The boundary text around a numeric page: the last chars of (page-1).md
+    and the first chars of (page+1).md, or "（无）" where there is none.
+    """
+    num = int(page)
+    prev_text = _read_md(ocr_dir, str(num - 1))
+    next_text = _read_md(ocr_dir, str(num + 1))
+    return CONTEXT_INSTRUCTIONS.format(
+        prev_name=f"{num - 1}.md",
+        prev_text=prev_text.strip("\n")[-chars:] if prev_text and prev_text.strip() else "（无）",
+        next_name=f"{num + 1}.md",
+        next_text=next_text.strip("\n")[:chars] if next_text and next_text.strip() else "（无）",
+    )
+
+
+def remediate_page(journal, ocr_dir, prompt_text, page, image_path, context_chars=DEFAULT_CONTEXT_CHARS, keep_fail_md=False):
+    """
+    OCR one failed page with its neighbours' text as context. On success
+    N.md is moved into place atomically and N.fail.md and N.fail.txt
+    removed (unless keep_fail_md). Returns the journal state.
+    """
+    image_bytes, mime_type = ocr._upload_bytes(image_path)
+    parts = [
+        types.Part.from_bytes(data=image_bytes, mime_type=mime_type or ocr._guess_mime_type(image_path, image_bytes)),
+        types.Part.from_text(text=neighbour_context(ocr_dir, page, context_chars)),
+    ]
+    journal.start(page, image_path)
+    started = time.monotonic()
+    try:
+        text = ocr.ocr_with_models(
+            prompt_text, parts, page, image_bytes, partial_path=ocr._partial_path(ocr_dir, page)
+        )
+    except Exception:
+        journal.finish(page, STATE_FAIL, time.monotonic() - started)
+        raise
+    state = ocr._write_page_result(journal, ocr_dir, page, page, text, time.monotonic() - started)
+    if state == STATE_DONE and not keep_fail_md:
+        for suffix in (FAIL_SUFFIX, ocr.PARTIAL_TEXT_SUFFIX):
+            try:
+                os.remove(os.path.join(ocr_dir, f"{page}{suffix}"))
+            except OSError:
+                pass
+    return state
+
+
+def remediate(
+    ocr_dir,
+    images_dirs,
+    prompt_text,
+    batch_size=3,
+    context_chars=DEFAULT_CONTEXT_CHARS,
+    keep_fail_md=False,
+    use_journal=True,
+    dry_run=False,
+):
+    """
+    Re-OCR every fail page of a book concurrently, each with its neighbours'
+    text as boundary context, and write <ocr_dir>/remediate.json with the
+    outcome of every page. Returns the pages still failing.
+    """
+    pages = [name[: -len(FAIL_SUFFIX)] for name in list_fail_files(ocr_dir, use_journal=use_journal)]
+    if not pages:
+        print(f"No fail pages in: {ocr_dir}")
+        return []
+    report = {}
+    work = []
+    for page in pages:
+        image_path = find_image(images_dirs, page)
+        if image_path is None:
+            report[page] = {"state": "no image"}
+        else:
+            work.append((page, image_path))
+    print(f"Fail pages: {len(pages)}, with images: {len(work)}")
+    if dry_run:
+        for page, image_path in work:
+            print(f"  {page}: {image_path}")
+        return pages
+
+    journal = OcrJournal(ocr_dir)
+    completed = 0
+    started = time.monotonic()
+    ocr.update_progress(0, len(work), ocr.client_pool.status_text())
+
+    def _worker(item):
+        page, image_path = item
+        return remediate_page(journal, ocr_dir, prompt_text, page, image_path, context_chars, keep_fail_md)
+
+    def _on_done(item, future):
+        nonlocal completed
+        page, image_path = item
+        try:
+            report[page] = {"state": future.result(), "image": image_path}
+        except Exception as e:
+            report[page] = {"state": STATE_FAIL, "image": image_path, "error": str(e)}
+        completed += 1
+        ocr.update_progress(completed, len(work), ocr.client_pool.status_text())
+
+    try:
+        ocr.run_sliding_window(work, _worker, max(batch_size, ocr.client_pool.max_limit), _on_done)
+    finally:
+        journal.close()
+
+    still_failing = [page for page in pages if report[page]["state"] != STATE_DONE]
+    with open(os.path.join(ocr_dir, REPORT_FILENAME), "w", encoding="utf-8") as f:
+        json.dump(
+            {"pages": report, "still_failing": still_failing},
+            f,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(
+        f"Remediated {len(pages) - len(still_failing)} of {len(pages)} pages "
+        f"in {ocr._format_duration(time.monotonic() - started)}."
+    )
+    print(ocr.client_pool.summary())
+    print(ocr.request_stats.summary())
+    if still_failing:
+        print(f"Still failing (see {REPORT_FILENAME}): {', '.join(still_failing)}")
+    return still_failing
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Re-OCR all .fail.md pages of a book concurrently, with neighbouring pages as context."
+    )
+    parser.add_argument(
+        "--base-dir",
+        default=os.getcwd(),
+        help="Book root directory (default: current directory).",
+    )
+    parser.add_argument(
+        "--book-name",
+        default=None,
+        help="Book name (used to resolve <base-dir>/<book-name>).",
+    )
+    parser.add_argument(
+        "--ocr-dir",
+        default=None,
+        help=f"Path to ocr-result folder (default: <base-dir>/{DEFAULT_OCR_DIRNAME}).",
+    )
+    parser.add_argument(
+        "--images-dir",
+        default=None,
+        help=f"Path to the page images (default: <base-dir>/images, then <base-dir>/{IMAGE_DIRNAME}).",
+    )
+    parser.add_argument(
+        "--models",
+        default=None,
+        help="Comma-separated model chain to use instead of the model in secrets.txt, as in ocr.py.",
+    )
+    parser.add_argument(
+        "--prompt-file",
+        default=None,
+        help="Prompt file (default: <script-dir>/ocr_prompt.md).",
+    )
+    parser.add_argument(
+        "--context-chars",
+        type=int,
+        default=DEFAULT_CONTEXT_CHARS,
+        help=f"Characters of each neighbouring page given as context (default: {DEFAULT_CONTEXT_CHARS}).",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=3,
+        help="Initial number of concurrent API calls (default: 3).",
+    )
+    parser.add_argument(
+        "--max-concurrency",
+        type=int,
+        default=8,
+        help="Upper bound the adaptive limiter may raise each API key's concurrency to (default: 8).",
+    )
+    parser.add_argument(
+        "--request-timeout",
+        type=float,
+        default=300.0,
+        help="Abandon and retry a request after this many seconds; 0 waits indefinitely (default: 300).",
+    )
+    parser.add_argument(
+        "--keep-fail-md",
+        action="store_true",
+        help="Leave N.fail.md and N.fail.txt in place next to the new N.md.",
+    )
+    parser.add_argument(
+        "--scan-dir",
+        action="store_true",
+        help="Scan the folder for *.fail.md files even if an OCR journal exists.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only list the fail pages and their images.",
+    )
+    args = parser.parse_args()
+
+    base_dir = args.base_dir
+    if args.book_name:
+        base_dir = os.path.join(base_dir, args.book_name)
+    ocr_dir = args.ocr_dir or os.path.join(base_dir, DEFAULT_OCR_DIRNAME)
+    images_dirs = [args.images_dir] if args.images_dir else [
+        os.path.join(base_dir, "images"),
+        os.path.join(base_dir, IMAGE_DIRNAME),
+    ]
+    prompt_path = args.prompt_file or os.path.join(os.path.dirname(__file__), "ocr_prompt.md")
+
+    prompt_text = ocr._load_prompt(prompt_path)
+    if not args.dry_run:
+        ocr.init_client()
+        ocr.configure_limiter(args.batch_size, args.max_concurrency)
+        ocr.configure_quota()
+        ocr.configure_models(args.models.split(",") if args.models else None)
+        ocr.configure_timeout(args.request_timeout)
+        # The page context goes after the image, so the prompt itself stays cacheable.
+        ocr.configure_prompt_cache(prompt_text)
+    try:
+        remediate(
+            ocr_dir,
+            images_dirs,
+            prompt_text,
+            batch_size=args.batch_size,
+            context_chars=args.context_chars,
+            keep_fail_md=args.keep_fail_md,
+            use_journal=not args.scan_dir,
+            dry_run=args.dry_run,
+        )
+    finally:
+        ocr.close_prompt_caches()
@@ -1,9 +1,31 @@
 import argparse
+import hashlib
+import json
 import os
 import re
+import unicodedata
+from collections import deque
 
 DEFAULT_INPUT_DIRNAME = 'merge-result'
 DEFAULT_INPUT_FILENAME = '0.rough.md'
+DEFAULT_MANIFEST_FILENAME = '0.split.json'
+PAGE_MAP_FILENAME = '0.rough.map.json'
+MANIFEST_VERSION = 1
+# A title may differ from the TOC entry by one character in this many
+# (so titles shorter than this must match exactly once normalised).
+FUZZY_CHARS_PER_ERROR = 5
+# Matches this many non-blank lines apart or closer look like the book's own
+# table of contents rather than chapter starts.
+TOC_BLOCK_GAP = 2
+# Consecutive TOC entries needed in a row to count as the book's contents page.
+TOC_BLOCK_MIN = 3
+# Candidate lines may be longer than the longest title by this many characters.
+TITLE_SLACK = 4
+
+H1_RE = re.compile(r'#\s')
+HEADING_RE = re.compile(r'^\s*#{1,6}\s+')
+LIST_MARKER_RE = re.compile(r'^\s*(?:[-*+]\s+|\d+[.)、]\s*)')
+PAGE_NUMBER_RE = re.compile(r'(?:\.{2,}|…+|·{2,}|-{2,}|\s{2,}|\t)\s*\d+\s*$')
 
 def read_single_path(path):
     with open(path, 'r', encoding='utf-8') as f:
@@ -13,36 +35,454 @@ def read_single_path(path):
                 return value
     return ""
 
-def split_markdown_by_h1(input_file, output_dir):
+def iter_lines(path, h=None):
+    """
+    Yield (byte offset, line) for each line of path, newline included and
+    translated as a text-mode read would, without loading the whole file;
+    the raw bytes are fed to the hash h if given.
+    """
+    offset = 0
+    with open(path, 'rb') as f:
+        for raw in f:
+            if h is not None:
+                h.update(raw)
+            line = raw.decode('utf-8')
+            if '\r' in line:
+                line = line.replace('\r\n', '\n').replace('\r', '\n')
+                pieces = re.findall(r'[^\n]*\n|[^\n]+', line)
+            else:
+                pieces = (line,)
+            for piece in pieces:
+                yield offset, piece
+            offset += len(raw)
+
+def safe_filename(title):
+    return re.sub(r'[\\/*?:"<>|]', "_", title)
+
+def normalise_title(text):
+    """
+    Strip what OCR and TOC typing vary on: heading and list markers, dot
+    leaders with page numbers, width, case, spaces and punctuation.
+    """
+    text = HEADING_RE.sub('', text)
+    text = PAGE_NUMBER_RE.sub('', text)
+    text = unicodedata.normalize('NFKC', text).lower()
+    return ''.join(ch for ch in text if unicodedata.category(ch)[0] not in 'PZC')
+
+def read_toc(path):
+    """
+    Chapter titles from a UTF-8 TOC file, one per line; a leading list
+    marker or # and a trailing page number are dropped.
+    """
+    titles = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            title = PAGE_NUMBER_RE.sub('', LIST_MARKER_RE.sub('', HEADING_RE.sub('', line))).strip()
+            if title:
+                titles.append(title)
+    return titles
+
+def edit_distance(a, b, limit):
+    """
+    Levenshtein distance between a and b, or limit + 1 once it must exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, start=1):
+        current = [i]
+        for j, cb in enumerate(b, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+class AhoCorasick:
+    """
+    Finds every occurrence of a set of patterns in one pass over a text.
+    """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+        for value, pattern in patterns:
+            state = 0
+            for ch in pattern:
+                if ch not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                    self.goto[state][ch] = len(self.goto) - 1
+                state = self.goto[state][ch]
+            self.out[state].append(value)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(ch, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find(self, text):
+        """
+        The values of all patterns occurring in text.
+        """
+        found = set()
+        state = 0
+        for ch in text:
+            while state and ch not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(ch, 0)
+            found.update(self.out[state])
+        return found
+
+class TitleMatcher:
+    """
+    Matches lines against the normalised TOC titles: exactly, or within one
+    edit per FUZZY_CHARS_PER_ERROR characters. Fuzzy candidates come from an
+    Aho-Corasick automaton over the pieces of each title, since a title with
+    k errors still contains one of its k + 1 pieces unchanged.
+    """
+
+    def __init__(self, titles):
+        self.titles = [normalise_title(title) for title in titles]
+        self.exact = {}
+        pieces = []
+        for index, norm in enumerate(self.titles):
+            if not norm:
+                continue
+            self.exact.setdefault(norm, []).append(index)
+            errors = len(norm) // FUZZY_CHARS_PER_ERROR
+            if errors:
+                size = -(-len(norm) // (errors + 1))
+                pieces.extend((index, norm[i:i + size]) for i in range(0, len(norm), size))
+        self.automaton = AhoCorasick(pieces)
+        self.max_chars = max((len(norm) for norm in self.titles), default=0) + TITLE_SLACK
+        # Raw lines longer than this cannot normalise down to a title.
+        self.max_line = 3 * self.max_chars + 16
+
+    def match(self, norm):
+        """
+        [(toc index, exact)] for the titles the normalised line norm matches.
+        """
+        if not norm or len(norm) > self.max_chars:
+            return []
+        matches = [(index, True) for index in self.exact.get(norm, ())]
+        for index in self.automaton.find(norm):
+            title = self.titles[index]
+            if title != norm and edit_distance(norm, title, len(title) // FUZZY_CHARS_PER_ERROR) <= len(title) // FUZZY_CHARS_PER_ERROR:
+                matches.append((index, False))
+        return matches
+
+def scan_h1(input_file):
+    """
+    Chapter starts at level-1 headings, as the re.split on ^#\\s+ the
+    splitter used to do: a bare '#' line takes its title from the next
+    non-blank line. Returns (chapters, lines, source hash).
+    """
+    chapters = []
+    pending = None
+    h = hashlib.sha256()
+    line_no = 0
+    for offset, line in iter_lines(input_file, h):
+        line_no += 1
+        if pending is not None:
+            if not line.strip():
+                continue
+            if not H1_RE.match(line):
+                pending.update(title=line.strip(), body_line=line_no + 1)
+                pending = None
+                continue
+            pending = None
+        if H1_RE.match(line):
+            chapter = {"title": line[1:].strip(), "start": offset, "line": line_no, "body_line": line_no + 1}
+            chapters.append(chapter)
+            if not chapter["title"]:
+                # re.split's \s+ ran on over the blank lines to the title.
+                chapter["body_line"] = None
+                pending = chapter
+    return chapters, line_no, h.hexdigest()
+
+def scan_toc(input_file, titles):
+    """
+    Find where each TOC title starts a chapter. Every line short enough to
+    be a title is matched on its own and joined with the non-blank line
+    before it (titles OCR'd over two lines); the chapter starts are then the
+    heaviest run of matches in TOC order, weighing markdown headings up and
+    rows of consecutive TOC entries listed close together like the book's
+    own contents page down. A title that also appears as a running head starts
+    its chapter at its first occurrence.
+    Returns (chapters, missing titles, lines, source hash).
+    """
+    matcher = TitleMatcher(titles)
+    candidates = []
+    h = hashlib.sha256()
+    line_no = 0
+    non_blank = 0
+    previous = None
+    for offset, line in iter_lines(input_file, h):
+        line_no += 1
+        if not line.strip():
+            continue
+        non_blank += 1
+        if len(line) > matcher.max_line:
+            # Body text; only the blank-line count matters.
+            previous = None
+            continue
+        norm = normalise_title(line)
+        heading = bool(HEADING_RE.match(line))
+        here = {"start": offset, "line": line_no, "non_blank": non_blank, "heading": heading}
+        matches = matcher.match(norm)
+        for index, exact in matches:
+            candidates.append(dict(here, toc=index, weight=1.0 if exact else 0.8))
+        if previous is not None and not matches:
+            for index, exact in matcher.match(previous[1] + norm):
+                candidates.append(dict(previous[0], toc=index, weight=0.9 if exact else 0.7))
+        previous = (here, norm) if len(norm) <= matcher.max_chars else None
+
+    candidates.sort(key=lambda c: (c["line"], c["toc"]))
+    for i, candidate in enumerate(candidates):
+        if candidate["heading"]:
+            candidate["weight"] += 1.0
+        if _in_contents_block(candidates, i):
+            candidate["weight"] *= 0.25
+
+    chosen = _heaviest_run(candidates, len(titles))
+    chapters = [
+        {"title": titles[c["toc"]], "toc": c["toc"], "start": c["start"], "line": c["line"], "body_line": c["line"]}
+        for c in chosen
+    ]
+    found = {c["toc"] for c in chosen}
+    missing = [title for index, title in enumerate(titles) if index not in found]
+    return chapters, missing, line_no, h.hexdigest()
+
+def _in_contents_block(candidates, i):
+    """
+    Whether candidates[i] is one of at least TOC_BLOCK_MIN matches for
+    consecutive TOC entries, each within TOC_BLOCK_GAP non-blank lines of
+    the one before: entries listed line after line are the book's own
+    contents page. A chapter title that merely follows the contents page,
+    or the previous chapter's running head, is not.
+    """
+    run = 1
+    for step in (-1, 1):
+        k = i
+        while run < TOC_BLOCK_MIN:
+            k = _next_in_block(candidates, k, step)
+            if k is None:
+                break
+            run += 1
+    return run >= TOC_BLOCK_MIN
+
+def _next_in_block(candidates, i, step):
+    """
+    The candidate on a later (step 1) or earlier (step -1) line within
+    TOC_BLOCK_GAP non-blank lines of candidates[i] that matches the next or
+    previous TOC entry, or None.
+    """
+    candidate = candidates[i]
+    j = i + step
+    while 0 <= j < len(candidates):
+        distance = abs(candidates[j]["non_blank"] - candidate["non_blank"])
+        if distance > TOC_BLOCK_GAP:
+            break
+        if distance and candidates[j]["toc"] == candidate["toc"] + step:
+            return j
+        j += step
+    return None
+
+def _heaviest_run(candidates, count):
+    """
+    The subset of candidates (sorted by line) of greatest total weight with
+    both lines and TOC indices strictly increasing, using a Fenwick tree of
+    prefix maxima over TOC indices. Ties go to the earliest lines, so a
+    title repeated as a running head starts its chapter where it first
+    appears. Tree entries are (weight, -candidate) for that.
+    """
+    tree = [(0.0, 1)] * (count + 1)
+    best = []
+    back = []
+    i = 0
+    while i < len(candidates):
+        j = i
+        while j < len(candidates) and candidates[j]["line"] == candidates[i]["line"]:
+            j += 1
+        # Candidates on one line cannot follow each other: query them all first.
+        for k in range(i, j):
+            pos, prior = candidates[k]["toc"], (0.0, 1)
+            while pos > 0:
+                prior = max(prior, tree[pos])
+                pos -= pos & -pos
+            best.append(prior[0] + candidates[k]["weight"])
+            back.append(-prior[1])
+        for k in range(i, j):
+            pos = candidates[k]["toc"] + 1
+            while pos <= count:
+                tree[pos] = max(tree[pos], (best[k], -k))
+                pos += pos & -pos
+        i = j
+    if not best:
+        return []
+    k = max(range(len(best)), key=lambda n: best[n])
+    chosen = []
+    while k != -1:
+        chosen.append(candidates[k])
+        k = back[k]
+    return chosen[::-1]
+
+def _page_range(page_map, start, end):
+    pages = [p for p in page_map["pages"] if p["lines"] and p["start"] < end and p["end"] > start]
+    return (pages[0]["file"], pages[-1]["file"]) if pages else (None, None)
+
+def write_chapters(input_file, output_dir, chapters, rewrite_heading):
+    """
+    Copy each chapter's lines from input_file to its own file in one pass,
+    filling in each chapter's file, end, line count and content hash. With
+    rewrite_heading the heading line is written back as '# title'.
+    """
+    index = 0
+    current = None
+    f = None
+    h = None
+
+    def finish(end, last_line):
+        current["end"] = end
+        current["lines"] = last_line - current["line"] + 1
+        current["hash"] = h.hexdigest()
+        f.close()
+
+    try:
+        line_no = 0
+        offset = 0
+        for offset, line in iter_lines(input_file):
+            line_no += 1
+            if index < len(chapters) and line_no == chapters[index]["line"]:
+                if current is not None:
+                    finish(offset, line_no - 1)
+                current = chapters[index]
+                index += 1
+                current["file"] = f"{index}.{safe_filename(current['title'])}.md"
+                f = open(os.path.join(output_dir, current["file"]), 'w', encoding='utf-8')
+                h = hashlib.sha256()
+                if rewrite_heading:
+                    heading = f"# {current['title']}\n"
+                    f.write(heading)
+                    h.update(heading.encode('utf-8'))
+                    continue
+            # body_line is None for a heading with no title and nothing after it.
+            if current is not None and current["body_line"] is not None and line_no >= current["body_line"]:
+                f.write(line)
+                h.update(line.encode('utf-8'))
+        if current is not None:
+            finish(os.path.getsize(input_file), line_no)
+    finally:
+        if f is not None and not f.closed:
+            f.close()
+    for chapter in chapters:
+        chapter.pop("body_line", None)
+        print(f"Created: {chapter['file']}")
+
+def split_markdown(input_file, output_dir, toc_file=None, manifest_file=None):
+    """
+    Split input_file into 1.<title>.md, 2.<title>.md, ... in output_dir:
+    at level-1 headings, or with toc_file at the lines matching its titles
+    (kept as they are; only the file names come from the TOC). The file is
+    read line by line, once to find the chapters and once to copy them, and
+    a manifest (default <output_dir>/0.split.json) lists each chapter's
+    file, byte range and line range in input_file and content hash for the
+    later stages.
+    """
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
 
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
+    if toc_file:
+        titles = read_toc(toc_file)
+        chapters, missing, lines, source_hash = scan_toc(input_file, titles)
+        print(f"Matched {len(chapters)} of {len(titles)} TOC titles.")
+        for title in missing:
+            print(f"Warning: TOC title not found: {title}")
+    else:
+        chapters, lines, source_hash = scan_h1(input_file)
+        missing = []
+    if not chapters:
+        print(f"No chapters found in {input_file}; nothing written.")
+        return
+
+    write_chapters(input_file, output_dir, chapters, rewrite_heading=not toc_file)
+    if chapters[0]["start"] > 0:
+        print(f"Note: lines 1-{chapters[0]['line'] - 1} before the first chapter are not in any file.")
 
-    # Split by level 1 header "# " at the start of a line
-    parts = re.split(r'^#\s+', content, flags=re.MULTILINE)
+    page_map_file = os.path.join(os.path.dirname(input_file), PAGE_MAP_FILENAME)
+    if os.path.isfile(page_map_file):
+        with open(page_map_file, 'r', encoding='utf-8') as f:
+            page_map = json.load(f)
+        # Offsets only line up with the page map of this very 0.rough.md.
+        if page_map.get("output_hash") == source_hash:
+            for chapter in chapters:
+                chapter["first_page"], chapter["last_page"] = _page_range(page_map, chapter["start"], chapter["end"])
 
-    index = 1
-    for i in range(1, len(parts)):
-        section_content = parts[i]
-        lines = section_content.split('\n', 1)
-        title = lines[0].strip()
-        body = lines[1] if len(lines) > 1 else ""
+    manifest_file = manifest_file or os.path.join(output_dir, DEFAULT_MANIFEST_FILENAME)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "source": os.path.basename(input_file),
+        "source_hash": source_hash,
+        "source_bytes": os.path.getsize(input_file),
+        "source_lines": lines,
+        "mode": "toc" if toc_file else "h1",
+        "missing": missing,
+        "chapters": [dict({"index": n}, **chapter) for n, chapter in enumerate(chapters, start=1)],
+    }
+    part_file = manifest_file + '.part'
+    with open(part_file, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(part_file, manifest_file)
+    print(f"Wrote {len(chapters)} chapters; manifest: {manifest_file}")
 
-        safe_title = re.sub(r'[\\/*?:"<>|]', "_", title)
-        filename = f"{index}.{safe_title}.md"
-        output_path = os.path.join(output_dir, filename)
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
 
-        with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(f"# {title}\n{body}")
 
-        print(f"Created: {filename}")
-        index += 1
+def read_manifest(input_dir, manifest_file=None):
+    """
+    The chapter files listed in the split manifest of input_dir, in order,
+    or None when there is no manifest or it is stale: a chapter file is
+    missing, or the merged file it was split from (looked for next to the
+    manifest, then in input_dir) is gone or has changed since.
+    """
+    manifest_file = manifest_file or os.path.join(input_dir, DEFAULT_MANIFEST_FILENAME)
+    if not os.path.isfile(manifest_file):
+        return None
+    with open(manifest_file, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    files = [chapter["file"] for chapter in manifest["chapters"]]
+    missing = [name for name in files if not os.path.isfile(os.path.join(input_dir, name))]
+    if missing:
+        print(f"Ignoring {manifest_file}: {len(missing)} chapter files are missing (first: {missing[0]}).")
+        return None
+    candidates = [os.path.join(os.path.dirname(manifest_file), manifest["source"]), os.path.join(input_dir, manifest["source"])]
+    source_file = next((path for path in candidates if os.path.isfile(path)), None)
+    if source_file is None:
+        print(f"Ignoring {manifest_file}: cannot find {manifest['source']} to check it against.")
+        return None
+    if os.path.getsize(source_file) != manifest["source_bytes"] or file_hash(source_file) != manifest["source_hash"]:
+        print(f"Ignoring {manifest_file}: {source_file} has changed since it was split.")
+        return None
+    return files
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
-        description="Split merged markdown into multiple files by H1 headings."
+        description="Split merged markdown into multiple files by H1 headings or a table of contents."
     )
     parser.add_argument(
         "--base-dir",
@@ -64,6 +504,16 @@ if __name__ == "__main__":
         default=None,
         help=f"Path to output folder (default: <base-dir>/{DEFAULT_INPUT_DIRNAME}).",
     )
+    parser.add_argument(
+        "--toc-file",
+        default=None,
+        help="UTF-8 text file with one chapter title per line; split where the text matches them instead of at H1 headings.",
+    )
+    parser.add_argument(
+        "--manifest-file",
+        default=None,
+        help=f"Where to write the chapter manifest (default: <output-dir>/{DEFAULT_MANIFEST_FILENAME}).",
+    )
     args = parser.parse_args()
 
     input_file = args.input_file or os.path.join(
@@ -75,4 +525,4 @@ if __name__ == "__main__":
             input_file = input_file_from
     output_dir = args.output_dir or os.path.join(args.base_dir, DEFAULT_INPUT_DIRNAME)
 
-    split_markdown_by_h1(input_file, output_dir)
+    split_markdown(input_file, output_dir, toc_file=args.toc_file, manifest_file=args.manifest_file)
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import re
+import statistics
+import unicodedata
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+from ocr_journal import FINISHED_STATES, OcrJournal, STATE_TEXT_LAYER
+
+REPORT_FILENAME = "text-layer.json"
+
+DEFAULT_MIN_CHARS = 20
+DEFAULT_MAX_GARBAGE = 0.01
+DEFAULT_MAX_IMAGE_COVERAGE = 0.3
+# A book counts as CJK when its median page is at least this CJK; its pages
+# then need the same share, which catches fonts whose ToUnicode maps to junk.
+CJK_BOOK_RATIO = 0.3
+MAX_MOJIBAKE = 0.05
+
+TERMINAL_PUNCT = "。！？…」』”’）)!?.:：;；"
+FOLIO_RE = re.compile(r"^[\s\-–—·]*(\d{1,4}|[ivxlcdm]{1,7})[\s\-–—·]*$", re.IGNORECASE)
+
+
+def _is_cjk(ch):
+    return (
+        "一" <= ch <= "鿿"
+        or "㐀" <= ch <= "䶿"
+        or "぀" <= ch <= "ヿ"
+        or "가" <= ch <= "힯"
+        or "豈" <= ch <= "﫿"
+    )
+
+
+def _is_garbage(ch):
+    if ch == "�":
+        return True
+    return unicodedata.category(ch) in ("Cc", "Co", "Cn", "Cs")
+
+
+def _image_coverage(page):
+    left, bottom, right, top = page.get_cropbox()
+    page_area = (right - left) * (top - bottom)
+    if page_area <= 0:
+        return 0.0
+    covered = 0.0
+    for obj in page.get_objects():
+        if obj.type != pdfium_c.FPDF_PAGEOBJ_IMAGE:
+            continue
+        o_left, o_bottom, o_right, o_top = obj.get_bounds()
+        w = max(0.0, min(o_right, right) - max(o_left, left))
+        h = max(0.0, min(o_top, top) - max(o_bottom, bottom))
+        covered += w * h
+    return min(1.0, covered / page_area)
+
+
+def score_text(text):
+    """
+    Quality statistics for a page's text layer.
+    """
+    chars = [ch for ch in text if not ch.isspace()]
+    n = len(chars)
+    if not n:
+        return {"chars": 0, "garbage_ratio": 0.0, "cjk_ratio": 0.0, "mojibake_ratio": 0.0}
+    garbage = sum(1 for ch in chars if _is_garbage(ch))
+    cjk = sum(1 for ch in chars if _is_cjk(ch))
+    # Latin-1 letters are what a CJK font without a usable ToUnicode map decodes to.
+    mojibake = sum(1 for ch in chars if "À" <= ch <= "ÿ")
+    return {
+        "chars": n,
+        "garbage_ratio": round(garbage / n, 4),
+        "cjk_ratio": round(cjk / n, 4),
+        "mojibake_ratio": round(mojibake / n, 4),
+    }
+
+
+def _join_lines(prev, line):
+    if prev.endswith("-") and line[:1].islower():
+        return prev[:-1] + line
+    if _is_cjk(prev[-1:]) or _is_cjk(line[:1]) or unicodedata.east_asian_width(prev[-1:] or " ") in ("F", "W"):
+        return prev + line
+    return prev + " " + line
+
+
+def text_to_markdown(text):
+    """
+    Rebuild paragraphs from a text layer in the per-page format ocr_prompt.md
+    asks for: paragraphs separated by one blank line, indented paragraph
+    starts prefixed with two spaces, and a continued paragraph at the top of
+    the page left unindented. Bare page numbers are dropped.
+    """
+    lines = [line.rstrip() for line in text.replace("\r\n", "\n").replace("\r", "\n").split("\n")]
+    lines = [line for line in lines if not FOLIO_RE.match(line)]
+    widths = [len(line.strip()) for line in lines if line.strip()]
+    full_width = max(widths) if widths else 0
+
+    paragraphs = []
+    current = None
+    prev_short_end = False
+    for line in lines:
+        stripped = line.strip().replace("　", "")
+        if not stripped:
+            if current is not None:
+                paragraphs.append(current)
+                current = None
+            continue
+        indented = line[:1] in (" ", "　", "\t")
+        if current is None or indented or prev_short_end:
+            if current is not None:
+                paragraphs.append(current)
+            current = ("  " if indented else "") + stripped
+        else:
+            current = _join_lines(current, stripped)
+        prev_short_end = stripped[-1] in TERMINAL_PUNCT and len(stripped) < 0.85 * full_width
+    if current is not None:
+        paragraphs.append(current)
+    return "\n\n".join(paragraphs)
+
+
+def _passes(stats, cjk_book, min_chars, max_garbage, max_image_coverage):
+    if stats["chars"] < min_chars:
+        return False, "too few characters"
+    if stats["garbage_ratio"] > max_garbage:
+        return False, "unmapped glyphs"
+    if stats["image_coverage"] > max_image_coverage:
+        return False, "large images"
+    if cjk_book and (stats["cjk_ratio"] < CJK_BOOK_RATIO or stats["mojibake_ratio"] > MAX_MOJIBAKE):
+        return False, "not CJK in a CJK book"
+    return True, ""
+
+
+def extract_text_layer(
+    pdf_path,
+    output_dir,
+    start_index=0,
+    first_page=None,
+    last_page=None,
+    min_chars=DEFAULT_MIN_CHARS,
+    max_garbage=DEFAULT_MAX_GARBAGE,
+    max_image_coverage=DEFAULT_MAX_IMAGE_COVERAGE,
+    force=False,
+    dry_run=False,
+):
+    """
+    Write N.md for every page whose text layer passes the quality checks and
+    record it in the OCR journal as text-layer, so ocr.py only sends the
+    remaining pages to the vision model. Only PDF pages first_page..last_page
+    (0-based, inclusive; default all) are looked at. Pages the journal
+    already has as finished are left alone unless force is set. Returns the
+    per-page report.
+
+    The text is only rebuilt into paragraphs: running heads stay, and there
+    are no #/## headings or <sup> footnotes as ocr_prompt.md asks for.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pdf = pdfium.PdfDocument(pdf_path)
+    first = 0 if first_page is None else max(0, first_page)
+    last = len(pdf) - 1 if last_page is None else min(len(pdf) - 1, last_page)
+    pages = []
+    for i in range(first, last + 1):
+        page = pdf[i]
+        textpage = page.get_textpage()
+        text = textpage.get_text_range()
+        textpage.close()
+        stats = score_text(text)
+        stats["image_coverage"] = round(_image_coverage(page), 4)
+        page.close()
+        pages.append((str(start_index + i), text, stats))
+    pdf.close()
+
+    cjk_ratios = [stats["cjk_ratio"] for _, _, stats in pages if stats["chars"] >= min_chars]
+    cjk_book = bool(cjk_ratios) and statistics.median(cjk_ratios) >= CJK_BOOK_RATIO
+
+    journal = OcrJournal(output_dir)
+    journal.import_existing_outputs()
+    finished = {page for page, state in journal.states().items() if state in FINISHED_STATES}
+    report = []
+    written = 0
+    for name, text, stats in pages:
+        ok, reason = _passes(stats, cjk_book, min_chars, max_garbage, max_image_coverage)
+        entry = dict(page=name, accepted=ok, reason=reason, **stats)
+        if ok and name in finished and not force:
+            entry["reason"] = "already done"
+        elif ok and not dry_run:
+            markdown = text_to_markdown(text)
+            with open(os.path.join(output_dir, f"{name}.md"), "w", encoding="utf-8") as f:
+                f.write(markdown)
+            journal.finish(name, STATE_TEXT_LAYER, 0.0, markdown)
+            written += 1
+        report.append(entry)
+    journal.close()
+
+    if not dry_run:
+        with open(os.path.join(output_dir, REPORT_FILENAME), "w", encoding="utf-8") as f:
+            json.dump({"cjk_book": cjk_book, "pages": report}, f, ensure_ascii=False, indent=2)
+
+    accepted = sum(1 for entry in report if entry["accepted"])
+    print(
+        f"Text layer: {accepted} of {len(report)} pages usable, {written} written, "
+        f"{len(report) - accepted} left for OCR."
+    )
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write ocr-result/N.md from the PDF text layer for pages that do not need OCR."
+    )
+    parser.add_argument("input_pdf", help="Path to input PDF.")
+    parser.add_argument("output_dir", help="OCR output folder (usually <book>/ocr-result).")
+    parser.add_argument("--start", type=int, default=0, help="Starting index for filenames (default: 0).")
+    parser.add_argument(
+        "--first-page",
+        type=int,
+        default=None,
+        help="First PDF page to look at, 0-based (default: the first).",
+    )
+    parser.add_argument(
+        "--last-page",
+        type=int,
+        default=None,
+        help="Last PDF page to look at, 0-based and inclusive (default: the last).",
+    )
+    parser.add_argument(
+        "--min-chars",
+        type=int,
+        default=DEFAULT_MIN_CHARS,
+        help=f"Minimum non-space characters for a page to be used (default: {DEFAULT_MIN_CHARS}).",
+    )
+    parser.add_argument(
+        "--max-garbage",
+        type=float,
+        default=DEFAULT_MAX_GARBAGE,
+        help=f"Maximum share of unmapped/control characters (default: {DEFAULT_MAX_GARBAGE}).",
+    )
+    parser.add_argument(
+        "--max-image-coverage",
+        type=float,
+        default=DEFAULT_MAX_IMAGE_COVERAGE,
+        help=f"Maximum share of the page covered by images (default: {DEFAULT_MAX_IMAGE_COVERAGE}).",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Overwrite pages the OCR journal already has as finished.",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only score the pages; write nothing.",
+    )
+    args = parser.parse_args()
+
+    extract_text_layer(
+        args.input_pdf,
+        args.output_dir,
+        start_index=args.start,
+        first_page=args.first_page,
+        last_page=args.last_page,
+        min_chars=args.min_chars,
+        max_garbage=args.max_garbage,
+        max_image_coverage=args.max_image_coverage,
+        force=args.force,
+        dry_run=args.dry_run,
+    )
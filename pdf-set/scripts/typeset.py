@@ -3,17 +3,90 @@ import argparse
 import os
 import re
 
+from split import read_manifest
+
 DEFAULT_INPUT_DIRNAME = 'merge-result'
 DEFAULT_OUTPUT_DIRNAME = 'typeset-result'
+# Longest repeated Chinese word (in characters) collapsed by dedupe_words;
+# a run twice this long is deduplicated exactly as an unbounded match would.
+MAX_REPEAT = 100
+# Runs of Chinese characters too long for the backtracking regex.
+LONG_CJK_RUN_RE = re.compile(r'([\u4e00-\u9fa5]{%d,})' % (2 * MAX_REPEAT + 1))
+CJK_WORD_REPEAT_RE = re.compile(r'([\u4e00-\u9fa5]{2,})\1+')
+
+def _dedupe_run(run):
+    """
+    Collapse doubled words in a run of Chinese characters the way
+    re.sub(r'([\u4e00-\u9fa5]{2,})\1+', r'\1', run) does - at each position
+    the longest word that is immediately repeated, then all its repeats -
+    for words up to MAX_REPEAT characters. A word repeated at distance L
+    starts with a two-character pair seen again L characters on, so only
+    positions whose pair recurs within MAX_REPEAT are tried, found by
+    chaining each pair to its next occurrence.
+    """
+    n = len(run)
+    following = [0] * n
+    last_seen = {}
+    hot = []
+    for i in range(n - 2, -1, -1):
+        pair = run[i:i + 2]
+        j = last_seen.get(pair, 0)
+        following[i] = j
+        last_seen[pair] = i
+        if j == i + 1:
+            # Overlapping pair (as in 太太太); the next one apart is further on.
+            j = following[j]
+        if j and j - i <= MAX_REPEAT and j - i <= (n - i) // 2:
+            hot.append(i)
+    if not hot:
+        return run
+    hot.reverse()
+
+    out = []
+    done = 0
+    for p in hot:
+        if p < done:
+            continue
+        limit = min(MAX_REPEAT, (n - p) // 2)
+        lengths = []
+        j = following[p]
+        while j and j - p <= limit:
+            if j - p >= 2:
+                lengths.append(j - p)
+            j = following[j]
+        for length in reversed(lengths):
+            word = run[p:p + length]
+            if run.startswith(word, p + length):
+                end = p + 2 * length
+                while run.startswith(word, end):
+                    end += length
+                out.append(run[done:p + length])
+                done = end
+                break
+    if not out:
+        return run
+    out.append(run[done:])
+    return "".join(out)
+
+def dedupe_words(text):
+    """
+    Collapse repeated Chinese words like "已经已经" in time linear in the
+    text: the regex only sees runs of at most 2 * MAX_REPEAT characters,
+    where its backtracking stays bounded, and longer runs are scanned.
+    """
+    parts = LONG_CJK_RUN_RE.split(text)
+    # re.split puts the long runs at the odd indices.
+    return "".join(
+        _dedupe_run(part) if i % 2 else CJK_WORD_REPEAT_RE.sub(r'\1', part)
+        for i, part in enumerate(parts)
+    )
 
 def cleanup_text(text):
     """Clean up OCR artifacts like repeated Chinese words/characters and footnote newlines."""
     # Dedupe for Chinese words (2+ characters) like "已经已经"
-    text = re.sub(r'([\u4e00-\u9fa5]{2,})\1+', r'\1', text)
+    text = dedupe_words(text)
     # Dedupe for 3+ repeated Chinese characters (e.g., "太太太" -> "太太")
     text = re.sub(r'([\u4e00-\u9fa5])\1{2,}', r'\1\1', text)
-    # Dedupe for English/word-boundary repeating sequences
-    text = re.sub(r'(\b\w+\b)\1+', r'\1', text)
     
     # New Rule: Remove all newlines and multiple spaces within <sup>...</sup>
     def clean_footnote(match):
@@ -122,11 +195,12 @@ def read_file_list(path):
         lines = [line.strip() for line in f.readlines()]
     return [line for line in lines if line and line != '0.rough.md']
 
-def match_by_indices(input_dir, indices):
+def match_by_indices(input_dir, indices, chapter_files=None):
     matched = []
+    filenames = chapter_files if chapter_files is not None else os.listdir(input_dir)
     for index in indices:
         prefix = f"{index}."
-        for filename in os.listdir(input_dir):
+        for filename in filenames:
             if (
                 filename.startswith(prefix)
                 and filename.endswith('.md')
@@ -136,13 +210,17 @@ def match_by_indices(input_dir, indices):
                 break
     return matched
 
-def collect_input_files(input_dir, filenames, files_from, file_indices):
+def collect_input_files(input_dir, filenames, files_from, file_indices, use_manifest=True):
+    # The chapters split.py wrote, in order, rather than whatever .md files are lying around.
+    chapter_files = read_manifest(input_dir) if use_manifest else None
     if files_from:
         return read_file_list(files_from)
     if file_indices:
-        return match_by_indices(input_dir, file_indices)
+        return match_by_indices(input_dir, file_indices, chapter_files)
     if filenames:
         return [f for f in filenames if f != '0.rough.md']
+    if chapter_files is not None:
+        return chapter_files
     return sorted(
         f for f in os.listdir(input_dir)
         if f.endswith('.md') and f != '0.rough.md'
@@ -185,6 +263,11 @@ if __name__ == "__main__":
         default=None,
         help="Optional list of numeric prefixes to match files like 1.xxx.md, 2.xxx.md.",
     )
+    parser.add_argument(
+        "--no-manifest",
+        action="store_true",
+        help="Ignore the chapter manifest (0.split.json) written by split.py and list the input folder instead.",
+    )
     args = parser.parse_args()
 
     input_dir = args.input_dir or os.path.join(args.base_dir, DEFAULT_INPUT_DIRNAME)
@@ -198,6 +281,7 @@ if __name__ == "__main__":
         args.files,
         args.files_from,
         args.file_indices,
+        use_manifest=not args.no_manifest,
     )
 
     for filename in files_to_process:
@@ -0,0 +1,123 @@
+import io
+
+from PIL import Image
+
+from precheck_images import ink_mask, paper_level
+
+DEFAULT_MAX_EDGE = 1600
+DEFAULT_MAX_KB = 300
+DEFAULT_FORMAT = "jpeg"
+MARGIN_PAD = 0.02
+MIN_QUALITY = 35
+MAX_QUALITY = 85
+# Grey levels this close to the paper are turned white before encoding.
+PAPER_TOLERANCE = 25
+
+_MIME_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+
+def sniff_mime_type(data):
+    """
+    MIME type from the image's magic bytes, or None when it is not a format
+    the API accepts.
+    """
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if data[:2] == b"BM":
+        return "image/bmp"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return None
+
+
+def _whiten_paper(gray):
+    """
+    Stretch levels so the paper becomes pure white. Paper texture and scan
+    noise are most of a scan's JPEG size and carry nothing the OCR needs.
+    """
+    white = paper_level(gray) - PAPER_TOLERANCE
+    if white <= 0:
+        return gray
+    return gray.point(lambda v: 255 if v >= white else v * 255 // white)
+
+
+def _trim_margins(image):
+    gray = image if image.mode == "L" else image.convert("L")
+    bbox = ink_mask(gray).getbbox()
+    if not bbox:
+        return image
+    w, h = image.size
+    pad_x, pad_y = int(w * MARGIN_PAD), int(h * MARGIN_PAD)
+    left, top, right, bottom = bbox
+    return image.crop((max(0, left - pad_x), max(0, top - pad_y), min(w, right + pad_x), min(h, bottom + pad_y)))
+
+
+def _encode(image, fmt, quality):
+    buf = io.BytesIO()
+    image.save(buf, format=fmt.upper(), quality=quality)
+    return buf.getvalue()
+
+
+def _fit_budget(image, fmt, max_bytes):
+    """
+    Encode at the highest quality that fits max_bytes, found by bisection;
+    falls back to MIN_QUALITY when nothing fits.
+    """
+    data = _encode(image, fmt, MAX_QUALITY)
+    if len(data) <= max_bytes:
+        return data
+    best = None
+    low, high = MIN_QUALITY, MAX_QUALITY - 1
+    while low <= high:
+        quality = (low + high) // 2
+        candidate = _encode(image, fmt, quality)
+        if len(candidate) <= max_bytes:
+            best = candidate
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best if best is not None else _encode(image, fmt, MIN_QUALITY)
+
+
+def prepare_upload(
+    data,
+    grayscale=True,
+    trim=True,
+    max_edge=DEFAULT_MAX_EDGE,
+    max_kb=DEFAULT_MAX_KB,
+    fmt=DEFAULT_FORMAT,
+):
+    """
+    Shrink a page image for upload: optional grayscale, margins trimmed to the
+    inked area, long edge capped at max_edge, then JPEG/WebP quality chosen to
+    stay under max_kb. Grayscale pages also get their paper whitened. The
+    original is kept when it is already within budget and smaller than the
+    result. Returns (bytes, mime_type).
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft("L" if grayscale else "RGB", (max_edge, max_edge))
+    image = image.convert("L" if grayscale else "RGB")
+    if trim:
+        image = _trim_margins(image)
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    if grayscale:
+        image = _whiten_paper(image)
+    prepared = _fit_budget(image, fmt, max_kb * 1024)
+    original_mime = sniff_mime_type(data)
+    if original_mime and len(data) <= min(len(prepared), max_kb * 1024):
+        return data, original_mime
+    return prepared, _MIME_TYPES[fmt]
+
+
+def settings_key(grayscale, trim, max_edge, max_kb, fmt):
+    """
+    Text identifying the preprocessing settings, for cache keys.
+    """
+    return f"prep:gray={int(grayscale)}:trim={int(trim)}:edge={max_edge}:kb={max_kb}:fmt={fmt}"